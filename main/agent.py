@@ -1,42 +1,117 @@
+import asyncio
 import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 from plotly.graph_objs import Figure
 
-from prompts import system_prompt
-from tools import query_sql, visualize_data
+import tracing
+from db import DEFAULT_DB
+from llm_cache import completion_key, data_fingerprint, llm_cache
+from prompts import system_messages
+from result_shaping import shape_result
+from router import FastPathRouter
+from tools import query_deadline, query_sql, visualize_data
 from tool_schema import TOOLS_SCHEMA
 from utils import is_valid_client_id
 
+logger = logging.getLogger(__name__)
+
+# Used for models missing from `Agent.model_config`
+DEFAULT_MODEL_SETTINGS = {"temperature": 0.6, "cache": False}
+
 class Agent:
-    def __init__(self, Model, VectorStore):
+    def __init__(self, Model, VectorStore, model_config=None):
         self.client = Model.client
+        self.async_client = getattr(Model, "async_client", None)
         self.vector_store = VectorStore
+        self.db_path = getattr(VectorStore, "db_path", DEFAULT_DB)
         self.tools = {
             "query_sql": query_sql,
             "visualize_data": visualize_data
             }
         self.top_k = 50
         self.history_limit = 8
-        self.last_result = None
-        self.chart = None
+        # Positive values cap the ranked merchant / keyword lists sent in the prompt
+        self.max_prompt_merchants = int(os.getenv("PROMPT_MAX_MERCHANTS", "0"))
+        self.max_prompt_keywords = int(os.getenv("PROMPT_MAX_KEYWORDS", "0"))
+        # Answers simple single-filter questions without the LLM
+        self.router = None
+        if os.getenv("FAST_PATH_ROUTER", "1") == "1":
+            self.router = FastPathRouter(self.db_path)
+        # Model name -> {"temperature", "cache"}; replies are cached only at temperature 0
+        self.model_config = model_config or {}
+        self.llm_cache = llm_cache
+        # Query results go to the model as capped CSV with summary stats instead of dict reprs
+        self.shape_results = os.getenv("TOOL_RESULT_SHAPING", "1") == "1"
+        # Shared by all conversations, so concurrent queries stay within the SQLite pool
+        self.tool_timeout = float(os.getenv("TOOL_TIMEOUT", "30"))
+        self.tool_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("TOOL_WORKERS", "4")),
+            thread_name_prefix="agent-tool"
+        )
 
-    def call_model(self, context, merchants, descriptions, today, model_name):
+    def build_messages(self, context, merchants, descriptions, today):
         """
-        Calls the model with the given context, merchants, descriptions, today, and model name.
+        Prepends the system prompt to the conversation: the static prompt, identical for every
+        request so providers can cache it, then the per-question suffix, rendered once per chat.
         """
-        query = context["messages"]
-        messages = [{"role": "system", "content": system_prompt(merchants, descriptions, today)}] + query
-        try:
-            response = self.client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                temperature=0.6,
-                tools=TOOLS_SCHEMA
+        if context.get("system") is None:
+            context["system"] = system_messages(
+                merchants, descriptions, today, self.max_prompt_merchants, self.max_prompt_keywords
             )
-        except Exception as e:
-            context["messages"].append({"role": "assistant", "content": f"Model error: {e}"})
-            return context
+        return context["system"] + context["messages"]
 
-        reply = response.choices[0].message
+    def log_usage(self, context, usage, model_name):
+        """
+        Logs and records the token usage of one completion.
+        """
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details else None
+        tracing.annotate(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        context.setdefault("usage", []).append({
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": cached,
+        })
+        logger.info(
+            "LLM call (model %s): %s prompt tokens (%s cached), %s completion tokens",
+            model_name, usage.prompt_tokens, cached if cached is not None else "n/a", usage.completion_tokens
+        )
+
+    def model_settings(self, model_name):
+        return {**DEFAULT_MODEL_SETTINGS, **self.model_config.get(model_name, {})}
+
+    def cached_reply(self, messages, model_name, settings):
+        """
+        Looks the request up in the completion cache. Returns (key, reply); the key is None when
+        the request may not be cached, and the reply None on a miss.
+        """
+        if self.llm_cache is None or not settings["cache"] or settings["temperature"] != 0:
+            return None, None
+        with tracing.span("llm_cache_lookup", model=model_name) as span:
+            try:
+                version = data_fingerprint(self.db_path)
+            except sqlite3.Error:
+                return None, None
+            key = completion_key(model_name, messages, TOOLS_SCHEMA, settings["temperature"], version)
+            cached = self.llm_cache.get(key)
+            span.set(hit=cached is not None)
+        if cached is None:
+            return key, None
+        logger.info("LLM cache hit (model %s)", model_name)
+        return key, ChatCompletionMessage.model_validate(cached)
+
+    def handle_reply(self, context, reply):
+        """
+        Appends the model reply (tool calls or content) to the conversation.
+        """
         # Return error if the tool call is being manually added to the content
         if reply.content and ("<tool_call" in reply.content or "<function" in reply.content):
             context["messages"].append({
@@ -44,7 +119,7 @@ class Agent:
                 "content": "Error: Detected invalid manual tool call formatting. Please try rephrasing."
             })
             return context
-        print("Debug: ", reply)
+        logger.debug("Model reply: %s", reply)
         if reply.tool_calls:
             context["messages"].append({"role": reply.role, "tool_calls": [tc.model_dump() for tc in reply.tool_calls]})
         elif reply.content:
@@ -52,6 +127,126 @@ class Agent:
 
         return context
 
+    def call_model(self, context, merchants, descriptions, today, model_name):
+        """
+        Calls the model with the given context, merchants, descriptions, today, and model name.
+        """
+        messages = self.build_messages(context, merchants, descriptions, today)
+        settings = self.model_settings(model_name)
+        key, cached = self.cached_reply(messages, model_name, settings)
+        if cached is not None:
+            return self.handle_reply(context, cached)
+        with tracing.span("llm_call", model=model_name, messages=len(messages)):
+            try:
+                response = self.client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    temperature=settings["temperature"],
+                    tools=TOOLS_SCHEMA
+                )
+            except Exception as e:
+                context["messages"].append({"role": "assistant", "content": f"Model error: {e}"})
+                tracing.annotate(error=str(e))
+                return context
+            self.log_usage(context, response.usage, model_name)
+        reply = response.choices[0].message
+        if key:
+            self.llm_cache.put(key, reply.model_dump(mode="json"))
+        return self.handle_reply(context, reply)
+
+    async def acall_model(self, context, merchants, descriptions, today, model_name):
+        """
+        Async `call_model`: awaits the completion on the shared async client.
+        """
+        messages = self.build_messages(context, merchants, descriptions, today)
+        settings = self.model_settings(model_name)
+        key, cached = await asyncio.to_thread(self.cached_reply, messages, model_name, settings)
+        if cached is not None:
+            return self.handle_reply(context, cached)
+        with tracing.span("llm_call", model=model_name, messages=len(messages)):
+            try:
+                response = await self.async_client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    temperature=settings["temperature"],
+                    tools=TOOLS_SCHEMA
+                )
+            except Exception as e:
+                context["messages"].append({"role": "assistant", "content": f"Model error: {e}"})
+                tracing.annotate(error=str(e))
+                return context
+            self.log_usage(context, response.usage, model_name)
+        reply = response.choices[0].message
+        if key:
+            await asyncio.to_thread(self.llm_cache.put, key, reply.model_dump(mode="json"))
+        return self.handle_reply(context, reply)
+
+    def stream_model(self, context, merchants, descriptions, today, model_name):
+        """
+        Streaming `call_model`: yields {"type": "token", "text": ...} for each content delta and,
+        once the stream ends, appends the same reply to the conversation as `call_model` would.
+        """
+        messages = self.build_messages(context, merchants, descriptions, today)
+        settings = self.model_settings(model_name)
+        key, cached = self.cached_reply(messages, model_name, settings)
+        if cached is not None:
+            if cached.content:
+                yield {"type": "token", "text": cached.content}
+            self.handle_reply(context, cached)
+            return
+        content = []
+        tool_calls = {}
+        role = "assistant"
+        with tracing.span("llm_call", model=model_name, messages=len(messages), stream=True):
+            try:
+                stream = self.client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    temperature=settings["temperature"],
+                    tools=TOOLS_SCHEMA,
+                    stream=True
+                )
+                for chunk in stream:
+                    # Providers that report usage on streams send it with the last chunk
+                    if getattr(chunk, "usage", None):
+                        self.log_usage(context, chunk.usage, model_name)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    role = delta.role or role
+                    if delta.content:
+                        content.append(delta.content)
+                        yield {"type": "token", "text": delta.content}
+                    # Tool call names and arguments arrive in pieces, keyed by the call's index
+                    for part in delta.tool_calls or []:
+                        call = tool_calls.setdefault(part.index, {"id": None, "name": "", "arguments": ""})
+                        if part.id:
+                            call["id"] = part.id
+                        if part.function and part.function.name:
+                            call["name"] += part.function.name
+                        if part.function and part.function.arguments:
+                            call["arguments"] += part.function.arguments
+            except Exception as e:
+                context["messages"].append({"role": "assistant", "content": f"Model error: {e}"})
+                tracing.annotate(error=str(e))
+                return
+
+        reply = ChatCompletionMessage(
+            role=role,
+            content="".join(content) or None,
+            tool_calls=[
+                ChatCompletionMessageToolCall(
+                    id=call["id"] or f"call_{index}",
+                    type="function",
+                    function=Function(name=call["name"], arguments=call["arguments"])
+                )
+                for index, call in sorted(tool_calls.items())
+            ] or None
+        )
+        if key:
+            self.llm_cache.put(key, reply.model_dump(mode="json"))
+        self.handle_reply(context, reply)
+
     def should_continue(self, context):
         """
         Determines if the conversation should continue.
@@ -81,9 +276,28 @@ class Agent:
         else:
             return "end"
     
+    def run_tool(self, tool_name, tool_func, tool_args, timeout=None):
+        """
+        Runs one tool call. With `timeout`, SQLite statements are interrupted once that many
+        seconds have passed since the call started.
+        """
+        with tracing.span(f"tool.{tool_name}") as span, query_deadline(timeout):
+            result = tool_func(**tool_args)
+            if isinstance(result, dict):
+                span.set(rows=len(result.get("rows") or []))
+                if "error" in result:
+                    span.set(error=result["error"])
+        return result
+
     def tool_node(self, context, client_id):
         """
-        Executes the tool calls.
+        Executes the tool calls. `query_sql` calls are independent and run concurrently on the
+        tool pool; results are appended in the order the model asked for them. `visualize_data`
+        depends on the `query_sql` before it, so it runs once that result is in. A query still
+        running `tool_timeout` seconds after its worker picked it up is interrupted in SQLite,
+        which frees the worker and the pooled connection, and reported as an error. Waiting for a
+        result is also capped at `tool_timeout` seconds from the start of the turn, which bounds
+        time spent queued for a worker or a connection and work outside SQLite.
         """
         last_msg = context["messages"][-1]
         tool_calls = None
@@ -93,7 +307,10 @@ class Agent:
             tool_calls = getattr(last_msg, "tool_calls", None)
         if not tool_calls:
             return context
-        # Loop over available tool calls
+
+        # Parse every call and start the queries before collecting any result
+        deadline = time.monotonic() + self.tool_timeout if self.tool_timeout else None
+        planned = []
         for tool_call in tool_calls:
             if isinstance(tool_call, dict):
                 tool_name = tool_call.get("function", {}).get("name")
@@ -103,75 +320,233 @@ class Agent:
                 tool_args = tool_call.function.arguments
             # Return error if the tool is not registered
             if not tool_name:
-                context["messages"].append({"role": "function", "name": tool_name, "content": "Invalid tool call"})
+                planned.append((tool_name, None, "Invalid tool call"))
                 continue
             try:
                 tool_args = json.loads(tool_args) if isinstance(tool_args, str) else tool_args
-                tool_func = self.tools.get(tool_name)
-                if not tool_func:
-                    context["messages"].append({"role": "function", "name": tool_name, "content": "Tool not found"})
+                if not isinstance(tool_args, dict):
+                    raise ValueError("arguments must be a JSON object")
+            except Exception as e:
+                planned.append((tool_name, None, f"Tool error: {e}"))
+                continue
+            tool_func = self.tools.get(tool_name)
+            if not tool_func:
+                planned.append((tool_name, None, "Tool not found"))
+                continue
+            if tool_name == "query_sql":
+                tool_args["client_id"] = str(client_id) # Add client_id to the tool arguments
+                try:
+                    future = self.tool_executor.submit(
+                        tracing.bind(self.run_tool), tool_name, tool_func, tool_args, self.tool_timeout
+                    )
+                except Exception as e:
+                    planned.append((tool_name, None, f"Tool error: {e}"))
                     continue
-                
+                planned.append((tool_name, future, None))
+            else:
+                planned.append((tool_name, tool_args, None))
+
+        for tool_name, tool_args, error in planned:
+            if error:
+                context["messages"].append({"role": "function", "name": tool_name, "content": error})
+                continue
+            try:
                 if tool_name == "query_sql":
-                    tool_args["client_id"] = str(client_id) # Add client_id to the tool arguments
-                    result = tool_func(**tool_args)
-                    self.last_result = result
-                    context["messages"].append({"role": "function", "name": tool_name, "content": str(result)})
+                    try:
+                        result = tool_args.result(
+                            timeout=max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                        )
+                    except FutureTimeoutError:
+                        # Reported like a statement the worker interrupted; a queued call never starts
+                        tool_args.cancel()
+                        result = {"error": "Query timed out"}
+                    # The chart tool draws from the full result; the model gets the shaped one
+                    context["last_result"] = result
+                    content = shape_result(result) if self.shape_results else str(result)
+                    context["messages"].append({"role": "function", "name": tool_name, "content": content})
 
                 elif tool_name == "visualize_data":
-                    if self.last_result:
+                    if context.get("last_result"):
                         allowed_keys = ["chart_type", "x", "y", "title"]
                         tool_args = {k: v for k, v in tool_args.items() if k in allowed_keys} # Avoid extra arguments
-                        tool_args["data"] = self.last_result
-                        result = tool_func(**tool_args)
+                        tool_args["data"] = context["last_result"]
+                        result = self.run_tool(tool_name, self.tools[tool_name], tool_args)
                         if isinstance(result, Figure):
                             context["messages"].append({"role": "function", "name": tool_name, "content": "Chart generated"})
-                            self.chart = result
+                            context["chart"] = result
                         else:
                             context["messages"].append({"role": "function", "name": tool_name, "content": "Error: Chart not generated."})
                     else:
                         context["messages"].append({"role": "function", "name": tool_name, "content": "Error: No data to visualize."})
 
             except Exception as e:
+                if tool_name == "query_sql":
+                    context["last_result"] = None
                 context["messages"].append({"role": "function", "name": tool_name, "content": f"Tool error: {e}"})
                 continue
         return context
     
-    def chat(self, query, client_id, today, message_history=None, model_name=None):
+    def fast_path(self, query, client_id, today):
         """
-        Main function to start the conversation.
+        The router's templated answer, or None when the question needs the LLM.
+        """
+        if self.router is None:
+            return None
+        with tracing.span("fast_path") as span:
+            routed = self.router.answer(query, client_id, today)
+            span.set(routed=routed is not None)
+        return routed
+
+    def check_client(self, client_id):
+        with tracing.span("validate_client"):
+            return is_valid_client_id(client_id)
+
+    def retrieve(self, query, client_id):
+        """
+        Merchant candidates and description keywords for the prompt.
+        """
+        with tracing.span("retrieval") as span:
+            merchants, descriptions = self.vector_store.get_unique_merchants_and_descriptions(query, client_id, self.top_k)
+            span.set(merchants=len(merchants), keywords=len(descriptions))
+        return merchants, descriptions
+
+    def new_context(self, query, message_history=None):
+        """
+        Per-conversation state: the trimmed history plus the new question, and the last
+        query result and chart produced while answering it.
         """
-        if not is_valid_client_id(client_id):
-            return {"content": "Client ID does not exist.", "chart": None}
         if message_history:
             trimmed_history = [m for m in message_history if m["role"] in ["user", "assistant"]][-self.history_limit:]
         else:
             trimmed_history = []
-        context = {
+        return {
             "messages": trimmed_history + [{"role": "user", "content": query}],
             "state": "call_model",
+            "last_result": None,
+            "chart": None,
+            "system": None,
         }
-        # Get unique merchants and descriptions from the vector store
-        merchants, descriptions = self.vector_store.get_unique_merchants_and_descriptions(query, client_id, self.top_k)
-
-        while context["state"] != "end":
-            if context["state"] == "call_model":
-                context = self.call_model(context, merchants, descriptions, today, model_name)
-            elif context["state"] == "tools":
-                context = self.tool_node(context, client_id)
-            else:
-                break
-
-            context["state"] = self.should_continue(context)
 
+    def final_response(self, context):
         last_msg = context["messages"][-1]
 
         if isinstance(last_msg, dict):
             content = last_msg.get("content", "")
         else:
             content = last_msg.content
-        chart = self.chart
-        self.chart = None # Delete the class variable so it doesn't get displayed again
-        return {"content": content,"chart": chart}
+        return {"content": content, "chart": context["chart"]}
+
+    def chat(self, query, client_id, today, message_history=None, model_name=None):
+        """
+        Main function to start the conversation.
+        """
+        with tracing.span("chat", model=model_name):
+            if not self.check_client(client_id):
+                return {"content": "Client ID does not exist.", "chart": None}
+            routed = self.fast_path(query, client_id, today)
+            if routed is not None:
+                return {"content": routed["content"], "chart": None}
+            context = self.new_context(query, message_history)
+            # Get unique merchants and descriptions from the vector store
+            merchants, descriptions = self.retrieve(query, client_id)
+
+            while context["state"] != "end":
+                if context["state"] == "call_model":
+                    context = self.call_model(context, merchants, descriptions, today, model_name)
+                elif context["state"] == "tools":
+                    context = self.tool_node(context, client_id)
+                else:
+                    break
+
+                context["state"] = self.should_continue(context)
+
+            return self.final_response(context)
+
+    async def achat(self, query, client_id, today, message_history=None, model_name=None):
+        """
+        Async `chat`. The client check, the fast path and retrieval run concurrently on worker
+        threads; retrieval's result is dropped when the client is unknown or the fast path answers.
+        The model is awaited on the async client and tools run on worker threads, so one event
+        loop can serve many conversations. State lives in the per-call context, so one Agent can
+        be shared.
+        """
+        with tracing.span("chat", model=model_name):
+            retrieval = asyncio.ensure_future(asyncio.to_thread(self.retrieve, query, client_id))
+            checks = asyncio.gather(
+                asyncio.to_thread(self.check_client, client_id),
+                asyncio.to_thread(self.fast_path, query, client_id, today)
+            )
+            context = self.new_context(query, message_history)
+            try:
+                valid, routed = await checks
+            except BaseException:
+                retrieval.cancel()
+                raise
+            if not valid or routed is not None:
+                # The worker thread finishes on its own; its result or error is discarded
+                retrieval.cancel()
+                if not valid:
+                    return {"content": "Client ID does not exist.", "chart": None}
+                return {"content": routed["content"], "chart": None}
+            merchants, descriptions = await retrieval
+
+            while context["state"] != "end":
+                if context["state"] == "call_model":
+                    context = await self.acall_model(context, merchants, descriptions, today, model_name)
+                elif context["state"] == "tools":
+                    context = await asyncio.to_thread(self.tool_node, context, client_id)
+                else:
+                    break
+
+                context["state"] = self.should_continue(context)
+
+            return self.final_response(context)
+
+    def chat_stream(self, query, client_id, today, message_history=None, model_name=None):
+        """
+        Streaming `chat`. Yields typed events as the turn progresses:
+        {"type": "token", "text"} for model output, {"type": "tool_call_started", "name", "arguments"},
+        {"type": "tool_call_finished", "name", "content"}, {"type": "chart", "chart"}, and finally
+        {"type": "done", "content", "chart", "ttft_ms"} with the same content and chart `chat` returns.
+        Tokens of a round that ends in tool calls are streamed too; the final content is in "done".
+        """
+        with tracing.span("chat", model=model_name, stream=True):
+            start = time.perf_counter()
+            if not self.check_client(client_id):
+                yield {"type": "done", "content": "Client ID does not exist.", "chart": None, "ttft_ms": None}
+                return
+            routed = self.fast_path(query, client_id, today)
+            if routed is not None:
+                ttft_ms = (time.perf_counter() - start) * 1000
+                yield {"type": "token", "text": routed["content"]}
+                yield {"type": "done", "content": routed["content"], "chart": None, "ttft_ms": ttft_ms}
+                return
+            context = self.new_context(query, message_history)
+            # Get unique merchants and descriptions from the vector store
+            merchants, descriptions = self.retrieve(query, client_id)
+
+            ttft_ms = None
+            while context["state"] != "end":
+                if context["state"] == "call_model":
+                    for event in self.stream_model(context, merchants, descriptions, today, model_name):
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - start) * 1000
+                            logger.info("Time to first token: %.0f ms (model %s)", ttft_ms, model_name)
+                        yield event
+                elif context["state"] == "tools":
+                    for tool_call in context["messages"][-1].get("tool_calls") or []:
+                        function = tool_call.get("function", {})
+                        yield {"type": "tool_call_started", "name": function.get("name"), "arguments": function.get("arguments")}
+                    first_result = len(context["messages"])
+                    chart = context["chart"]
+                    context = self.tool_node(context, client_id)
+                    for message in context["messages"][first_result:]:
+                        yield {"type": "tool_call_finished", "name": message.get("name"), "content": message.get("content")}
+                    if context["chart"] is not chart:
+                        yield {"type": "chart", "chart": context["chart"]}
+                else:
+                    break
 
+                context["state"] = self.should_continue(context)
 
+            yield {"type": "done", **self.final_response(context), "ttft_ms": ttft_ms}
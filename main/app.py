@@ -1,3 +1,4 @@
+import logging
 import os
 from dotenv import load_dotenv
 import streamlit as st
@@ -8,6 +9,14 @@ from vector_store import VectorStore
 
 load_dotenv()
 
+# The agent logs time to first token and token usage at INFO
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+if os.getenv("METRICS_PORT"):
+    import tracing
+
+    tracing.start_metrics_server(int(os.getenv("METRICS_PORT")))
+
 if not os.getenv("LLM_API_KEY"):
     st.error(
         "Missing API Key!\n\n"
@@ -19,13 +28,16 @@ if not os.getenv("LLM_API_KEY"):
 st.set_page_config(layout="wide")
 st.title("Bank Assistant")
 
+# Display name -> model id, sampling temperature and whether identical requests are answered
+# from the LLM cache. Caching needs temperature 0; to opt a model in, set both on its entry,
+# e.g. {"model": "llama-3.3-70b-versatile", "temperature": 0, "cache": True}
 model_map = {
-    "Default (Llama 3.3 70b)": "llama-3.3-70b-versatile",
-    "Qwen qwq 32b": "qwen-qwq-32b",
-    "Mistral Saba 24b": "mistral-saba-24b",
-    "Llama 4 Maverick 17b": "meta-llama/llama-4-maverick-17b-128e-instruct",
-    "Llama 4 Scout 17b": "meta-llama/llama-4-scout-17b-16e-instruct",
-    "Llama 3.1 8b": "llama-3.1-8b-instant"
+    "Default (Llama 3.3 70b)": {"model": "llama-3.3-70b-versatile", "temperature": 0.6, "cache": False},
+    "Qwen qwq 32b": {"model": "qwen-qwq-32b", "temperature": 0.6, "cache": False},
+    "Mistral Saba 24b": {"model": "mistral-saba-24b", "temperature": 0.6, "cache": False},
+    "Llama 4 Maverick 17b": {"model": "meta-llama/llama-4-maverick-17b-128e-instruct", "temperature": 0.6, "cache": False},
+    "Llama 4 Scout 17b": {"model": "meta-llama/llama-4-scout-17b-16e-instruct", "temperature": 0.6, "cache": False},
+    "Llama 3.1 8b": {"model": "llama-3.1-8b-instant", "temperature": 0.6, "cache": False}
 }
 
 with st.sidebar:
@@ -38,10 +50,14 @@ with st.sidebar:
     index=0
 )
 
-selected_model = model_map.get(model_choice, "llama-3.3-70b-versatile")
+selected_model = model_map.get(model_choice, model_map["Default (Llama 3.3 70b)"])["model"]
 
 if "agent" not in st.session_state:
-    st.session_state.agent = Agent(Model(), VectorStore())
+    st.session_state.agent = Agent(
+        Model(),
+        VectorStore(),
+        model_config={config["model"]: config for config in model_map.values()}
+    )
 
 agent = st.session_state.agent
 
@@ -63,13 +79,29 @@ if prompt := st.chat_input("What do you want to know?"):
     
     with st.chat_message("user"):
         st.markdown(prompt)
-        
-        response = agent.chat(prompt, client_id, today_date, st.session_state.messages, model_name=selected_model)
-        content = response["content"]
-        chart = response["chart"]
     
     with st.chat_message("assistant"):
-        st.markdown(content)
+        tool_status = st.empty()
+        answer = st.empty()
+        response = {}
+
+        def stream_tokens():
+            for event in agent.chat_stream(prompt, client_id, today_date, st.session_state.messages, model_name=selected_model):
+                if event["type"] == "token":
+                    yield event["text"]
+                elif event["type"] == "tool_call_started":
+                    tool_status.caption(f"Running `{event['name']}`...")
+                elif event["type"] == "done":
+                    response.update(event)
+            tool_status.empty()
+
+        with answer.container():
+            streamed = st.write_stream(stream_tokens())
+        content = response["content"]
+        chart = response["chart"]
+        # Text streamed before a tool call is not part of the answer
+        if streamed != content:
+            answer.markdown(content)
         if chart is not None:
             st.plotly_chart(chart, use_container_width=True)
         
@@ -0,0 +1,128 @@
+"""
+Load test for Agent.achat: many simultaneous conversations in one process against the local
+mock LLM (benchmarks/mock_llm.py), compared with the same turns through the blocking
+Agent.chat one after another. Questions name merchants, so retrieval is served by the
+merchant index and the embedding model is not needed.
+
+    cd main
+    python -m benchmarks.bench_async --conversations 200 --concurrency 50 --latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date
+
+QUESTIONS = [
+    "How much did I spend on {merchant}?",
+    "How many times did I go to {merchant}?",
+    "What is my average {merchant} bill?",
+    "Total {merchant} and {other} spending",
+]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def summarize(latencies: list[float], seconds: float) -> dict:
+    return {
+        "conversations": len(latencies),
+        "seconds": seconds,
+        "throughput_per_s": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def make_turns(clients: int, n: int, seed: int = 0) -> list[tuple[str, int]]:
+    from benchmarks.synthetic import MERCHANTS
+
+    rng = random.Random(seed)
+    turns = []
+    for _ in range(n):
+        (merchant, _), (other, _) = rng.sample(MERCHANTS, 2)
+        turns.append((rng.choice(QUESTIONS).format(merchant=merchant, other=other), rng.randint(1, clients)))
+    return turns
+
+
+async def run_async(agent, turns: list, concurrency: int, model_name: str) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(question, client_id):
+        async with semaphore:
+            start = time.perf_counter()
+            await agent.achat(question, client_id, date(2024, 12, 31), model_name=model_name)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(question, client_id) for question, client_id in turns))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_sync(agent, turns: list, model_name: str) -> dict:
+    latencies = []
+    start = time.perf_counter()
+    for question, client_id in turns:
+        begin = time.perf_counter()
+        agent.chat(question, client_id, date(2024, 12, 31), model_name=model_name)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sync-conversations", type=int, default=20, help="Turns replayed through the blocking chat")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock LLM seconds per completion")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--rows-per-client", type=int, default=500)
+    args = parser.parse_args()
+
+    # The database path must be set before the modules that read it are imported
+    tmp = tempfile.mkdtemp(prefix="bench_async_")
+    os.environ["TRANSACTIONS_DB"] = os.path.join(tmp, "transactions.db")
+    os.environ.setdefault("ENCODER_WARMUP", "0")
+    os.environ.setdefault("LLM_API_KEY", "mock")
+
+    from agent import Agent
+    from benchmarks.mock_llm import MockLLMServer
+    from benchmarks.synthetic import make_transactions_db
+    from migrate import migrate
+    from model import Model
+    from vector_store import VectorStore
+
+    make_transactions_db(os.environ["TRANSACTIONS_DB"], args.clients, args.rows_per_client)
+    migrate(os.environ["TRANSACTIONS_DB"])
+    server = MockLLMServer(("127.0.0.1", 0), latency=args.latency)
+    server.start()
+
+    agent = Agent(
+        Model(base_url=server.base_url),
+        VectorStore(db_path=os.environ["TRANSACTIONS_DB"], persist_dir=os.path.join(tmp, "chroma"))
+    )
+    turns = make_turns(args.clients, args.conversations)
+
+    sync = run_sync(agent, turns[:args.sync_conversations], "mock")
+    concurrent = asyncio.run(run_async(agent, turns, args.concurrency, "mock"))
+    server.shutdown()
+
+    print(json.dumps({
+        "mock_latency_s": args.latency,
+        "concurrency": args.concurrency,
+        "sync_chat": sync,
+        "async_achat": concurrent,
+        "llm_requests": server.requests,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
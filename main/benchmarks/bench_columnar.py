@@ -0,0 +1,97 @@
+"""
+`query_sql` latency on SQLite versus the columnar engine (columnar.py), for chatty
+sessions: each client asks a run of follow-up questions, so the first query of a session
+pays for loading the client's columns and the rest are answered from memory. The result
+cache is off, so every call is executed. Every columnar result is checked against SQLite
+and must be identical, value types included; anything else counts as a mismatch.
+
+    cd main
+    python -m benchmarks.bench_columnar
+    python -m benchmarks.bench_columnar --clients 50 --rows-per-client 20000 --max-bytes 50000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+
+def same_rows(expected: list[dict], actual: list[dict]) -> str:
+    from rollup import typed_rows
+
+    keys = [list(row) for row in expected] == [list(row) for row in actual]
+    values = typed_rows([tuple(row.values()) for row in expected]) == typed_rows([tuple(row.values()) for row in actual])
+    return "exact" if keys and values else "mismatch"
+
+
+def run_sessions(sessions: list[list[dict]], execute) -> dict:
+    """
+    Runs each session's calls; latency of the first call and of the follow-ups, in ms.
+    """
+    first, follow_ups = [], []
+    for calls in sessions:
+        for i, args in enumerate(calls):
+            start = time.perf_counter()
+            execute(args)
+            (follow_ups if i else first).append((time.perf_counter() - start) * 1000)
+    total = sum(first) + sum(follow_ups)
+    return {
+        "calls": len(first) + len(follow_ups),
+        "first_call_ms": sum(first) / len(first),
+        "follow_up_ms": sum(follow_ups) / len(follow_ups) if follow_ups else 0.0,
+        "per_sec": (len(first) + len(follow_ups)) / (total / 1000) if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rows-per-client", type=int, default=5000)
+    parser.add_argument("--follow-ups", type=int, default=30, help="Calls per client session")
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024 * 1024, help="Columnar memory budget")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The database path must be set before the modules that read it are imported
+    tmp = tempfile.mkdtemp(prefix="bench_columnar_")
+    os.environ["TRANSACTIONS_DB"] = os.path.join(tmp, "transactions.db")
+
+    from benchmarks.synthetic import make_transactions_db, tool_call_args
+    from columnar import columnar_cache
+    from migrate import migrate
+    from result_cache import query_cache
+    from tools import query_sql
+
+    make_transactions_db(os.environ["TRANSACTIONS_DB"], clients=args.clients, rows_per_client=args.rows_per_client, seed=args.seed)
+    migrate(os.environ["TRANSACTIONS_DB"])
+    query_cache.max_entries = 0
+
+    calls = tool_call_args(args.clients, args.clients * args.follow_ups, args.seed)
+    sessions = {}
+    for call in calls:
+        sessions.setdefault(call["client_id"], []).append(call)
+    sessions = list(sessions.values())
+
+    columnar_cache.enabled = False
+    expected = [query_sql(**call) for session in sessions for call in session]
+    report = {"sqlite": run_sessions(sessions, lambda call: query_sql(**call))}
+
+    columnar_cache.enabled = True
+    columnar_cache.max_bytes = args.max_bytes
+    columnar_cache.clear()
+    report["columnar"] = run_sessions(sessions, lambda call: query_sql(**call))
+    report["columnar"]["cache"] = columnar_cache.stats()
+
+    agreement = {"exact": 0, "mismatch": 0}
+    for want, call in zip(expected, (call for session in sessions for call in session)):
+        got = query_sql(**call)
+        agreement[same_rows(want.get("rows", []), got.get("rows", [])) if "error" not in want else "exact"] += 1
+    report["agreement"] = agreement
+    report["follow_up_speedup"] = (
+        report["sqlite"]["follow_up_ms"] / report["columnar"]["follow_up_ms"] if report["columnar"]["follow_up_ms"] else 0.0
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
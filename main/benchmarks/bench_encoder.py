@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for the shared query encoder: cold start, warm encode latency and the
+hit rate of the query-embedding LRU on a replay with repeated questions.
+
+    cd main
+    ENCODER_WARMUP=0 python -m benchmarks.bench_encoder --backend torch
+    ENCODER_WARMUP=0 python -m benchmarks.bench_encoder --backend onnx-int8
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from encoder import ENCODER_MODEL, Encoder
+from utils import remove_stopwords
+
+QUESTIONS = [
+    "How much did I spend on Uber last month?",
+    "Visualise utility bills over the year.",
+    "Summarize my spending by category between August and September.",
+    "What is my average grocery bill?",
+    "Show my Amazon purchases this year",
+    "How many times did I eat at McDonald's?",
+    "What was my biggest travel expense?",
+    "How much did I get paid in March?",
+    "Total gas station spending in the last 3 months",
+    "How much do I pay for Netflix and Spotify?",
+]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def run(backend: str, queries: int, cache_size: int, seed: int = 0) -> dict:
+    start = time.perf_counter()
+    encoder = Encoder(ENCODER_MODEL, backend, cache_size)
+    encoder.encode_query("cold start")
+    cold_start = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    variants = [f"{q} {i}" for q in QUESTIONS for i in range(20)]
+    uncached = []
+    for text in rng.sample(variants, min(queries, len(variants))):
+        start = time.perf_counter()
+        encoder.encode([remove_stopwords(text)])
+        uncached.append((time.perf_counter() - start) * 1000)
+
+    # Follow-up turns repeat a few popular questions far more often than the rest
+    weights = [1 / (rank + 1) for rank in range(len(QUESTIONS))]
+    replay = rng.choices(QUESTIONS, weights=weights, k=queries)
+    served = []
+    for text in replay:
+        start = time.perf_counter()
+        encoder.encode_query(remove_stopwords(text))
+        served.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "backend": backend,
+        "cold_start_s": cold_start,
+        "warm_encode_p50_ms": statistics.median(uncached),
+        "warm_encode_p99_ms": percentile(uncached, 0.99),
+        "cached_path_p50_ms": statistics.median(served),
+        "cached_path_p99_ms": percentile(served, 0.99),
+        "cache": encoder.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--cache-size", type=int, default=4096)
+    args = parser.parse_args()
+    print(json.dumps(run(args.backend, args.queries, args.cache_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
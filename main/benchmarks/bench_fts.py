@@ -0,0 +1,82 @@
+"""
+Compares the descriptions filter through the FTS5 index against the LIKE scan on a
+synthetic multi-million-row table.
+
+    cd main
+    python -m benchmarks.bench_fts --clients 2000 --rows-per-client 1000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from benchmarks.synthetic import MERCHANTS, make_transactions_db
+from migrate import migrate
+from query_builder import build_query
+
+KEYWORDS = [m.lower() for m, _ in MERCHANTS] + ["payroll", "pos purchase", "deposit", "purchase #12"]
+
+
+def time_queries(db_path: str, arg_sets: list[dict], schema_version: int, tokenizer: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    latencies = []
+    rows = 0
+    for args in arg_sets:
+        sql, params = build_query(**args, schema_version=schema_version, fts_tokenizer=tokenizer)
+        start = time.perf_counter()
+        rows += conn.execute(sql, params).fetchone()[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "total_s": sum(latencies) / 1000,
+        "matched_rows": rows,
+    }
+
+
+def run(clients: int, rows_per_client: int, queries: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    arg_sets = [
+        {
+            "client_id": rng.randint(1, clients),
+            "aggregation": "count",
+            "descriptions": rng.sample(KEYWORDS, rng.randint(1, 2)),
+        }
+        for _ in range(queries)
+    ]
+    results = {"rows": clients * rows_per_client, "queries": queries}
+    with tempfile.TemporaryDirectory() as tmp:
+        base = make_transactions_db(os.path.join(tmp, "base.db"), clients, rows_per_client, seed)
+        migrate(base, target=1)
+        results["like"] = time_queries(base, arg_sets, 1, "")
+        for tokenizer in ("trigram", "unicode61"):
+            path = os.path.join(tmp, f"{tokenizer}.db")
+            shutil.copy(base, path)
+            start = time.perf_counter()
+            migrate(path, fts_tokenizer=tokenizer)
+            build_s = time.perf_counter() - start
+            results[tokenizer] = time_queries(path, arg_sets, 2, tokenizer)
+            results[tokenizer]["build_s"] = build_s
+            results[tokenizer]["db_mb"] = os.path.getsize(path) / 1e6
+        results["base_db_mb"] = os.path.getsize(base) / 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--rows-per-client", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(run(args.clients, args.rows_per_client, args.queries), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Vector query latency against the number of clients, for the single filtered collection and
+the per-client / bucketed partitioned layouts. Uses random unit vectors, so it measures the
+Chroma side only.
+
+    cd main
+    python -m benchmarks.bench_partitions --clients 10 100 1000 --rows-per-client 200
+"""
+import argparse
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from partitions import CollectionRouter, chroma_client
+
+
+def fill(router: CollectionRouter, vectors: np.ndarray, client_ids: list[int], batch_size: int = 1000):
+    for start in range(0, len(vectors), batch_size):
+        rows = range(start, min(start + batch_size, len(vectors)))
+        router.add(
+            [str(i) for i in rows],
+            [f"txn {i}" for i in rows],
+            vectors[start:rows.stop].tolist(),
+            [{"client_id": client_ids[i]} for i in rows]
+        )
+
+
+def time_queries(router: CollectionRouter, queries: np.ndarray, clients: list[int], top_k: int) -> dict:
+    latencies = []
+    for vector, client_id in zip(queries, clients):
+        start = time.perf_counter()
+        router.collection_for(client_id, create=False).query(
+            query_embeddings=[vector.tolist()],
+            n_results=top_k,
+            where=router.where(client_id),
+            include=["metadatas"]
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def run(clients: int, rows_per_client: int, queries: int, top_k: int, buckets: int, dim: int = 384, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((clients * rows_per_client, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    client_ids = [1 + i // rows_per_client for i in range(len(vectors))]
+    query_vectors = rng.standard_normal((queries, dim), dtype=np.float32)
+    query_clients = [random.Random(seed + i).randint(1, clients) for i in range(queries)]
+
+    result = {"clients": clients, "rows": len(vectors)}
+    for mode in ("single", "client", "bucket"):
+        tmp = tempfile.mkdtemp(prefix="bench_partitions_")
+        try:
+            router = CollectionRouter(chroma_client(tmp), "transactions", mode, buckets)
+            start = time.perf_counter()
+            fill(router, vectors, client_ids)
+            load = time.perf_counter() - start
+            # The first pass opens (and loads) each partition; the second is steady state
+            cold = time_queries(router, query_vectors, query_clients, top_k)
+            warm = time_queries(router, query_vectors, query_clients, top_k)
+            result[mode] = {
+                "load_s": load,
+                "cold_p50_ms": cold["p50_ms"],
+                "p50_ms": warm["p50_ms"],
+                "p95_ms": warm["p95_ms"],
+            }
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--rows-per-client", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--buckets", type=int, default=16)
+    args = parser.parse_args()
+    results = [run(n, args.rows_per_client, args.queries, args.top_k, args.buckets) for n in args.clients]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
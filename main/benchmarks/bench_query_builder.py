@@ -0,0 +1,104 @@
+"""
+Compares statement compile time of the legacy string-interpolated `query_sql` against
+the parameterized query builder over a replay of realistic tool-call arguments.
+
+    cd main
+    python -m benchmarks.bench_query_builder --calls 5000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.synthetic import TRANSACTIONS_SCHEMA, make_transactions_db, tool_call_args
+from query_builder import AGGREGATIONS, ALLOWED_COLUMNS, build_query
+
+
+def legacy_sql(client_id, start_date=None, end_date=None, aggregation=None, direction=None, category=None,
+               merchants=None, descriptions=None, group_by=None, limit=None):
+    """
+    The SQL text `query_sql` produced before the query builder, kept for comparison.
+    """
+    where_clauses = [f"clnt_id = {client_id}"]
+    if start_date:
+        where_clauses.append(f"txn_date >= '{start_date}'")
+    if end_date:
+        where_clauses.append(f"txn_date <= '{end_date}'")
+    if direction == "spend":
+        where_clauses.append("amt < 0")
+    elif direction == "income":
+        where_clauses.append("amt > 0")
+    if category:
+        where_clauses.append(f"cat = '{category}'")
+    if merchants:
+        formatted = ', '.join([f'"{m.lower()}"' for m in merchants])
+        where_clauses.append(f'LOWER("merchant") IN ({formatted})')
+    if descriptions:
+        desc_clauses = [f'LOWER("desc") LIKE \'%{d.lower()}%\'' for d in descriptions]
+        where_clauses.append("(" + " OR ".join(desc_clauses) + ")")
+    select_fields = AGGREGATIONS[aggregation]
+    group_clause = ""
+    if group_by:
+        group_clean = [f'"{col}"' for col in group_by if col in ALLOWED_COLUMNS]
+        group_clause = f" GROUP BY {', '.join(group_clean)}"
+        select_fields = ', '.join(group_clean + [AGGREGATIONS[aggregation]])
+    sql = f"SELECT {select_fields} FROM transactions WHERE {' AND '.join(where_clauses)}{group_clause}"
+    if limit:
+        sql += f" LIMIT {limit}"
+    return sql
+
+
+def replay(conn, statements) -> tuple[float, int]:
+    """
+    Executes every statement and returns the elapsed time and the number of statements that failed.
+    Interpolated SQL breaks on values such as "mcdonald's", which is counted rather than raised.
+    """
+    errors = 0
+    start = time.perf_counter()
+    for sql, params in statements:
+        try:
+            conn.execute(sql, params).fetchall()
+        except sqlite3.Error:
+            errors += 1
+    return time.perf_counter() - start, errors
+
+
+def run(calls: int, clients: int, rows_per_client: int) -> dict:
+    arg_sets = tool_call_args(clients, calls)
+    legacy = [(legacy_sql(**args), ()) for args in arg_sets]
+    built = [build_query(**args) for args in arg_sets]
+
+    results = {
+        "calls": calls,
+        "legacy_distinct_sql": len({sql for sql, _ in legacy}),
+        "builder_distinct_sql": len({sql for sql, _ in built}),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        # An empty table isolates prepare cost: execution does no row work
+        empty = sqlite3.connect(os.path.join(tmp, "empty.db"), cached_statements=256)
+        empty.execute(TRANSACTIONS_SCHEMA)
+        results["compile_legacy_s"], results["legacy_errors"] = replay(empty, legacy)
+        results["compile_builder_s"], results["builder_errors"] = replay(empty, built)
+
+        db_path = make_transactions_db(os.path.join(tmp, "transactions.db"), clients, rows_per_client)
+        full = sqlite3.connect(db_path, cached_statements=256)
+        results["end_to_end_legacy_s"], _ = replay(full, legacy)
+        results["end_to_end_builder_s"], _ = replay(full, built)
+
+    results["compile_speedup"] = results["compile_legacy_s"] / results["compile_builder_s"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rows-per-client", type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(run(args.calls, args.clients, args.rows_per_client), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Size of the `query_sql` results sent back to the model, as dict reprs and as shaped by
+result_shaping.py, over replayed tool calls on a synthetic database. Then the same questions
+(mostly grouped results) go through Agent.chat with shaping off and on, and the prompt
+tokens and time of the LLM calls are compared. By default that runs against the mock LLM,
+which estimates tokens as characters / 4 and can add prefill time per prompt token
+(--token-latency); --llm uses BASE_URL and the provider's token counts.
+
+    cd main
+    python -m benchmarks.bench_result_shaping
+    python -m benchmarks.bench_result_shaping --llm --model llama-3.3-70b-versatile
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+from datetime import date
+
+TODAY = date(2024, 12, 31)
+
+# (question, query_sql arguments the mock LLM answers it with)
+QUESTIONS = [
+    ("Show my spending by category this year",
+     {"aggregation": "sum", "direction": "spend", "group_by": ["cat"], "start_date": "2024-01-01", "end_date": "2024-12-31"}),
+    ("Show my spending by merchant in 2024",
+     {"aggregation": "sum", "direction": "spend", "group_by": ["merchant"], "start_date": "2024-01-01", "end_date": "2024-12-31"}),
+    ("What did I spend each day in the last 3 months?",
+     {"aggregation": "sum", "direction": "spend", "group_by": ["txn_date"], "start_date": "2024-09-30", "end_date": "2024-12-31"}),
+    ("List my daily spending this year",
+     {"aggregation": "sum", "direction": "spend", "group_by": ["txn_date"], "start_date": "2024-01-01", "end_date": "2024-12-31"}),
+    ("How many transactions did I make at each merchant?",
+     {"aggregation": "count", "direction": "both", "group_by": ["merchant"]}),
+    ("What was my biggest purchase at each merchant by category?",
+     {"aggregation": "min", "direction": "spend", "group_by": ["cat", "merchant"]}),
+    ("How much did I spend in total last month?",
+     {"aggregation": "sum", "direction": "spend", "start_date": "2024-11-01", "end_date": "2024-11-30"}),
+]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def describe(values: list[int]) -> dict:
+    values = sorted(values)
+    return {
+        "mean": statistics.fmean(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+def payload_sizes(calls: list[dict]) -> dict:
+    """
+    Estimated tokens of each call's result as `str(result)` and as `shape_result(result)`.
+    """
+    from result_shaping import MAX_ROWS, shape_result
+    from tools import query_sql
+
+    raw, shaped, truncated = [], [], 0
+    for args in calls:
+        result = query_sql(**args)
+        raw.append(estimate_tokens(str(result)))
+        shaped.append(estimate_tokens(shape_result(result)))
+        truncated += len(result.get("rows", [])) > MAX_ROWS
+    return {
+        "calls": len(calls),
+        "truncated_calls": truncated,
+        "raw_tokens": describe(raw),
+        "shaped_tokens": describe(shaped),
+        "reduction": 1 - sum(shaped) / sum(raw),
+    }
+
+
+def run_chat(agent, model_name: str, client_id: int) -> dict:
+    """
+    Prompt tokens and seconds of the LLM calls over QUESTIONS, from the llm_call spans.
+    """
+    import tracing
+
+    tracing.recorder.reset()
+    for question, _ in QUESTIONS:
+        agent.chat(question, client_id, TODAY, model_name=model_name)
+    metric = tracing.recorder.metrics.get("llm_call", {"count": 0, "seconds": 0.0, "totals": {}})
+    return {
+        "llm_calls": metric["count"],
+        "prompt_tokens": metric["totals"].get("prompt_tokens", 0),
+        "llm_seconds": metric["seconds"],
+        "llm_ms_per_call": metric["seconds"] * 1000 / metric["count"] if metric["count"] else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm", action="store_true", help="Use the LLM at BASE_URL instead of the mock")
+    parser.add_argument("--model", default="llama-3.3-70b-versatile")
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--rows-per-client", type=int, default=3000)
+    parser.add_argument("--calls", type=int, default=500, help="Replayed query_sql calls")
+    parser.add_argument("--token-latency", type=float, default=0.0002, help="Mock LLM seconds per prompt token")
+    args = parser.parse_args()
+
+    # Settings read at import time must be set first
+    tmp = tempfile.mkdtemp(prefix="bench_shaping_")
+    os.environ["TRANSACTIONS_DB"] = os.path.join(tmp, "transactions.db")
+    os.environ["TRACING"] = "1"
+    os.environ.setdefault("ENCODER_WARMUP", "0")
+
+    from benchmarks.synthetic import make_transactions_db, tool_call_args
+    from migrate import migrate
+
+    make_transactions_db(os.environ["TRANSACTIONS_DB"], clients=args.clients, rows_per_client=args.rows_per_client)
+    migrate(os.environ["TRANSACTIONS_DB"])
+    report = {"payload": payload_sizes(tool_call_args(args.clients, args.calls))}
+
+    from agent import Agent
+    from model import Model
+    from vector_store import VectorStore
+
+    server = None
+    if not args.llm:
+        from benchmarks.mock_llm import MockLLMServer, scripted_reply
+
+        planned = dict(QUESTIONS)
+
+        def reply(messages):
+            message = scripted_reply(messages)
+            question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+            if message.get("tool_calls") and question in planned:
+                message["tool_calls"][0]["function"]["arguments"] = json.dumps(planned[question])
+            return message
+
+        os.environ.setdefault("LLM_API_KEY", "mock")
+        server = MockLLMServer(("127.0.0.1", 0), reply_fn=reply, token_latency=args.token_latency)
+        server.start()
+    agent = Agent(
+        Model(base_url=server.base_url) if server else Model(),
+        VectorStore(db_path=os.environ["TRANSACTIONS_DB"], persist_dir=os.path.join(tmp, "chroma"))
+    )
+    # Every question must reach the model, twice
+    agent.router = None
+    agent.llm_cache = None
+    model_name = "mock" if server else args.model
+    try:
+        for name, shaped in (("before", False), ("after", True)):
+            agent.shape_results = shaped
+            report[name] = run_chat(agent, model_name, client_id=1)
+    finally:
+        if server:
+            server.shutdown()
+    before, after = report["before"], report["after"]
+    report["prompt_token_reduction"] = 1 - after["prompt_tokens"] / before["prompt_tokens"] if before["prompt_tokens"] else 0.0
+    report["llm_time_reduction"] = 1 - after["llm_seconds"] / before["llm_seconds"] if before["llm_seconds"] else 0.0
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Per-turn retrieval latency with merchant/description metadata stored in Chroma, against a
+collection that only stores client_id and needs a SQLite lookup of the matched uids.
+
+    cd main
+    python -m benchmarks.bench_retrieval --clients 50 --rows-per-client 500
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import MERCHANTS, make_transactions_db
+from vector_store import VectorStore
+
+QUERIES = [
+    "spend on {merchant} last month",
+    "how much did I pay {merchant}",
+    "{merchant} purchases this year",
+    "rides and taxis",
+    "coffee and restaurants",
+    "monthly subscriptions",
+]
+
+
+def copy_without_metadata(store: VectorStore, legacy, batch_size: int = 500):
+    """
+    Copies the store's collection into `legacy`, keeping only the client_id metadata.
+    """
+    total = store.collection.count()
+    for offset in range(0, total, batch_size):
+        batch = store.collection.get(offset=offset, limit=batch_size, include=["embeddings", "documents", "metadatas"])
+        legacy.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=[{"client_id": meta["client_id"]} for meta in batch["metadatas"]]
+        )
+
+
+def time_turns(store: VectorStore, turns: list[tuple[int, str]], top_k: int) -> dict:
+    latencies = []
+    for client_id, query in turns:
+        start = time.perf_counter()
+        store.get_unique_merchants_and_descriptions(query, client_id, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "mean_ms": statistics.mean(latencies),
+    }
+
+
+def run(clients: int, rows_per_client: int, turns: int, top_k: int, seed: int = 0) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench_retrieval_")
+    db_path = make_transactions_db(os.path.join(tmp, "transactions.db"), clients, rows_per_client, seed)
+    csv_path = os.path.join(tmp, "transactions.csv")
+    conn = sqlite3.connect(db_path)
+    pd.read_sql_query("SELECT * FROM transactions", conn).to_csv(csv_path, index=False)
+    conn.close()
+
+    store = VectorStore(
+        db_path=db_path,
+        persist_dir=os.path.join(tmp, "chroma"),
+        embedding_cache_dir=os.path.join(tmp, "embedding_cache"),
+        use_merchant_index=False,
+        partition_mode="single"
+    )
+    store.load_data_stream(csv_path)
+    legacy = VectorStore(
+        db_path=db_path,
+        persist_dir=os.path.join(tmp, "chroma"),
+        collection_name="transactions_legacy",
+        embedding_cache_dir=os.path.join(tmp, "embedding_cache"),
+        use_merchant_index=False,
+        partition_mode="single"
+    )
+    copy_without_metadata(store, legacy.collection)
+
+    rng = random.Random(seed)
+    replay = [
+        (rng.randint(1, clients), rng.choice(QUERIES).format(merchant=rng.choice(MERCHANTS)[0]))
+        for _ in range(turns)
+    ]
+    # Warm the query-embedding LRU so both paths time retrieval only
+    for client_id, query in replay:
+        store.get_vector_matches(query, client_id, top_k)
+
+    return {
+        "rows": clients * rows_per_client,
+        "top_k": top_k,
+        "metadata": time_turns(store, replay, top_k),
+        "sqlite_lookup": time_turns(legacy, replay, top_k),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--rows-per-client", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=100)
+    args = parser.parse_args()
+    print(json.dumps(run(args.clients, args.rows_per_client, args.turns, args.top_k), indent=2))
+
+
+if __name__ == "__main__":
+    main()
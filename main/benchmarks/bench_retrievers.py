@@ -0,0 +1,80 @@
+"""
+NumPy brute-force search against Chroma's filtered HNSW query for one client, by client
+history size, with Chroma's recall measured against the exact NumPy result. Used to pick
+NUMPY_RETRIEVER_MAX_ROWS.
+
+    cd main
+    python -m benchmarks.bench_retrievers --sizes 500 2000 10000 50000
+"""
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_partitions import fill
+from partitions import CollectionRouter, chroma_client
+from retrievers import ChromaRetriever, NumpyRetriever
+
+
+def time_search(retriever, client_id: int, queries: np.ndarray, top_k: int, batch: int) -> tuple[dict, list]:
+    latencies = []
+    results = []
+    for start in range(0, len(queries), batch):
+        vectors = queries[start:start + batch].tolist()
+        begin = time.perf_counter()
+        results.extend(retriever.search(client_id, vectors, top_k))
+        latencies.append((time.perf_counter() - begin) * 1000 / len(vectors))
+    return {"p50_ms_per_query": statistics.median(latencies)}, results
+
+
+def run(size: int, other_clients: int, queries: int, top_k: int, batch: int, dim: int = 384, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    clients = other_clients + 1
+    vectors = rng.standard_normal((size * clients, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    client_ids = [1 + i // size for i in range(len(vectors))]
+    query_vectors = rng.standard_normal((queries, dim), dtype=np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+    tmp = tempfile.mkdtemp(prefix="bench_retrievers_")
+    try:
+        router = CollectionRouter(chroma_client(tmp), "transactions", "single")
+        fill(router, vectors, client_ids)
+        numpy = NumpyRetriever(router, cache_dir=tmp + "/client_vectors")
+        numpy.matrix(1)
+        exact_timing, exact = time_search(numpy, 1, query_vectors, top_k, 1)
+        batched_timing, _ = time_search(numpy, 1, query_vectors, top_k, batch)
+        chroma_timing, approximate = time_search(ChromaRetriever(router), 1, query_vectors, top_k, 1)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    recall = statistics.mean(
+        len(set(a["ids"]) & set(e["ids"])) / len(e["ids"]) for a, e in zip(approximate, exact)
+    )
+    return {
+        "client_rows": size,
+        "numpy": exact_timing,
+        f"numpy_batch_{batch}": batched_timing,
+        "chroma": chroma_timing,
+        "chroma_recall": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 10000, 50000])
+    parser.add_argument("--other-clients", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=8)
+    args = parser.parse_args()
+    results = [run(size, args.other_clients, args.queries, args.top_k, args.batch) for size in args.sizes]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Accuracy harness for the fast-path router (router.py). Runs a labeled question set against
+a synthetic database and reports the hit rate, how many routed questions got exactly the
+expected `query_sql` arguments, and false routes (questions labeled for the LLM that the
+router answered anyway). With --llm the same questions go through the LLM path of
+Agent.chat and the first `query_sql` call is compared with the router's, so a model can be
+checked for agreement; --mock points that at the local mock LLM instead of BASE_URL.
+
+    cd main
+    python -m benchmarks.bench_router
+    python -m benchmarks.bench_router --llm --model llama-3.3-70b-versatile
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date
+
+TODAY = date(2024, 12, 31)
+CLIENT_ID = 1
+
+# (question, expected query_sql arguments, or None when the question needs the LLM)
+LABELED = [
+    ("How much did I spend on Uber last month?",
+     {"aggregation": "sum", "direction": "spend", "merchants": ["uber"], "start_date": "2024-11-01", "end_date": "2024-11-30"}),
+    ("How much did I spend at Starbucks this year?",
+     {"aggregation": "sum", "direction": "spend", "merchants": ["starbucks"], "start_date": "2024-01-01", "end_date": "2024-12-31"}),
+    ("How many times did I go to McDonald's in the last 3 months?",
+     {"aggregation": "count", "direction": "spend", "merchants": ["mcdonald's"], "start_date": "2024-09-30", "end_date": "2024-12-31"}),
+    ("What is my average Netflix bill?",
+     {"aggregation": "avg", "direction": "spend", "merchants": ["netflix"]}),
+    ("What was my biggest Amazon purchase in 2023?",
+     {"aggregation": "min", "direction": "spend", "merchants": ["amazon"], "start_date": "2023-01-01", "end_date": "2023-12-31"}),
+    ("What was my smallest purchase at Walmart in March?",
+     {"aggregation": "max", "direction": "spend", "merchants": ["walmart"], "start_date": "2024-03-01", "end_date": "2024-03-31"}),
+    ("Total spending on groceries last year",
+     {"aggregation": "sum", "direction": "spend", "category": "Supermarkets and Groceries", "start_date": "2023-01-01", "end_date": "2023-12-31"}),
+    ("How much did I spend on gas in the past 6 months?",
+     {"aggregation": "sum", "direction": "spend", "category": "Gas Stations", "start_date": "2024-06-30", "end_date": "2024-12-31"}),
+    ("How much did I earn from payroll this year?",
+     {"aggregation": "sum", "direction": "income", "category": "Payroll", "start_date": "2024-01-01", "end_date": "2024-12-31"}),
+    ("How many Lyft rides did I take in October 2024?",
+     {"aggregation": "count", "direction": "spend", "merchants": ["lyft"], "start_date": "2024-10-01", "end_date": "2024-10-31"}),
+    ("Average restaurant spending this month",
+     {"aggregation": "avg", "direction": "spend", "category": "Restaurants", "start_date": "2024-12-01", "end_date": "2024-12-31"}),
+    ("How much did I pay Verizon in the past year?",
+     {"aggregation": "sum", "direction": "spend", "merchants": ["verizon"], "start_date": "2023-12-31", "end_date": "2024-12-31"}),
+    ("How much money did I get from Uber?",
+     {"aggregation": "sum", "direction": "income", "merchants": ["uber"]}),
+    ("How much did I get from Amazon last month?",
+     {"aggregation": "sum", "direction": "income", "merchants": ["amazon"], "start_date": "2024-11-01", "end_date": "2024-11-30"}),
+    ("How much did I spend on Uber and Lyft last month?", None),
+    ("Show my spending by category this year", None),
+    ("Plot my monthly Starbucks spending", None),
+    ("How much did I spend on Uber from March to June?", None),
+    ("What did I buy last weekend?", None),
+    ("Compare my grocery and gas spending", None),
+    ("How much did I spend on coffee?", None),
+    ("Why is my balance so low?", None),
+    ("How much did I spend in Q3?", None),
+    ("How much did I spend at Shell in the first week of May 2024?", None),
+]
+
+
+def canonical(args: dict | None) -> dict | None:
+    from result_cache import normalize_args
+
+    if args is None:
+        return None
+    return normalize_args({key: value for key, value in args.items() if key != "client_id"})
+
+
+def run_router(router) -> dict:
+    outcomes = []
+    start = time.perf_counter()
+    for question, expected in LABELED:
+        routed = router.route(question, CLIENT_ID, TODAY)
+        got = canonical(routed["args"]) if routed else None
+        outcomes.append({"question": question, "expected": canonical(expected), "router": got})
+    seconds = time.perf_counter() - start
+
+    routed = [o for o in outcomes if o["router"] is not None]
+    routable = [o for o in outcomes if o["expected"] is not None]
+    return {
+        "questions": len(outcomes),
+        "hit_rate": len(routed) / len(outcomes),
+        "routable_hit_rate": sum(o["router"] is not None for o in routable) / len(routable),
+        "routed_accuracy": sum(o["router"] == o["expected"] for o in routed) / len(routed) if routed else 0.0,
+        "false_routes": [o["question"] for o in routed if o["expected"] is None],
+        "wrong_args": [o for o in routed if o["expected"] is not None and o["router"] != o["expected"]],
+        "route_ms_per_question": seconds * 1000 / len(outcomes),
+    }, outcomes
+
+
+def run_llm(agent, outcomes: list[dict], model_name: str) -> dict:
+    """
+    Sends the routed questions through the LLM path and compares its first query_sql call.
+    """
+    query_sql = agent.tools["query_sql"]
+    router, agent.router = agent.router, None
+    disagreements = []
+    compared = 0
+    try:
+        for outcome in outcomes:
+            if outcome["router"] is None:
+                continue
+            calls = []
+            agent.tools["query_sql"] = lambda **kwargs: calls.append(kwargs) or query_sql(**kwargs)
+            agent.chat(outcome["question"], CLIENT_ID, TODAY, model_name=model_name)
+            compared += 1
+            llm = canonical(calls[0]) if calls else None
+            if llm != outcome["router"]:
+                disagreements.append({"question": outcome["question"], "router": outcome["router"], "llm": llm})
+    finally:
+        agent.tools["query_sql"] = query_sql
+        agent.router = router
+    return {
+        "compared": compared,
+        "agreement": (compared - len(disagreements)) / compared if compared else 0.0,
+        "disagreements": disagreements,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm", action="store_true", help="Compare routed questions with the LLM path")
+    parser.add_argument("--mock", action="store_true", help="Use the local mock LLM for --llm")
+    parser.add_argument("--model", default="llama-3.3-70b-versatile")
+    args = parser.parse_args()
+
+    # The database path must be set before the modules that read it are imported
+    tmp = tempfile.mkdtemp(prefix="bench_router_")
+    os.environ["TRANSACTIONS_DB"] = os.path.join(tmp, "transactions.db")
+    os.environ.setdefault("ENCODER_WARMUP", "0")
+
+    from benchmarks.synthetic import make_transactions_db
+    from migrate import migrate
+    from router import FastPathRouter
+
+    make_transactions_db(os.environ["TRANSACTIONS_DB"], clients=5, rows_per_client=500)
+    migrate(os.environ["TRANSACTIONS_DB"])
+    report, outcomes = run_router(FastPathRouter(os.environ["TRANSACTIONS_DB"]))
+
+    if args.llm:
+        from agent import Agent
+        from model import Model
+        from vector_store import VectorStore
+
+        server = None
+        if args.mock:
+            from benchmarks.mock_llm import MockLLMServer
+
+            os.environ.setdefault("LLM_API_KEY", "mock")
+            server = MockLLMServer(("127.0.0.1", 0))
+            server.start()
+        agent = Agent(
+            Model(base_url=server.base_url) if server else Model(),
+            VectorStore(db_path=os.environ["TRANSACTIONS_DB"], persist_dir=os.path.join(tmp, "chroma"))
+        )
+        report["llm"] = run_llm(agent, outcomes, "mock" if server else args.model)
+        if server:
+            server.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Load generator for server.py. Threads with keep-alive connections send /chat questions
+(or /query calls with --endpoint query) for a fixed number of requests or seconds, and the
+report gives throughput, p50/p95/p99 latency and errors by status.
+
+    cd main
+    python server.py --port 8000 --workers 4 &
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --concurrency 32 --duration 30
+
+With --local the run is self-contained: a synthetic database, the mock LLM
+(benchmarks/mock_llm.py) and a server.py with --workers processes are started first.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from benchmarks.bench_async import make_turns, summarize
+from benchmarks.synthetic import tool_call_args
+
+
+def make_requests(endpoint: str, clients: int, n: int, seed: int = 0) -> list[tuple[str, dict]]:
+    if endpoint == "query":
+        return [("/query", args) for args in tool_call_args(clients, n, seed)]
+    return [
+        ("/chat", {"query": question, "client_id": client_id, "today": "2024-12-31"})
+        for question, client_id in make_turns(clients, n, seed)
+    ]
+
+
+def run(url: str, requests: list, concurrency: int, duration: float = None, timeout: float = 120.0) -> dict:
+    """
+    Sends `requests` round-robin from `concurrency` threads, once each, or for `duration` seconds.
+    """
+    target = urlparse(url)
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_request():
+        i = next(counter)
+        if deadline is None and i >= len(requests):
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        return requests[i % len(requests)]
+
+    def worker():
+        conn = http.client.HTTPConnection(target.hostname, target.port, timeout=timeout)
+        while (request := next_request()) is not None:
+            path, body = request
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port, timeout=timeout)
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+        conn.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    report = summarize(latencies, seconds) if latencies else {"conversations": 0, "seconds": seconds}
+    report["requests"] = report.pop("conversations")
+    report["statuses"] = {str(status): count for status, count in statuses.items()}
+    report["errors"] = sum(count for status, count in statuses.items() if status != 200)
+    return report
+
+
+def wait_healthy(url: str, timeout: float = 300.0):
+    target = urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(target.hostname, target.port, timeout=2)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} did not become healthy within {timeout:g}s")
+
+
+def start_local(port: int, workers: int, clients: int, rows_per_client: int, latency: float):
+    """
+    Synthetic database, mock LLM and server.py in a subprocess. Returns (server process, mock LLM).
+    """
+    from benchmarks.mock_llm import MockLLMServer
+    from benchmarks.synthetic import make_transactions_db
+    from migrate import migrate
+
+    tmp = tempfile.mkdtemp(prefix="load_test_")
+    db_path = os.path.join(tmp, "transactions.db")
+    make_transactions_db(db_path, clients, rows_per_client)
+    migrate(db_path)
+    llm = MockLLMServer(("127.0.0.1", 0), latency=latency)
+    llm.start()
+    env = dict(
+        os.environ,
+        TRANSACTIONS_DB=db_path,
+        BASE_URL=llm.base_url,
+        LLM_API_KEY=os.getenv("LLM_API_KEY", "mock"),
+        LLM_CACHE_DB="",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--port", str(port), "--workers", str(workers), "--model", "mock"],
+        env=env
+    )
+    return process, llm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=["chat", "query"], default="chat")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Distinct requests to send (cycled with --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run instead of sending each request once")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--local", action="store_true", help="Start a synthetic database, mock LLM and server first")
+    parser.add_argument("--workers", type=int, default=2, help="Server workers with --local")
+    parser.add_argument("--rows-per-client", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock LLM seconds per completion with --local")
+    args = parser.parse_args()
+
+    process = llm = None
+    if args.local:
+        process, llm = start_local(urlparse(args.url).port, args.workers, args.clients, args.rows_per_client, args.latency)
+    try:
+        wait_healthy(args.url)
+        report = run(args.url, make_requests(args.endpoint, args.clients, args.requests), args.concurrency, args.duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            llm.shutdown()
+    report.update({"endpoint": args.endpoint, "concurrency": args.concurrency})
+    if llm is not None:
+        report["llm_requests"] = llm.requests
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
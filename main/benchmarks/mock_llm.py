@@ -0,0 +1,197 @@
+"""
+Local OpenAI-compatible chat completions server (plain and `stream=True`) that answers with
+scripted tool calls, for benchmarks and load tests without a real LLM. The first turn of a question gets a
+`query_sql` call built from the merchants named in it; once a tool result is in the
+conversation the reply is a short text answer.
+
+    cd main
+    python -m benchmarks.mock_llm --port 8001 --latency 0.3
+    BASE_URL=http://127.0.0.1:8001/v1 LLM_API_KEY=mock streamlit run app.py
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic import MERCHANTS
+
+_ids = itertools.count(1)
+
+
+def scripted_tool_args(question: str) -> dict:
+    """
+    `query_sql` arguments for a question: merchants it names, income for "paid"/"income", sum otherwise.
+    """
+    text = question.lower()
+    args = {"aggregation": "sum", "direction": "spend"}
+    merchants = [name.lower() for name, _ in MERCHANTS if name.lower() in text]
+    if merchants:
+        args["merchants"] = merchants
+    if re.search(r"\b(income|paid|salary|payroll)\b", text):
+        args["direction"] = "income"
+    if re.search(r"\bhow many\b|\bcount\b", text):
+        args["aggregation"] = "count"
+    if re.search(r"\baverage\b|\bavg\b", text):
+        args["aggregation"] = "avg"
+    return args
+
+
+def scripted_reply(messages: list[dict]) -> dict:
+    """
+    Assistant message for the conversation so far.
+    """
+    last = messages[-1] if messages else {}
+    if last.get("role") in ("function", "tool"):
+        return {"role": "assistant", "content": f"Here is what I found: {str(last.get('content', ''))[:200]}"}
+    question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{
+            "id": f"call_{next(_ids)}",
+            "type": "function",
+            "function": {"name": "query_sql", "arguments": json.dumps(scripted_tool_args(question))},
+        }],
+    }
+
+
+def estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def completion(request: dict, reply_fn=scripted_reply) -> dict:
+    message = reply_fn(request.get("messages", []))
+    return {
+        "id": f"chatcmpl-{next(_ids)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+        }],
+        "usage": {
+            "prompt_tokens": estimate_tokens(request.get("messages", [])),
+            "completion_tokens": estimate_tokens(message),
+            "total_tokens": estimate_tokens(request.get("messages", [])) + estimate_tokens(message),
+        },
+    }
+
+
+def completion_chunks(request: dict, reply_fn=scripted_reply, piece: int = 8):
+    """
+    The same reply as `completion`, as `chat.completion.chunk` objects: content word by word,
+    tool call arguments in `piece`-character fragments.
+    """
+    message = reply_fn(request.get("messages", []))
+    completion_id = f"chatcmpl-{next(_ids)}"
+
+    def chunk(delta: dict, finish_reason=None) -> dict:
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    yield chunk({"role": "assistant", "content": ""})
+    for word in re.findall(r"\S+\s*", message.get("content") or ""):
+        yield chunk({"content": word})
+    for index, call in enumerate(message.get("tool_calls") or []):
+        yield chunk({"tool_calls": [{
+            "index": index, "id": call["id"], "type": "function",
+            "function": {"name": call["function"]["name"], "arguments": ""},
+        }]})
+        arguments = call["function"]["arguments"]
+        for start in range(0, len(arguments), piece):
+            yield chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + piece]}}]})
+    yield chunk({}, "tool_calls" if message.get("tool_calls") else "stop")
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server for POST /v1/chat/completions. Each request sleeps `latency` seconds,
+    plus `token_latency` per estimated prompt token for prefill, to stand in for model time;
+    `requests` counts the completions served.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple[str, int], latency: float = 0.0, reply_fn=scripted_reply, token_latency: float = 0.0):
+        super().__init__(address, MockLLMHandler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reply_fn = reply_fn
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True)
+        thread.start()
+        return thread
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this Nagle + delayed ACK adds ~40 ms per reply
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        delay = self.server.latency
+        if self.server.token_latency:
+            delay += self.server.token_latency * estimate_tokens(request.get("messages", []))
+        if delay:
+            time.sleep(delay)
+        with self.server._lock:
+            self.server.requests += 1
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in completion_chunks(request, self.server.reply_fn):
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+        body = json.dumps(completion(request, self.server.reply_fn)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each completion takes")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per prompt token")
+    args = parser.parse_args()
+    server = MockLLMServer((args.host, args.port), args.latency, token_latency=args.token_latency)
+    print(f"Mock LLM listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+End-to-end benchmark suite on synthetic data: `query_sql` over replayed tool calls (on
+SQLite, the columnar engine and the result cache), `VectorStore.load_data` from CSV,
+`get_unique_merchants_and_descriptions` on the merchant index and vector paths, and full
+`Agent.chat` turns against the mock LLM. Prints one JSON document tagged with the git
+commit, so runs can be stored and compared across commits.
+
+    cd main
+    python -m benchmarks.suite --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.suite --baseline benchmarks/results/abc1234.json --threshold 0.2
+
+With --baseline, latency metrics more than --threshold slower (or throughput that much lower)
+are listed under "regressions" and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+
+STAGES = ["query_sql", "load_data", "retrieval", "agent_chat"]
+
+QUESTIONS = [
+    "How much did I spend on {merchant}?",
+    "How many times did I go to {merchant} this year?",
+    "Show my {merchant} spending by month",
+    "coffee and snacks",
+    "monthly subscriptions",
+]
+
+
+def git_info() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def timed(fn, items: list) -> dict:
+    """
+    Calls `fn` on each item; latency percentiles in ms and calls per second.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        begin = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - begin) * 1000)
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "calls": len(items),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "mean_ms": statistics.fmean(latencies),
+        "per_sec": len(items) / seconds if seconds else 0.0,
+    }
+
+
+def make_questions(merchants: list, clients: int, n: int, seed: int = 0) -> list[tuple[str, int]]:
+    rng = random.Random(seed)
+    return [
+        (rng.choice(QUESTIONS).format(merchant=rng.choice(merchants)[0]), rng.randint(1, clients))
+        for _ in range(n)
+    ]
+
+
+def bench_query_sql(config: dict) -> dict:
+    from benchmarks.synthetic import tool_call_args
+    from columnar import columnar_cache
+    from result_cache import query_cache
+    from tools import query_sql
+
+    calls = tool_call_args(config["clients"], config["calls"], config["seed"])
+    query_cache.clear()
+    # Uncached: every call reaches SQLite, or the columnar engine once its clients are loaded
+    max_entries, query_cache.max_entries = query_cache.max_entries, 0
+    enabled = columnar_cache.enabled
+    try:
+        columnar_cache.enabled = False
+        uncached = timed(lambda args: query_sql(**args), calls)
+        columnar_cache.enabled = True
+        columnar_cache.clear()
+        for args in calls:
+            query_sql(**args)
+        columnar = timed(lambda args: query_sql(**args), calls)
+    finally:
+        query_cache.max_entries = max_entries
+        columnar_cache.enabled = enabled
+    for args in calls:
+        query_sql(**args)
+    return {"uncached": uncached, "columnar": columnar, "cached": timed(lambda args: query_sql(**args), calls)}
+
+
+def bench_load_data(config: dict, store) -> dict:
+    start = time.perf_counter()
+    store.load_data(config["csv"])
+    seconds = time.perf_counter() - start
+    rows = config["clients"] * config["rows_per_client"]
+    return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0}
+
+
+def bench_retrieval(config: dict, store) -> dict:
+    from benchmarks.synthetic import merchant_catalog
+
+    questions = make_questions(merchant_catalog(config["merchants"]), config["clients"], config["calls"], config["seed"])
+    results = {}
+    for name, use_index in (("merchant_index", True), ("vector", False)):
+        store.use_merchant_index = use_index
+        results[name] = timed(lambda item: store.get_unique_merchants_and_descriptions(item[0], item[1], 50), questions)
+    store.use_merchant_index = True
+    return results
+
+
+def bench_agent_chat(config: dict, store) -> dict:
+    from agent import Agent
+    from benchmarks.mock_llm import MockLLMServer
+    from benchmarks.synthetic import merchant_catalog
+    from model import Model
+
+    server = MockLLMServer(("127.0.0.1", 0), latency=config["llm_latency"])
+    server.start()
+    try:
+        agent = Agent(Model(base_url=server.base_url), store)
+        # The LLM path end to end; the fast path and completion cache would skip it
+        agent.router = None
+        agent.llm_cache = None
+        questions = make_questions(merchant_catalog(config["merchants"]), config["clients"], config["turns"], config["seed"])
+        result = timed(lambda item: agent.chat(item[0], item[1], date(2024, 12, 31), model_name="mock"), questions)
+        result["llm_requests"] = server.requests
+    finally:
+        server.shutdown()
+    return result
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[dict]:
+    """
+    Metrics that moved the wrong way by more than `threshold`: latencies (`_ms`, `seconds`)
+    that grew, throughputs (`per_sec`) that fell.
+    """
+    current, previous = flatten(results), flatten(baseline.get("results", {}))
+    regressions = []
+    for name, old in previous.items():
+        new = current.get(name)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if name.endswith(("_ms", "seconds")) and change > threshold:
+            regressions.append({"metric": name, "baseline": old, "current": new, "change": change})
+        elif name.endswith("per_sec") and -change > threshold:
+            regressions.append({"metric": name, "baseline": old, "current": new, "change": change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rows-per-client", type=int, default=500)
+    parser.add_argument("--merchants", type=int, default=40)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--calls", type=int, default=500, help="query_sql calls and retrieval questions")
+    parser.add_argument("--turns", type=int, default=50, help="Agent.chat turns")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Mock LLM seconds per completion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_suite_")
+    config = {
+        "clients": args.clients,
+        "rows_per_client": args.rows_per_client,
+        "merchants": args.merchants,
+        "days": args.days,
+        "calls": args.calls,
+        "turns": args.turns,
+        "llm_latency": args.llm_latency,
+        "seed": args.seed,
+        "csv": os.path.join(tmp, "data.csv"),
+    }
+    # The database path must be set before the modules that read it are imported
+    os.environ["TRANSACTIONS_DB"] = os.path.join(tmp, "transactions.db")
+    os.environ.setdefault("LLM_API_KEY", "mock")
+    os.environ.setdefault("ENCODER_WARMUP", "0")
+
+    from benchmarks.synthetic import make_transactions_csv, make_transactions_db
+    from migrate import migrate
+
+    options = dict(
+        clients=args.clients, rows_per_client=args.rows_per_client, seed=args.seed,
+        merchants=args.merchants, days=args.days
+    )
+    make_transactions_db(os.environ["TRANSACTIONS_DB"], **options)
+    make_transactions_csv(config["csv"], **options)
+    migrate(os.environ["TRANSACTIONS_DB"])
+
+    results = {}
+    store = None
+    if set(args.stages) - {"query_sql"}:
+        from vector_store import VectorStore
+
+        store = VectorStore(
+            db_path=os.environ["TRANSACTIONS_DB"],
+            persist_dir=os.path.join(tmp, "chroma"),
+            embedding_cache_dir=os.path.join(tmp, "embedding_cache"),
+            client_vectors_dir=os.path.join(tmp, "client_vectors"),
+        )
+    if "query_sql" in args.stages:
+        results["query_sql"] = bench_query_sql(config)
+    # Retrieval and chat search the vectors load_data adds
+    if store is not None:
+        loaded = bench_load_data(config, store)
+        if "load_data" in args.stages:
+            results["load_data"] = loaded
+    if "retrieval" in args.stages:
+        results["retrieval"] = bench_retrieval(config, store)
+    if "agent_chat" in args.stages:
+        results["agent_chat"] = bench_agent_chat(config, store)
+
+    report = {
+        **git_info(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in config.items() if key != "csv"},
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline_commit"] = baseline.get("commit")
+        report["regressions"] = compare(results, baseline, args.threshold)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import calendar
+import csv
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+MERCHANTS = [
+    ("Uber", "Travel"), ("Lyft", "Travel"), ("Amazon", "Shops"), ("Walmart", "Supermarkets and Groceries"),
+    ("Kroger", "Supermarkets and Groceries"), ("Starbucks", "Restaurants"), ("McDonald's", "Restaurants"),
+    ("Netflix", "Digital Entertainment"), ("Spotify", "Digital Entertainment"), ("Shell", "Gas Stations"),
+    ("Chevron", "Gas Stations"), ("AT&T", "Telecommunication Services"), ("Verizon", "Telecommunication Services"),
+    ("Planet Fitness", "Gyms and Fitness Centers"), ("CVS", "Healthcare"), ("Target", "Department Stores"),
+    ("Geico", "Insurance"), ("PG&E", "Utilities"), ("Delta", "Travel"), ("7-Eleven", "Convenience Stores"),
+]
+
+TRANSACTIONS_SCHEMA = (
+    "CREATE TABLE transactions (uid INTEGER PRIMARY KEY, clnt_id INTEGER, bank_id INTEGER, acc_id INTEGER, "
+    "txn_id INTEGER, txn_date TEXT, desc TEXT, amt REAL, cat TEXT, merchant TEXT)"
+)
+
+
+def merchant_catalog(n: int = None, seed: int = 0) -> list[tuple[str, str]]:
+    """
+    `n` (merchant, category) pairs: the well-known MERCHANTS first, then made-up local
+    merchants in random spending categories. None returns MERCHANTS.
+    """
+    if n is None or n <= len(MERCHANTS):
+        return MERCHANTS[:n] if n else list(MERCHANTS)
+    rng = random.Random(seed)
+    categories = sorted({cat for _, cat in MERCHANTS})
+    words = ["Corner", "Main Street", "Sunrise", "Harbor", "Maple", "Golden", "Metro", "Valley", "Union", "Pine"]
+    kinds = ["Market", "Cafe", "Outfitters", "Pharmacy", "Fuel", "Bistro", "Hardware", "Books", "Deli", "Cleaners"]
+    extra = [(f"{rng.choice(words)} {rng.choice(kinds)} {i}", rng.choice(categories)) for i in range(n - len(MERCHANTS))]
+    return list(MERCHANTS) + extra
+
+
+def generate_rows(
+        clients: int,
+        rows_per_client: int,
+        start: date = date(2023, 1, 1),
+        days: int = 730,
+        seed: int = 0,
+        merchants: list[tuple[str, str]] = None,
+    ):
+    """
+    Yields synthetic transaction rows matching the notebook's `transactions` schema.
+    """
+    rng = random.Random(seed)
+    merchants = merchants or MERCHANTS
+    uid = 0
+    for clnt_id in range(1, clients + 1):
+        for txn_id in range(rows_per_client):
+            if rng.random() < 0.05:
+                merchant, cat, amt = "", "Payroll", round(rng.uniform(1500, 4000), 2)
+                desc = f"PAYROLL DEPOSIT {rng.randint(1000, 9999)}"
+            else:
+                merchant, cat = rng.choice(merchants)
+                amt = -round(rng.uniform(2, 300), 2)
+                desc = f"POS PURCHASE {merchant.upper()} #{rng.randint(100, 999)}"
+            txn_date = (start + timedelta(days=rng.randrange(days))).isoformat()
+            yield (uid, clnt_id, 1, clnt_id * 10, txn_id, txn_date, desc, amt, cat, merchant or None)
+            uid += 1
+
+
+def make_transactions_db(
+        path: str,
+        clients: int = 200,
+        rows_per_client: int = 500,
+        seed: int = 0,
+        merchants: int = None,
+        start: date = date(2023, 1, 1),
+        days: int = 730,
+    ) -> str:
+    """
+    Creates (or replaces) a synthetic transactions database at `path`.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(TRANSACTIONS_SCHEMA)
+    conn.executemany(
+        "INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        generate_rows(clients, rows_per_client, start, days, seed, merchant_catalog(merchants, seed))
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def make_transactions_csv(
+        path: str,
+        clients: int = 200,
+        rows_per_client: int = 500,
+        seed: int = 0,
+        merchants: int = None,
+        start: date = date(2023, 1, 1),
+        days: int = 730,
+    ) -> str:
+    """
+    Writes the same rows as `make_transactions_db` in the layout of the notebook's `data.csv`
+    (no uid column, 'DD/MM/YYYY HH:MM' dates), for `VectorStore.load_data`. Row i is uid i.
+    """
+    rng = random.Random(seed + 1)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["clnt_id", "bank_id", "acc_id", "txn_id", "txn_date", "desc", "amt", "cat", "merchant"])
+        for row in generate_rows(clients, rows_per_client, start, days, seed, merchant_catalog(merchants, seed)):
+            _, clnt_id, bank_id, acc_id, txn_id, txn_date, desc, amt, cat, merchant = row
+            day = date.fromisoformat(txn_date)
+            raw_date = f"{day:%d/%m/%Y} {rng.randrange(24):02d}:{rng.randrange(60):02d}"
+            writer.writerow([clnt_id, bank_id, acc_id, txn_id, raw_date, desc, amt, cat, merchant or ""])
+    return path
+
+
+def tool_call_args(clients: int, n: int, seed: int = 0) -> list[dict]:
+    """
+    Returns `n` realistic `query_sql` argument sets, as the LLM would emit them.
+    """
+    rng = random.Random(seed)
+    calls = []
+    for _ in range(n):
+        year = rng.choice([2023, 2024])
+        month = rng.randint(1, 12)
+        end_month = min(12, month + rng.choice([0, 0, 2]))
+        args = {
+            "client_id": str(rng.randint(1, clients)),
+            "aggregation": rng.choice(["sum", "sum", "sum", "count", "avg", "max", "min"]),
+            "direction": rng.choice(["spend", "spend", "income", "both"]),
+            "start_date": f"{year}-{month:02d}-01",
+            "end_date": f"{year}-{end_month:02d}-{rng.choice([15, calendar.monthrange(year, end_month)[1]])}",
+        }
+        kind = rng.random()
+        if kind < 0.3:
+            args["merchants"] = [m.lower() for m, _ in rng.sample(MERCHANTS, rng.randint(1, 3))]
+        elif kind < 0.5:
+            args["category"] = rng.choice(MERCHANTS)[1]
+        elif kind < 0.65:
+            args["descriptions"] = [rng.choice(MERCHANTS)[0].lower()]
+        if rng.random() < 0.3:
+            args["group_by"] = [rng.choice(["cat", "merchant", "txn_date"])]
+        if rng.random() < 0.1:
+            args["limit"] = rng.randint(1, 20)
+        calls.append(args)
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic transactions database and/or CSV.")
+    parser.add_argument("--db", help="Output SQLite database")
+    parser.add_argument("--csv", help="Output CSV in the notebook's data.csv layout")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--rows-per-client", type=int, default=500)
+    parser.add_argument("--merchants", type=int, default=None, help=f"Distinct merchants (default {len(MERCHANTS)})")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2023, 1, 1), help="First transaction date")
+    parser.add_argument("--days", type=int, default=730, help="Days the transactions span")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not args.db and not args.csv:
+        parser.error("give --db and/or --csv")
+    options = dict(
+        clients=args.clients, rows_per_client=args.rows_per_client, seed=args.seed,
+        merchants=args.merchants, start=args.start, days=args.days
+    )
+    if args.db:
+        print(make_transactions_db(args.db, **options))
+    if args.csv:
+        print(make_transactions_csv(args.csv, **options))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+In-memory columnar copy of one client's transactions and a vectorized executor for the
+`query_sql` arguments. A client's rows are loaded once into NumPy arrays (dates as int32
+days, amounts as float64, text columns dictionary-encoded as int32 codes) and every later
+query of that client is answered with boolean masks and `np.bincount`, without SQLite.
+Loaded clients are kept within a memory budget, least recently used first out, and are
+reloaded once the database has been written.
+
+Results are identical to the SQL path: same rows, columns, group order, values and value
+types. Queries the arrays cannot answer exactly return None and go to SQLite: unmigrated
+databases, dates that are not YYYY-MM-DD, description keywords with LIKE wildcards or
+non-ASCII letters, word-tokenizer full-text indexes, sums and averages of REAL amounts
+(SQLite's floating-point sum depends on the order it reads the rows in) and amount
+aggregates over a column mixing integers and floats.
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from query_builder import AGGREGATIONS, ALLOWED_COLUMNS, ISO_DATE, NORMALIZED_COLUMNS_VERSION, fts_match_expression
+
+logger = logging.getLogger(__name__)
+
+# Dictionary-encoded columns: the group_by columns other than amt, plus the filter columns
+TEXT_COLUMNS = ("bank_id", "acc_id", "txn_id", "txn_date", "desc", "cat", "merchant", "merchant_lc")
+LOAD_SQL = (
+    'SELECT bank_id, acc_id, txn_id, txn_date, "desc", cat, merchant, merchant_lc, amt, txn_date_iso, '
+    "txn_date_iso GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' "
+    "FROM transactions WHERE clnt_id = ?"
+)
+# Aggregates whose result depends on the order floating-point amounts are added in
+SUM_AGGREGATIONS = {"sum", "avg"}
+# Description keyword masks kept per client
+MAX_KEYWORDS = 256
+ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def sqlite_order(value):
+    """
+    Sort key matching SQLite's ordering of mixed values: NULL, numbers, text (BINARY), blobs.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def encode(values: list) -> tuple[np.ndarray, list, dict]:
+    """
+    Dictionary-encodes a column. Codes follow SQLite's sort order, so sorting by code sorts
+    like GROUP BY does. Returns the codes, the values by code and the code of each value.
+    """
+    distinct = set(values)
+    try:
+        # Columns of one type (the usual case) sort the same without the key
+        dictionary = sorted(distinct)
+    except TypeError:
+        dictionary = sorted(distinct, key=sqlite_order)
+    index = {value: code for code, value in enumerate(dictionary)}
+    return np.fromiter(map(index.__getitem__, values), dtype=np.int32, count=len(values)), dictionary, index
+
+
+def iso_days(value) -> int | None:
+    """
+    Days since 1970-01-01 of a YYYY-MM-DD date, or None for anything else.
+    """
+    if not isinstance(value, str) or not ISO_DATE.match(value):
+        return None
+    try:
+        return int(np.datetime64(value, "D").astype(np.int64))
+    except ValueError:
+        return None
+
+
+class ClientColumns:
+    """
+    One client's transactions as column arrays.
+    """
+    def __init__(self, rows: list[tuple]):
+        self.rows = len(rows)
+        columns = list(zip(*rows)) if rows else [()] * (len(TEXT_COLUMNS) + 3)
+        self.codes, self.dictionaries, self.indexes = {}, {}, {}
+        for name, values in zip(TEXT_COLUMNS, columns):
+            self.codes[name], self.dictionaries[name], self.indexes[name] = encode(list(values))
+        # Lowercased like SQLite's LOWER(), which folds ASCII letters only; NULL matches no keyword
+        self.lower_descriptions = np.array(
+            [value.translate(ASCII_LOWER) if isinstance(value, str) else "" for value in self.dictionaries["desc"]],
+            dtype=str
+        )
+        # Keyword -> rows whose description contains it; follow-up questions reuse keywords
+        self.keyword_rows = {}
+        amounts, dates, iso = columns[len(TEXT_COLUMNS):]
+        # NaN stands for NULL: it fails every comparison and is skipped by the aggregates
+        self.amounts = np.array([np.nan if value is None else value for value in amounts], dtype=np.float64)
+        # int or float when every amount has that type (what SQLite hands back), None when mixed
+        types = {type(value) for value in amounts if value is not None}
+        self.amount_type = types.pop() if len(types) == 1 else (float if not types else None)
+        if self.amount_type is int and np.nansum(np.abs(self.amounts)) >= 2 ** 53:
+            # Sums could leave float64's exact integers, which SQLite's AVG adds up in
+            self.amount_type = None
+        # Date filters need every row's date as YYYY-MM-DD; otherwise those queries stay on SQLite
+        self.days = None
+        if all(iso):
+            try:
+                self.days = np.array(dates, dtype="datetime64[D]").astype(np.int32)
+            except ValueError:
+                pass
+        self.size = (
+            sum(codes.nbytes for codes in self.codes.values())
+            + self.amounts.nbytes
+            + (self.days.nbytes if self.days is not None else 0)
+            + sum(sys.getsizeof(dictionary) + sum(map(sys.getsizeof, dictionary)) for dictionary in self.dictionaries.values())
+            + self.lower_descriptions.nbytes
+        )
+
+    def column(self, name: str, mask: np.ndarray) -> tuple[np.ndarray, list]:
+        """
+        Codes of the selected rows and the values they stand for.
+        """
+        if name == "amt":
+            # Grouping by amount is rare; encode it on demand
+            codes, dictionary, _ = encode([
+                None if np.isnan(value) else self.amount_type(value) for value in self.amounts[mask].tolist()
+            ])
+            return codes, dictionary
+        return self.codes[name][mask], self.dictionaries[name]
+
+    def exact(self, args: dict) -> bool:
+        """
+        Whether the aggregate and grouping come out identical to SQLite's for these amounts.
+        """
+        uses_amounts = args["aggregation"] != "count" or "amt" in (args.get("group_by") or [])
+        if uses_amounts and self.amount_type is None:
+            return False
+        return args["aggregation"] not in SUM_AGGREGATIONS or self.amount_type is int
+
+    def select(self, args: dict, fts_tokenizer: str) -> np.ndarray | None:
+        """
+        Boolean mask of the rows matching the filters, or None if a filter cannot be matched exactly.
+        """
+        if not self.exact(args):
+            return None
+        mask = np.ones(self.rows, dtype=bool)
+        for key, compare in (("start_date", np.greater_equal), ("end_date", np.less_equal)):
+            if args.get(key):
+                day = iso_days(args[key])
+                if day is None or self.days is None:
+                    return None
+                mask &= compare(self.days, day)
+
+        direction = args.get("direction")
+        if direction == "spend":
+            mask &= self.amounts < 0
+        elif direction == "income":
+            mask &= self.amounts > 0
+
+        if args.get("category"):
+            code = self.indexes["cat"].get(args["category"])
+            if code is None:
+                return mask & False
+            mask &= self.codes["cat"] == code
+
+        merchants = args.get("merchants")
+        if merchants and isinstance(merchants, list):
+            index = self.indexes["merchant_lc"]
+            wanted = np.zeros(len(index), dtype=bool)
+            wanted[[index[name] for name in {m.lower() for m in merchants} if name in index]] = True
+            mask &= wanted[self.codes["merchant_lc"]]
+
+        descriptions = args.get("descriptions")
+        if descriptions and isinstance(descriptions, list):
+            keywords = [str(keyword).lower() for keyword in descriptions]
+            # LIKE wildcards, LIKE's ASCII-only case folding and word-prefix FTS matching are left to SQLite
+            if any("%" in keyword or "_" in keyword or not keyword.isascii() for keyword in keywords):
+                return None
+            if fts_tokenizer and fts_tokenizer != "trigram" and fts_match_expression(
+                    args["client_id"], descriptions, fts_tokenizer):
+                return None
+            mask &= np.logical_or.reduce([self.keyword_mask(keyword) for keyword in keywords])
+        return mask
+
+    def keyword_mask(self, keyword: str) -> np.ndarray:
+        rows = self.keyword_rows.get(keyword)
+        if rows is None:
+            if len(self.keyword_rows) >= MAX_KEYWORDS:
+                self.keyword_rows.clear()
+            matches = np.char.find(self.lower_descriptions, keyword) >= 0 if len(self.lower_descriptions) else np.zeros(0, dtype=bool)
+            rows = self.keyword_rows[keyword] = matches[self.codes["desc"]]
+        return rows
+
+    def aggregate(self, args: dict, mask: np.ndarray) -> list[dict]:
+        """
+        The rows `query_sql` returns for the selected transactions.
+        """
+        aggregation = args["aggregation"]
+        group_by = [column for column in args.get("group_by") or [] if column in ALLOWED_COLUMNS]
+        amounts = self.amounts[mask]
+
+        labels = []
+        if group_by:
+            key = np.zeros(len(amounts), dtype=np.int64)
+            encoded = [(name, *self.column(name, mask)) for name in group_by]
+            for _, codes, dictionary in encoded:
+                # Ranks of the combined key stay below the row count, so the key never overflows
+                _, key = np.unique(key * len(dictionary) + codes, return_inverse=True)
+            _, first, groups = np.unique(key, return_index=True, return_inverse=True)
+            groups = groups.reshape(-1)
+            count = len(first)
+            labels = [(name, [dictionary[code] for code in codes[first]]) for name, codes, dictionary in encoded]
+        else:
+            groups = np.zeros(len(amounts), dtype=np.int64)
+            count = 1
+
+        values = self.reduce(aggregation, amounts, groups, count, self.amount_type)
+        rows = []
+        for i in range(count):
+            row = {name: column[i] for name, column in labels}
+            row[AGGREGATIONS[aggregation]] = values[i]
+            rows.append(row)
+        limit = args.get("limit")
+        if limit and isinstance(limit, int) and limit > 0:
+            rows = rows[:limit]
+        return rows
+
+    @staticmethod
+    def reduce(aggregation: str, amounts: np.ndarray, groups: np.ndarray, count: int, amount_type: type = float) -> list:
+        """
+        Per-group aggregate with SQL semantics: NULL amounts are skipped, and a group without
+        any amount has a NULL sum/avg/min/max. Sums and averages are only asked for integer
+        amounts, which add up exactly in any order; sums of integers are integers, as in SQLite.
+        """
+        if aggregation == "count":
+            return [int(n) for n in np.bincount(groups, minlength=count)]
+        valid = ~np.isnan(amounts)
+        amounts, groups = amounts[valid], groups[valid]
+        present = np.bincount(groups, minlength=count)
+        result_type = float if aggregation == "avg" else amount_type
+        if aggregation in SUM_AGGREGATIONS:
+            totals = np.zeros(count, dtype=np.int64)
+            np.add.at(totals, groups, amounts.astype(np.int64))
+            if aggregation == "avg":
+                totals = totals / np.maximum(present, 1)
+        else:
+            reducer, start = (np.minimum, np.inf) if aggregation == "min" else (np.maximum, -np.inf)
+            totals = np.full(count, start)
+            reducer.at(totals, groups, amounts)
+        return [result_type(total) if n else None for total, n in zip(totals.tolist(), present)]
+
+
+class ColumnarCache:
+    """
+    Loaded clients of one process, keyed by database and client, within `max_bytes`.
+    Entries are tagged with the data version they were loaded at and reloaded once it moves on.
+    """
+    def __init__(self, enabled: bool = False, max_bytes: int = 256 * 1024 * 1024):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # Clients that could not be loaded or exceed max_bytes, by the data version they were tried at
+        self._skipped = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.served = 0
+        self.fallbacks = 0
+
+    def columns(self, pool, client_id: int, version: int) -> ClientColumns | None:
+        key = (pool.db_path, client_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if self._skipped.get(key) == version:
+                return None
+        try:
+            with pool.connection() as conn:
+                rows = conn.execute(LOAD_SQL, (client_id,)).fetchall()
+            columns = ClientColumns(rows)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            # Unexpected column types (text amounts); this client stays on SQLite
+            logger.debug("Columnar load of client %s failed: %s", client_id, e)
+            columns = None
+        with self._lock:
+            self.loads += 1
+            if key in self._entries:
+                self._remove(key)
+            if columns is None or columns.size > self.max_bytes:
+                # Not retried until the data changes
+                self._skipped[key] = version
+                return None
+            self._entries[key] = (columns, version)
+            self.bytes += columns.size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return columns
+
+    def _remove(self, key):
+        columns, _ = self._entries.pop(key)
+        self.bytes -= columns.size
+
+    def execute(self, args: dict, pool, version: int) -> dict | None:
+        """
+        Answers normalized `query_sql` arguments from the client's arrays. Returns None when
+        the query has to go to SQLite instead.
+        """
+        if not self.enabled or pool.user_version < NORMALIZED_COLUMNS_VERSION:
+            return None
+        columns = self.columns(pool, args["client_id"], version)
+        mask = columns.select(args, pool.fts_tokenizer) if columns is not None else None
+        if mask is None:
+            with self._lock:
+                self.fallbacks += 1
+            return None
+        rows = columns.aggregate(args, mask)
+        with self._lock:
+            self.served += 1
+        return {"rows": rows}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._skipped.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "served": self.served,
+                "fallbacks": self.fallbacks,
+            }
+
+
+columnar_cache = ColumnarCache(
+    enabled=os.getenv("COLUMNAR_ENGINE", "0") == "1",
+    max_bytes=int(os.getenv("COLUMNAR_MAX_BYTES", str(256 * 1024 * 1024))),
+)
@@ -0,0 +1,317 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import resolve_repo_path
+
+DEFAULT_DB = os.getenv("TRANSACTIONS_DB", "data/transactions.db")
+
+
+def resolve_db_path(db_path: str = DEFAULT_DB) -> str:
+    """
+    Resolves a database path relative to the repository root.
+    """
+    return resolve_repo_path(db_path)
+
+
+def iso_date_sql(column: str) -> str:
+    """
+    SQL expression that normalizes 'YYYY/MM/DD', 'YYYY-MM-DD' and the raw CSV
+    'DD/MM/YYYY HH:MM' formats to an ISO 'YYYY-MM-DD' date.
+    """
+    return (
+        f"CASE "
+        f"WHEN substr({column}, 5, 1) IN ('/', '-') THEN replace(substr({column}, 1, 10), '/', '-') "
+        f"WHEN substr({column}, 3, 1) = '/' AND substr({column}, 6, 1) = '/' "
+        f"THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) "
+        f"ELSE {column} END"
+    )
+
+
+def detect_fts_tokenizer(conn: sqlite3.Connection) -> str:
+    """
+    Returns the tokenizer of the `transactions_fts` table, or "" if it does not exist.
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions_fts'").fetchone()
+    if row is None:
+        return ""
+    return "trigram" if "trigram" in row[0] else "unicode61"
+
+
+def amount_column_type(conn: sqlite3.Connection) -> str:
+    """
+    Declared type of `transactions.amt` ("REAL" in the notebook's schema), "" if it has none.
+    """
+    for row in conn.execute("PRAGMA table_info(transactions)"):
+        if row[1] == "amt":
+            return row[2]
+    return ""
+
+
+def has_integer_affinity(declared_type: str) -> bool:
+    """
+    SQLite's rule for INTEGER column affinity.
+    """
+    return "INT" in declared_type.upper()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived SQLite connections for one database file.
+    Connections are handed out one thread at a time and returned on exit of `connection()`.
+    """
+    def __init__(
+            self,
+            db_path: str,
+            readonly: bool = True,
+            max_size: int = 8,
+            timeout: float = 10.0,
+            mmap_size: int = 256 * 1024 * 1024,
+            cache_size_kb: int = 64 * 1024,
+            cached_statements: int = 256,
+        ):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.max_size = max_size
+        self.timeout = timeout
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = 0
+        self._closed = False
+        self._user_version = None
+        self._fts_tokenizer = None
+        self._integer_amounts = None
+        self._data_version = 0
+        self._seen_versions = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+        self._enable_wal()
+
+    def _enable_wal(self):
+        """
+        Switches the database to WAL so readers never block on a writer. The journal
+        mode is persistent, so a read-only pool only needs to attempt it once.
+        """
+        if not os.path.exists(self.db_path):
+            return
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.readonly:
+            uri = f"file:{self.db_path}?mode=ro"
+        else:
+            uri = f"file:{self.db_path}"
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only=ON")
+        # A new connection cannot tell which commits happened before it opened
+        self.bump_data_version()
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Returns an idle connection, opening a new one while the pool is below `max_size`
+        and otherwise waiting up to `timeout` seconds for one to be released.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._size < self.max_size
+            if can_open:
+                self._size += 1
+                self.misses += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Timed out waiting for a connection to {self.db_path}")
+        finally:
+            with self._lock:
+                self.waits += 1
+                self.wait_time += time.perf_counter() - start
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """
+        Returns a connection to the pool, rolling back anything left open.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._size -= 1
+                self._seen_versions.pop(id(conn), None)
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @property
+    def user_version(self) -> int:
+        """
+        Schema version written by `migrate.py`, read once per pool. Returns 0 if the
+        database cannot be opened so callers fall back to the unmigrated schema.
+        """
+        if self._user_version is None:
+            try:
+                with self.connection() as conn:
+                    self._user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            except sqlite3.Error:
+                return 0
+        return self._user_version
+
+    @property
+    def fts_tokenizer(self) -> str:
+        """
+        Tokenizer of the `transactions_fts` table ("" if the table does not exist), read once per pool.
+        """
+        if self._fts_tokenizer is None:
+            try:
+                with self.connection() as conn:
+                    self._fts_tokenizer = detect_fts_tokenizer(conn)
+            except sqlite3.Error:
+                return ""
+        return self._fts_tokenizer
+
+    @property
+    def integer_amounts(self) -> bool:
+        """
+        Whether `transactions.amt` has INTEGER affinity, read once per pool.
+        """
+        if self._integer_amounts is None:
+            try:
+                with self.connection() as conn:
+                    self._integer_amounts = has_integer_affinity(amount_column_type(conn))
+            except sqlite3.Error:
+                return False
+        return self._integer_amounts
+
+    def data_version(self) -> int:
+        """
+        Returns a counter that changes whenever the database has been written since the last call.
+        SQLite's `PRAGMA data_version` changes on a connection when any other connection, in this
+        process or another, commits; every pooled connection remembers the value it last saw.
+        """
+        with self.connection() as conn:
+            seen = conn.execute("PRAGMA data_version").fetchone()[0]
+            with self._lock:
+                if self._seen_versions.get(id(conn)) != seen:
+                    self._seen_versions[id(conn)] = seen
+                    self._data_version += 1
+                return self._data_version
+
+    def bump_data_version(self):
+        """
+        Marks the data as changed, for writes made by this process.
+        """
+        with self._lock:
+            self._data_version += 1
+
+    def stats(self) -> dict:
+        """
+        Returns pool counters used to size `max_size`.
+        """
+        with self._lock:
+            requests = self.hits + self.misses + self.waits
+            return {
+                "db_path": self.db_path,
+                "readonly": self.readonly,
+                "size": self._size,
+                "idle": self._idle.qsize(),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "avg_wait": self.wait_time / self.waits if self.waits else 0.0,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._size -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str = DEFAULT_DB, readonly: bool = True, **kwargs) -> ConnectionPool:
+    """
+    Returns the process-wide pool for the given database, creating it on first use.
+    """
+    full_path = resolve_db_path(db_path)
+    key = (full_path, readonly)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            max_size = kwargs.pop("max_size", int(os.getenv("SQLITE_POOL_SIZE", "8")))
+            pool = ConnectionPool(full_path, readonly=readonly, max_size=max_size, **kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats() -> list[dict]:
+    with _pools_lock:
+        return [pool.stats() for pool in _pools.values()]
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,169 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+from utils import resolve_repo_path
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store. Vectors live in a memory-mapped matrix (`vectors.bin`),
+    row i belonging to the i-th hash in `keys.txt`. Both files are append-only, so reloading
+    only encodes texts whose hash has not been seen, and identical texts share one row.
+    Appends take an exclusive lock on `lock` and first pick up rows other processes appended,
+    so server workers and the ingest CLI can share one cache directory.
+    The cache is tied to the model name and encoder backend (torch and ONNX int8 vectors
+    differ slightly); a different model or backend starts a new cache.
+    """
+    def __init__(
+            self,
+            cache_dir: str = "data/embedding_cache",
+            model_name: str = "all-MiniLM-L6-v2",
+            dtype: str = "float32",
+            backend: str = "torch",
+        ):
+        self.cache_dir = resolve_repo_path(cache_dir)
+        self.model_name = model_name
+        self.backend = backend
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.index = {}
+        self._matrix = None
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.meta_path = os.path.join(self.cache_dir, "meta.json")
+        self.keys_path = os.path.join(self.cache_dir, "keys.txt")
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.bin")
+        self.lock_path = os.path.join(self.cache_dir, "lock")
+        with self._file_lock():
+            self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Exclusive lock on the cache directory, across processes.
+        """
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        # Missing files, e.g. from a copy of meta.json alone, leave nothing to trust
+        if not all(os.path.exists(path) for path in (self.meta_path, self.keys_path, self.vectors_path)):
+            self._reset()
+            return
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        if (meta.get("model"), meta.get("backend", "torch"), meta.get("dtype")) != (self.model_name, self.backend, self.dtype.name):
+            self._reset()
+            return
+        self.dim = meta["dim"]
+        with open(self.keys_path) as f:
+            keys = f.read().split()
+        # A write interrupted between the two files leaves extra keys or vectors; keep the common prefix
+        row_bytes = self.dim * self.dtype.itemsize
+        rows = min(len(keys), os.path.getsize(self.vectors_path) // row_bytes)
+        if rows != len(keys) or rows * row_bytes != os.path.getsize(self.vectors_path):
+            # Trim the leftovers, so the next append starts at a row both files agree on
+            with open(self.keys_path, "w") as f:
+                f.write("".join(key + "\n" for key in keys[:rows]))
+            os.truncate(self.vectors_path, rows * row_bytes)
+        self.index = {key: i for i, key in enumerate(keys[:rows])}
+        self._remap(rows)
+
+    def _reset(self):
+        for path in (self.keys_path, self.vectors_path):
+            if os.path.exists(path):
+                os.remove(path)
+        open(self.keys_path, "w").close()
+        open(self.vectors_path, "wb").close()
+        self.dim = None
+        self.index = {}
+        self._matrix = None
+
+    def _remap(self, rows: int):
+        if rows == 0:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+
+    def _write_meta(self):
+        with open(self.meta_path, "w") as f:
+            json.dump({
+                "model": self.model_name,
+                "backend": self.backend,
+                "dtype": self.dtype.name,
+                "dim": self.dim,
+                "count": len(self.index),
+            }, f)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, keys: list[str], vectors: np.ndarray):
+        """
+        Appends vectors for keys that are not cached yet, after reloading the rows other
+        writers appended since this instance last read the files.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._file_lock():
+            self._load()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            rows, new_keys = [], []
+            for key, vector in zip(keys, vectors):
+                if key in self.index or key in new_keys:
+                    continue
+                rows.append(vector)
+                new_keys.append(key)
+            if not new_keys:
+                return
+            start = os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.asarray(rows, dtype=self.dtype).tobytes())
+            with open(self.keys_path, "a") as f:
+                f.write("\n".join(new_keys) + "\n")
+            for i, key in enumerate(new_keys):
+                self.index[key] = start + i
+            self._remap(start + len(new_keys))
+            self._write_meta()
+
+    def get(self, keys: list[str]) -> np.ndarray:
+        """
+        Returns the cached vectors for keys as float32; every key must be cached.
+        """
+        # `add` swaps the index and matrix together
+        with self._lock:
+            rows = [self.index[key] for key in keys]
+            return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def encode(self, texts: list[str], encode_fn, batch_size: int = 1024) -> tuple[np.ndarray, int]:
+        """
+        Returns embeddings for texts, calling `encode_fn` only for texts not in the cache.
+        Also returns how many distinct texts had to be encoded.
+        """
+        keys = [text_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.index and key not in missing:
+                missing[key] = text
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), batch_size):
+            batch_keys = missing_keys[start:start + batch_size]
+            vectors = encode_fn([missing[key] for key in batch_keys])
+            self.add(batch_keys, vectors)
+        if not keys:
+            return np.empty((0, self.dim or 0), dtype=np.float32), 0
+        return self.get(keys), len(missing_keys)
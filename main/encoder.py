@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+ENCODER_MODEL = os.getenv("ENCODER_MODEL", "all-MiniLM-L6-v2")
+# "torch" (default), "onnx", or "onnx-int8" for the quantized ONNX export
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+ENCODER_ONNX_INT8_FILE = os.getenv("ENCODER_ONNX_INT8_FILE", "onnx/model_qint8_avx512.onnx")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+
+
+def load_model(model_name: str, backend: str):
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    if backend == "onnx-int8":
+        return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": ENCODER_ONNX_INT8_FILE})
+    raise ValueError(f"Unknown encoder backend: {backend}")
+
+
+class Encoder:
+    """
+    Sentence embedding model shared by the whole process, with an LRU of query embeddings.
+    The model is loaded once, on first use or by `warm_up`.
+    """
+    def __init__(self, model_name: str = ENCODER_MODEL, backend: str = ENCODER_BACKEND, cache_size: int = QUERY_CACHE_SIZE):
+        self.model_name = model_name
+        self.backend = backend
+        self.cache_size = cache_size
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = load_model(self.model_name, self.backend)
+        return self._model
+
+    def warm_up(self):
+        """
+        Loads the model and runs one encode so the first request does not pay for either.
+        """
+        self.encode(["warm up"])
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, batch_size=batch_size)
+
+    def encode_query(self, query: str) -> list[float]:
+        """
+        Embeds a single query, served from the LRU when the same (whitespace-normalized) text
+        was embedded before. Callers pass the stopword-stripped query.
+        """
+        key = " ".join(query.split())
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = self.encode([key])[0].tolist()
+
+        if self.cache_size > 0:
+            with self._cache_lock:
+                self._cache[key] = vector
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return vector
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "backend": self.backend,
+                "loaded": self._model is not None,
+                "cached_queries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder() -> Encoder:
+    """
+    Returns the process-wide encoder.
+    """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = Encoder()
+    return _encoder
+
+
+def warm_up_in_background() -> threading.Thread:
+    """
+    Starts loading the shared encoder on a daemon thread; requests arriving meanwhile wait for it.
+    """
+    thread = threading.Thread(target=get_encoder().warm_up, name="encoder-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+if os.getenv("ENCODER_WARMUP", "1") == "1":
+    warm_up_in_background()
@@ -0,0 +1,185 @@
+"""
+Adds new transactions to a running deployment in one pass: rows are inserted into SQLite
+and their vectors upserted into Chroma inside one SQLite transaction, which commits only
+once the vectors are written. If the upsert or the commit fails, the vectors written so far
+are deleted again before the rollback frees their uids. Transactions already stored (same clnt_id and txn_id) are
+skipped, so a batch can be sent again safely. The rollups, full-text index and normalized
+columns are kept up to date by the database triggers. Caches keyed on the data version
+(query results, columnar engine, merchant index, LLM replies) see the write on their next
+lookup.
+
+    cd main
+    python ingest.py new_transactions.csv
+    python ingest.py new_transactions.csv --batch-size 5000
+
+The CSV has the columns of the notebook's data.csv: clnt_id, bank_id, acc_id, txn_id,
+txn_date, desc, amt, cat, merchant. clnt_id, txn_id, txn_date and amt are required.
+Run `python migrate.py` first, so the (clnt_id, txn_id) lookup is indexed.
+"""
+import argparse
+import json
+import math
+import sqlite3
+import time
+
+from db import DEFAULT_DB, get_pool, resolve_db_path
+
+COLUMNS = ("clnt_id", "bank_id", "acc_id", "txn_id", "txn_date", "desc", "amt", "cat", "merchant")
+REQUIRED = ("clnt_id", "txn_id", "txn_date", "amt")
+INTEGER_COLUMNS = ("clnt_id", "bank_id", "acc_id", "txn_id")
+
+INSERT_SQL = (
+    'INSERT INTO transactions (uid, clnt_id, bank_id, acc_id, txn_id, txn_date, "desc", amt, cat, merchant) '
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+EXISTING_SQL = "SELECT txn_id FROM transactions WHERE clnt_id = ? AND txn_id IN (SELECT value FROM json_each(?))"
+
+
+def clean_value(value):
+    """
+    None for missing values (None, NaN, empty strings); plain Python types for NumPy scalars.
+    """
+    if hasattr(value, "item"):
+        value = value.item()
+    if value is None or value == "" or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def normalize_transaction(transaction: dict) -> tuple:
+    """
+    Values of one transaction in COLUMNS order. Raises ValueError if a required one is missing.
+    """
+    values = {column: clean_value(transaction.get(column)) for column in COLUMNS}
+    missing = [column for column in REQUIRED if values[column] is None]
+    if missing:
+        raise ValueError(f"Transaction is missing {', '.join(missing)}: {transaction}")
+    for column in INTEGER_COLUMNS:
+        if values[column] is not None:
+            values[column] = int(values[column])
+    values["amt"] = float(values["amt"])
+    return tuple(values[column] for column in COLUMNS)
+
+
+class Ingestor:
+    """
+    Writes batches of new transactions to the database and vector store of `vector_store`.
+    """
+    def __init__(self, vector_store, db_path: str = None, timeout: float = 30.0):
+        self.vector_store = vector_store
+        self.db_path = resolve_db_path(db_path or vector_store.db_path)
+        self.timeout = timeout
+
+    def ingest(self, transactions: list[dict]) -> dict:
+        """
+        Inserts the transactions not stored yet and upserts their vectors. Returns counts and
+        seconds per stage.
+        """
+        start = time.perf_counter()
+        rows = {}
+        for transaction in transactions:
+            row = normalize_transaction(transaction)
+            # The first of several copies in one batch wins
+            rows.setdefault((row[0], row[3]), row)
+
+        report = {
+            "received": len(transactions),
+            "duplicates": len(transactions) - len(rows),
+            "existing": 0,
+            "inserted": 0,
+            "encoded_texts": 0,
+            "insert_seconds": 0.0,
+            "encode_seconds": 0.0,
+            "upsert_seconds": 0.0,
+        }
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.timeout)
+        try:
+            # Takes the write lock up front, so the uids handed out below stay free until COMMIT
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                insert_start = time.perf_counter()
+                by_client = {}
+                for client_id, txn_id in rows:
+                    by_client.setdefault(client_id, []).append(txn_id)
+                existing = set()
+                for client_id, txn_ids in by_client.items():
+                    existing.update(
+                        (client_id, txn_id) for (txn_id,) in conn.execute(EXISTING_SQL, (client_id, json.dumps(txn_ids)))
+                    )
+                new = [row for key, row in rows.items() if key not in existing]
+                next_uid = conn.execute("SELECT COALESCE(MAX(uid), -1) + 1 FROM transactions").fetchone()[0]
+                uids = list(range(next_uid, next_uid + len(new)))
+                conn.executemany(INSERT_SQL, [(uid, *row) for uid, row in zip(uids, new)])
+                report["insert_seconds"] = time.perf_counter() - insert_start
+
+                client_ids = [row[0] for row in new]
+                if new:
+                    try:
+                        report.update(self.vector_store.upsert_transactions(
+                            uids,
+                            client_ids,
+                            [row[5] for row in new],
+                            [row[8] for row in new]
+                        ))
+                        conn.execute("COMMIT")
+                    except BaseException:
+                        # The rollback frees these uids, so their vectors must not outlive it
+                        self.vector_store.delete_transactions(uids, client_ids)
+                        raise
+                else:
+                    conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        get_pool(self.db_path).bump_data_version()
+        for client_id in set(client_ids):
+            self.vector_store.retriever.invalidate(client_id)
+
+        seconds = time.perf_counter() - start
+        report.update(
+            existing=len(existing),
+            inserted=len(new),
+            seconds=seconds,
+            rows_per_sec=len(transactions) / seconds if seconds else 0.0,
+        )
+        return report
+
+
+def ingest_csv(ingestor: Ingestor, file_path: str, batch_size: int = 1000) -> dict:
+    """
+    Ingests a CSV in batches of `batch_size` rows and sums the batch reports.
+    """
+    import pandas as pd
+
+    total = {}
+    start = time.perf_counter()
+    for chunk in pd.read_csv(file_path, chunksize=batch_size, dtype={"desc": str, "merchant": str, "cat": str, "txn_date": str}):
+        report = ingestor.ingest(chunk.to_dict("records"))
+        for key, value in report.items():
+            if key != "rows_per_sec":
+                total[key] = total.get(key, 0) + value
+    seconds = time.perf_counter() - start
+    total["seconds"] = seconds
+    total["rows_per_sec"] = total.get("received", 0) / seconds if seconds else 0.0
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="CSV of new transactions")
+    parser.add_argument("--db", default=DEFAULT_DB, help="Database path, relative to the repository root")
+    parser.add_argument("--persist-dir", default="data/chroma_store", help="Chroma directory, relative to the repository root")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per SQLite transaction")
+    args = parser.parse_args()
+
+    from vector_store import VectorStore
+
+    store = VectorStore(db_path=args.db, persist_dir=args.persist_dir)
+    print(json.dumps(ingest_csv(Ingestor(store), args.file, args.batch_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
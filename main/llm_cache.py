@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_pool, resolve_db_path
+
+
+def completion_key(model: str, messages: list, tools: list, temperature: float, data_version: str) -> str:
+    """
+    Hash of everything that decides a completion: the model, the full message list, the tools
+    schema and the sampling temperature, plus the version of the data the tool results came from.
+    Tool call ids are left out; providers make them up per call and no later message refers to them.
+    """
+    def strip_ids(message):
+        if not isinstance(message, dict) or not message.get("tool_calls"):
+            return message
+        calls = [{k: v for k, v in call.items() if k != "id"} for call in message["tool_calls"]]
+        return {**message, "tool_calls": calls}
+
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": [strip_ids(message) for message in messages],
+            "tools": tools,
+            "temperature": temperature,
+            "data_version": data_version,
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def data_fingerprint(db_path: str) -> str:
+    """
+    Version of the transactions data that stays the same across processes, so the on-disk
+    tier can tell results computed on older data: the schema version, row count and highest
+    uid. Recomputed only when the pool sees a write.
+    """
+    pool = get_pool(db_path)
+    version = pool.data_version()
+    with _fingerprints_lock:
+        cached = _fingerprints.get(db_path)
+        if cached and cached[0] == version:
+            return cached[1]
+    with pool.connection() as conn:
+        schema = conn.execute("PRAGMA user_version").fetchone()[0]
+        rows, last_uid = conn.execute("SELECT COUNT(*), MAX(uid) FROM transactions").fetchone()
+    fingerprint = f"{schema}:{rows}:{last_uid}"
+    with _fingerprints_lock:
+        _fingerprints[db_path] = (version, fingerprint)
+    return fingerprint
+
+
+class CompletionCache:
+    """
+    Cache of assistant messages by `completion_key`: an in-memory LRU of `max_entries`, backed
+    by an optional SQLite file that survives restarts. Entries older than `ttl` seconds are misses.
+    """
+    def __init__(self, max_entries: int = 256, db_path: str = None, ttl: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.db_path = resolve_db_path(db_path) if db_path else None
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk(self) -> sqlite3.Connection:
+        """
+        Connection to the on-disk tier, opened on first use. Callers hold `_lock`.
+        """
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, message TEXT, created REAL)"
+            )
+        return self._conn
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            row = None
+            if self.db_path:
+                try:
+                    row = self._disk().execute(
+                        "SELECT message, created FROM completions WHERE key = ?", (key,)
+                    ).fetchone()
+                except sqlite3.Error:
+                    row = None
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            message = json.loads(row[0])
+            self._remember(key, message, row[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return message
+
+    def put(self, key: str, message: dict):
+        now = time.time()
+        with self._lock:
+            self._remember(key, message, now)
+            if self.db_path:
+                try:
+                    conn = self._disk()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO completions (key, message, created) VALUES (?, ?, ?)",
+                        (key, json.dumps(message), now)
+                    )
+                    conn.commit()
+                except sqlite3.Error:
+                    pass
+
+    def _remember(self, key: str, message: dict, created: float):
+        self._entries[key] = (message, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.db_path and os.path.exists(self.db_path):
+                conn = self._disk()
+                conn.execute("DELETE FROM completions")
+                conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "db_path": self.db_path,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+llm_cache = CompletionCache(
+    max_entries=int(os.getenv("LLM_CACHE_SIZE", "256")),
+    db_path=os.getenv("LLM_CACHE_DB", "data/llm_cache.db") or None,
+    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+)
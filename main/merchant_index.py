@@ -0,0 +1,134 @@
+import difflib
+import os
+import threading
+from collections import Counter, OrderedDict
+
+from db import get_pool
+from utils import clean_text
+
+
+class ClientVocabulary:
+    """
+    Normalized merchant names and description tokens of one client, with their row counts.
+    """
+    def __init__(self, rows: list[tuple]):
+        self.merchants = Counter()
+        self.description_tokens = Counter()
+        for desc, merchant in rows:
+            if merchant:
+                name = merchant.lower().strip()
+                if name:
+                    self.merchants[name] += 1
+            if desc:
+                self.description_tokens.update(set(clean_text(desc).split()))
+
+        # Merchant token -> merchants containing it, so "eats" finds "uber eats"
+        self.merchant_tokens = {}
+        for name in self.merchants:
+            for token in clean_text(name).split():
+                self.merchant_tokens.setdefault(token, set()).add(name)
+
+    def match(self, tokens: list[str], fuzzy_cutoff: float = 0.85) -> tuple[list[str], list[str]]:
+        """
+        Returns merchants matched by query tokens (exactly, or by close spelling) and the query
+        tokens found in the client's descriptions, both ordered by how often the client uses them.
+        """
+        merchants = set()
+        keywords = set()
+        for token in tokens:
+            if token in self.merchant_tokens:
+                merchants.update(self.merchant_tokens[token])
+            elif len(token) >= 4:
+                for close in difflib.get_close_matches(token, self.merchant_tokens.keys(), n=3, cutoff=fuzzy_cutoff):
+                    merchants.update(self.merchant_tokens[close])
+            if token in self.description_tokens:
+                keywords.add(token)
+        return (
+            sorted(merchants, key=lambda name: (-self.merchants[name], name)),
+            sorted(keywords, key=lambda token: (-self.description_tokens[token], token))
+        )
+
+
+class MerchantIndex:
+    """
+    Per-client in-memory merchant and keyword index, built lazily from SQLite on a client's first
+    question and evicted least-recently-used. Answers exact and fuzzy token matches so retrieval
+    only needs the vector store when nothing in the client's vocabulary matches.
+    """
+    def __init__(self, db_path: str, max_clients: int = 256, min_token_length: int = 3):
+        self.db_path = db_path
+        self.max_clients = max_clients
+        self.min_token_length = min_token_length
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.evictions = 0
+
+    def vocabulary(self, client_id: int) -> ClientVocabulary:
+        pool = get_pool(self.db_path)
+        version = pool.data_version()
+        key = int(client_id)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is not None and entry[0] == version:
+                self._clients.move_to_end(key)
+                return entry[1]
+
+        with pool.connection() as conn:
+            rows = conn.execute('SELECT "desc", merchant FROM transactions WHERE clnt_id = ?', (key,)).fetchall()
+        vocabulary = ClientVocabulary(rows)
+
+        with self._lock:
+            self.builds += 1
+            self._clients[key] = (version, vocabulary)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+        return vocabulary
+
+    def lookup(self, client_id: int, query: str):
+        """
+        Returns (merchants, description keywords) for a stopword-stripped query, or None when
+        nothing matched and the caller should fall back to vector retrieval.
+        """
+        tokens = [token for token in clean_text(query).split() if len(token) >= self.min_token_length]
+        merchants, keywords = ([], [])
+        if tokens:
+            merchants, keywords = self.vocabulary(client_id).match(tokens)
+        with self._lock:
+            if merchants or keywords:
+                self.hits += 1
+                return merchants, keywords
+            self.misses += 1
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "clients": len(self._clients),
+                "index_served": self.hits,
+                "vector_fallbacks": self.misses,
+                "index_rate": self.hits / lookups if lookups else 0.0,
+                "builds": self.builds,
+                "evictions": self.evictions,
+            }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_merchant_index(db_path: str) -> MerchantIndex:
+    """
+    Returns the process-wide merchant index for the given database.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is None:
+            index = MerchantIndex(db_path, max_clients=int(os.getenv("MERCHANT_INDEX_CLIENTS", "256")))
+            _indexes[db_path] = index
+        return index
@@ -0,0 +1,252 @@
+"""
+Versioned schema migrations for the transactions database.
+The applied version is stored in `PRAGMA user_version`.
+
+    cd main
+    python migrate.py             # apply all pending migrations
+    python migrate.py --status    # show applied and pending migrations
+    python migrate.py --verify    # check that every query_sql shape is served by an index
+
+Running processes read the schema version once per connection pool, so restart the app after migrating.
+"""
+import argparse
+import itertools
+import sqlite3
+import sys
+
+from db import DEFAULT_DB, amount_column_type, detect_fts_tokenizer, has_integer_affinity, iso_date_sql, resolve_db_path
+from query_builder import AGGREGATIONS, build_query
+from rollup import create_rollup_tables, create_rollup_triggers, rebuild_rollups
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def migration_1_normalized_columns(conn: sqlite3.Connection, **options):
+    """
+    Adds `txn_date_iso` and `merchant_lc`, keeps them filled by triggers, and indexes
+    the per-client access paths used by query_sql.
+    """
+    add_column(conn, "transactions", "txn_date_iso", "TEXT")
+    add_column(conn, "transactions", "merchant_lc", "TEXT")
+
+    conn.execute(f"""
+        UPDATE transactions
+        SET txn_date_iso = {iso_date_sql("txn_date")},
+            merchant_lc = LOWER(merchant)
+    """)
+
+    for event in ("INSERT", "UPDATE OF txn_date, merchant"):
+        name = "trg_transactions_normalize_" + event.split()[0].lower()
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"""
+            CREATE TRIGGER {name} AFTER {event} ON transactions
+            BEGIN
+                UPDATE transactions
+                SET txn_date_iso = {iso_date_sql("NEW.txn_date")},
+                    merchant_lc = LOWER(NEW.merchant)
+                WHERE rowid = NEW.rowid;
+            END
+        """)
+
+    # amt is included so sum/count/avg/min/max over these paths never touch the table
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txn_clnt_date ON transactions (clnt_id, txn_date_iso, amt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txn_clnt_cat_date ON transactions (clnt_id, cat, txn_date_iso, amt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txn_clnt_merchant ON transactions (clnt_id, merchant_lc, txn_date_iso, amt)")
+    conn.execute("ANALYZE transactions")
+
+
+def migration_2_fts(conn: sqlite3.Connection, fts_tokenizer: str = "trigram", **options):
+    """
+    Adds the contentless `transactions_fts` full-text index over desc/merchant, kept in sync by triggers.
+    Each row also indexes a `clnt_tag` token ("|<clnt_id>|") so a MATCH is scoped to one client's
+    rows instead of every client's. The trigram tokenizer serves substring matches; "unicode61"
+    builds a smaller word index with prefix indexes for word-prefix matches.
+    """
+    if fts_tokenizer == "trigram":
+        tokenize = "tokenize='trigram'"
+    else:
+        tokenize = f"tokenize='{fts_tokenizer}', prefix='2 3 4'"
+    conn.execute("DROP TABLE IF EXISTS transactions_fts")
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE transactions_fts USING fts5(
+            clnt_tag, "desc", merchant, content='', {tokenize}
+        )
+    """)
+    conn.execute("""
+        INSERT INTO transactions_fts(rowid, clnt_tag, "desc", merchant)
+        SELECT rowid, '|' || clnt_id || '|', "desc", merchant FROM transactions
+    """)
+
+    insert_new = """
+        INSERT INTO transactions_fts(rowid, clnt_tag, "desc", merchant)
+        VALUES (NEW.rowid, '|' || NEW.clnt_id || '|', NEW."desc", NEW.merchant);"""
+    # A contentless table needs the originally indexed values to remove a row
+    delete_old = """
+        INSERT INTO transactions_fts(transactions_fts, rowid, clnt_tag, "desc", merchant)
+        VALUES ('delete', OLD.rowid, '|' || OLD.clnt_id || '|', OLD."desc", OLD.merchant);"""
+    triggers = {
+        "trg_transactions_fts_insert": f"AFTER INSERT ON transactions BEGIN {insert_new} END",
+        "trg_transactions_fts_delete": f"AFTER DELETE ON transactions BEGIN {delete_old} END",
+        "trg_transactions_fts_update": (
+            f'AFTER UPDATE OF clnt_id, "desc", merchant ON transactions BEGIN {delete_old} {insert_new} END'
+        ),
+    }
+    for name, body in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def migration_3_rollups(conn: sqlite3.Connection, **options):
+    """
+    Adds the daily and monthly rollup tables (see rollup.py), fills them and installs their triggers.
+    """
+    create_rollup_tables(conn)
+    rebuild_rollups(conn)
+    create_rollup_triggers(conn)
+
+
+def migration_4_transaction_ids(conn: sqlite3.Connection, **options):
+    """
+    Indexes (clnt_id, txn_id), which ingest.py looks up to skip transactions it already has.
+    Not unique, so databases that already hold duplicate ids still migrate.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_txn_clnt_txn ON transactions (clnt_id, txn_id)")
+    conn.execute("ANALYZE transactions")
+
+
+MIGRATIONS = [
+    (1, "ISO date and lowercase merchant columns with per-client covering indexes", migration_1_normalized_columns),
+    (2, "FTS5 index over desc/merchant for the descriptions filter", migration_2_fts),
+    (3, "Per-client daily and monthly rollups by category and merchant", migration_3_rollups),
+    (4, "Per-client transaction id index for idempotent ingestion", migration_4_transaction_ids),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str = DEFAULT_DB, target: int = None, **options) -> list[int]:
+    """
+    Applies pending migrations up to `target` (default: latest), each in its own transaction.
+    `options` (e.g. `fts_tokenizer`) are passed to every migration. Returns the versions applied.
+    """
+    target = LATEST_VERSION if target is None else target
+    conn = sqlite3.connect(resolve_db_path(db_path), isolation_level=None)
+    applied = []
+    try:
+        version = current_version(conn)
+        for number, description, apply in MIGRATIONS:
+            if number <= version or number > target:
+                continue
+            print(f"Applying migration {number}: {description}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                apply(conn, **options)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append(number)
+    finally:
+        conn.close()
+    return applied
+
+
+def query_shapes(schema_version: int, tokenizer: str = "", integer_amounts: bool = False):
+    """
+    Yields (args, sql, params) for every filter combination query_sql can emit.
+    """
+    filters = {
+        "start_date": "2024-01-01",
+        "end_date": "2024-12-31",
+        "direction": "spend",
+        "category": "Travel",
+        "merchants": ["uber"],
+        "descriptions": ["uber"],
+    }
+    group_bys = [None, ["cat"], ["merchant"], ["txn_date"], ["cat", "merchant"]]
+    for aggregation in AGGREGATIONS:
+        for used in itertools.product([False, True], repeat=len(filters)):
+            for group_by in group_bys:
+                args = {name: value for (name, value), on in zip(filters.items(), used) if on}
+                args.update(client_id=1, aggregation=aggregation, group_by=group_by)
+                if group_by is None and used[1]:
+                    # Also cover the whole-month range served by the monthly rollup
+                    args["end_date"] = "2024-11-30"
+                sql, params = build_query(
+                    **args, schema_version=schema_version, fts_tokenizer=tokenizer, integer_amounts=integer_amounts
+                )
+                yield args, sql, params
+
+
+def verify_indexes(db_path: str = DEFAULT_DB) -> list[dict]:
+    """
+    Runs EXPLAIN QUERY PLAN on every query shape and returns the shapes that scan the table they read
+    (`transactions` or a rollup table).
+    """
+    conn = sqlite3.connect(resolve_db_path(db_path))
+    schema_version = current_version(conn)
+    tokenizer = detect_fts_tokenizer(conn)
+    integer_amounts = has_integer_affinity(amount_column_type(conn))
+    failures = []
+    seen = set()
+    try:
+        for args, sql, params in query_shapes(schema_version, tokenizer, integer_amounts):
+            if sql in seen:
+                continue
+            seen.add(sql)
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            table = sql.split(" FROM ", 1)[1].split()[0]
+            scans = [step for step in plan if step.split()[:2] == ["SCAN", table]]
+            uses_index = any(step.split()[:2] == ["SEARCH", table] for step in plan)
+            if scans or not uses_index:
+                failures.append({"args": args, "sql": sql, "plan": plan})
+    finally:
+        conn.close()
+    print(f"Checked {len(seen)} query shapes at schema version {schema_version}: {len(failures)} without an index")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="Database path, relative to the repository root")
+    parser.add_argument("--target", type=int, default=None, help="Migrate up to this version")
+    parser.add_argument("--status", action="store_true", help="Show migration status and exit")
+    parser.add_argument("--verify", action="store_true", help="Verify query plans after migrating")
+    parser.add_argument(
+        "--fts-tokenizer", default="trigram", choices=["trigram", "unicode61"],
+        help="Tokenizer for the full-text index: trigram (substring matches) or unicode61 (word prefixes)"
+    )
+    args = parser.parse_args()
+
+    if args.status:
+        conn = sqlite3.connect(resolve_db_path(args.db))
+        version = current_version(conn)
+        conn.close()
+        for number, description, _ in MIGRATIONS:
+            state = "applied" if number <= version else "pending"
+            print(f"{number:>3}  {state:<8} {description}")
+        return
+
+    applied = migrate(args.db, args.target, fts_tokenizer=args.fts_tokenizer)
+    if not applied:
+        print("Database is up to date.")
+
+    if args.verify:
+        failures = verify_indexes(args.db)
+        for failure in failures:
+            print(f"\n{failure['sql']}\n  " + "\n  ".join(failure["plan"]))
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
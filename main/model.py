@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 load_dotenv()
 
@@ -12,3 +12,8 @@ class Model:
             base_url=self.base_url,
             api_key=self.api_key
         )
+        # Used by Agent.achat; one client multiplexes all conversations of the process
+        self.async_client = AsyncOpenAI(
+            base_url=self.base_url,
+            api_key=self.api_key
+        )
@@ -0,0 +1,242 @@
+"""
+Partitioned layouts for the transaction vectors. In the default "single" layout every client
+shares one collection and queries filter on client_id, which makes HNSW search the global
+graph. "client" gives each client its own collection; "bucket" hashes clients into a fixed
+number of collections, for deployments with too many clients for one collection each.
+
+    cd main
+    python partitions.py --status
+    python partitions.py --migrate --mode client
+    python partitions.py --migrate --mode bucket --buckets 64 --drop-source
+"""
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import chromadb
+from chromadb.config import Settings
+from chromadb.errors import NotFoundError
+
+from utils import resolve_repo_path
+
+PARTITION_MODES = ("single", "client", "bucket")
+DEFAULT_BUCKETS = 64
+LAYOUT_FILE = "layout.json"
+
+
+def chroma_client(persist_dir: str):
+    """
+    Persistent Chroma client. VECTOR_MEMORY_LIMIT_BYTES bounds the loaded segments, which are
+    then unloaded least-recently-used.
+    """
+    memory_limit = int(os.getenv("VECTOR_MEMORY_LIMIT_BYTES", "0"))
+    settings = Settings(anonymized_telemetry=False)
+    if memory_limit > 0:
+        settings = Settings(
+            anonymized_telemetry=False,
+            chroma_segment_cache_policy="LRU",
+            chroma_memory_limit_bytes=memory_limit
+        )
+    return chromadb.PersistentClient(path=persist_dir, settings=settings)
+
+
+def read_layouts(persist_dir: str) -> dict:
+    """
+    Partition layouts recorded in the Chroma directory, by base collection name.
+    """
+    path = os.path.join(persist_dir, LAYOUT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_layout(persist_dir: str, collection_name: str) -> dict | None:
+    return read_layouts(persist_dir).get(collection_name)
+
+
+def write_layout(persist_dir: str, collection_name: str, mode: str, buckets: int):
+    layouts = read_layouts(persist_dir)
+    layouts[collection_name] = {"mode": mode, "buckets": buckets}
+    os.makedirs(persist_dir, exist_ok=True)
+    with open(os.path.join(persist_dir, LAYOUT_FILE), "w") as f:
+        json.dump(layouts, f, indent=2)
+
+
+def partition_name(base: str, mode: str, client_id: int, buckets: int = DEFAULT_BUCKETS) -> str:
+    if mode == "single":
+        return base
+    if mode == "client":
+        return f"{base}_c{int(client_id)}"
+    if mode == "bucket":
+        return f"{base}_b{int(client_id) % buckets:04d}"
+    raise ValueError(f"Unknown partition mode: {mode}")
+
+
+class CollectionRouter:
+    """
+    Maps a client to the collection holding its vectors. Collection handles are opened on
+    first use and at most `max_open` are kept; the least recently used are dropped.
+    """
+    def __init__(self, client, base_name: str = "transactions", mode: str = "single", buckets: int = DEFAULT_BUCKETS, max_open: int = 128):
+        if mode not in PARTITION_MODES:
+            raise ValueError(f"Unknown partition mode: {mode}")
+        self.client = client
+        self.base_name = base_name
+        self.mode = mode
+        self.buckets = buckets
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.unloaded = 0
+
+    def name_for(self, client_id: int) -> str:
+        return partition_name(self.base_name, self.mode, client_id, self.buckets)
+
+    def where(self, client_id: int) -> dict | None:
+        """
+        Metadata filter still needed inside the client's partition.
+        """
+        return None if self.mode == "client" else {"client_id": client_id}
+
+    def collection_for(self, client_id: int = None, create: bool = True):
+        """
+        Returns the collection for a client, or None when it does not exist and `create` is False.
+        """
+        name = self.base_name if self.mode == "single" else self.name_for(client_id)
+        with self._lock:
+            collection = self._open.get(name)
+            if collection is not None:
+                self._open.move_to_end(name)
+                return collection
+
+        if create:
+            collection = self.client.get_or_create_collection(name)
+        else:
+            try:
+                collection = self.client.get_collection(name)
+            except NotFoundError:
+                return None
+
+        with self._lock:
+            self._open[name] = collection
+            self._open.move_to_end(name)
+            self.opened += 1
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+                self.unloaded += 1
+        return collection
+
+    def split(self, client_ids: list) -> dict[str, list[int]]:
+        """
+        Groups row positions by the partition their client belongs to.
+        """
+        groups = {}
+        for i, client_id in enumerate(client_ids):
+            groups.setdefault(self.name_for(client_id), []).append(i)
+        return groups
+
+    def add(self, ids: list, documents: list, embeddings: list, metadatas: list, upsert: bool = False):
+        """
+        Adds vectors, sending each row to its client's partition. With `upsert`, existing ids
+        are overwritten instead of rejected.
+        """
+        method = "upsert" if upsert else "add"
+        if self.mode == "single":
+            getattr(self.collection_for(), method)(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+            return
+        for rows in self.split([meta["client_id"] for meta in metadatas]).values():
+            client_id = metadatas[rows[0]]["client_id"]
+            getattr(self.collection_for(client_id), method)(
+                ids=[ids[i] for i in rows],
+                documents=[documents[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows],
+                metadatas=[metadatas[i] for i in rows]
+            )
+
+    def delete(self, ids: list, client_ids: list):
+        """
+        Deletes vectors by id from their clients' partitions. Ids that are not stored are ignored.
+        """
+        if self.mode == "single":
+            self.collection_for().delete(ids=ids)
+            return
+        for rows in self.split(client_ids).values():
+            collection = self.collection_for(client_ids[rows[0]], create=False)
+            if collection is not None:
+                collection.delete(ids=[ids[i] for i in rows])
+
+    def partition_names(self) -> list[str]:
+        names = [collection.name for collection in self.client.list_collections()]
+        if self.mode == "single":
+            return [name for name in names if name == self.base_name]
+        prefix = f"{self.base_name}_{'c' if self.mode == 'client' else 'b'}"
+        return [name for name in names if name.startswith(prefix) and name[len(prefix):].isdigit()]
+
+    def drop(self):
+        """
+        Deletes every collection of this layout.
+        """
+        with self._lock:
+            self._open.clear()
+        for name in self.partition_names():
+            self.client.delete_collection(name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "buckets": self.buckets if self.mode == "bucket" else None,
+                "open": len(self._open),
+                "opened": self.opened,
+                "unloaded": self.unloaded,
+            }
+
+
+def migrate_collection(persist_dir: str, source: str = "transactions", mode: str = "client", buckets: int = DEFAULT_BUCKETS, batch_size: int = 1000, drop_source: bool = False) -> dict:
+    """
+    Copies the vectors of a single collection into a partitioned layout, keeping ids,
+    documents, embeddings and metadata, and records the new layout for `VectorStore`.
+    """
+    client = chroma_client(persist_dir)
+    source_collection = client.get_collection(source)
+    router = CollectionRouter(client, source, mode, buckets)
+    total = source_collection.count()
+    for offset in range(0, total, batch_size):
+        batch = source_collection.get(offset=offset, limit=batch_size, include=["embeddings", "documents", "metadatas"])
+        router.add(
+            batch["ids"],
+            batch["documents"],
+            [list(vector) for vector in batch["embeddings"]],
+            batch["metadatas"]
+        )
+    partitions = router.partition_names()
+    if drop_source:
+        client.delete_collection(source)
+    write_layout(persist_dir, source, mode, buckets)
+    return {"vectors": total, "partitions": len(partitions), "mode": mode}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--persist-dir", default="data/chroma_store", help="Chroma directory, relative to the repository root")
+    parser.add_argument("--collection", default="transactions", help="Single collection to migrate from")
+    parser.add_argument("--migrate", action="store_true", help="Copy the single collection into partitions")
+    parser.add_argument("--mode", default="client", choices=["client", "bucket"])
+    parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS)
+    parser.add_argument("--drop-source", action="store_true", help="Delete the single collection after copying")
+    parser.add_argument("--status", action="store_true", help="Show the recorded layout")
+    args = parser.parse_args()
+
+    persist_dir = resolve_repo_path(args.persist_dir)
+    if args.migrate:
+        print(json.dumps(migrate_collection(persist_dir, args.collection, args.mode, args.buckets, drop_source=args.drop_source)))
+    if args.status or not args.migrate:
+        print(json.dumps({args.collection: read_layout(persist_dir, args.collection) or {"mode": "single"}}))
+
+
+if __name__ == "__main__":
+    main()
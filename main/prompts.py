@@ -1,6 +1,41 @@
 import datetime
 
-SYSTEM_PROMPT = """
+CATEGORIES = [
+    "Shops",
+    "Telecommunication Services",
+    "Utilities",
+    "Insurance",
+    "Clothing and Accessories",
+    "Digital Entertainment",
+    "Gyms and Fitness Centers",
+    "Department Stores",
+    "Healthcare",
+    "Service",
+    "Travel",
+    "Arts and Entertainment",
+    "Interest",
+    "Tax Refund",
+    "Bank Fee",
+    "Payment",
+    "Restaurants",
+    "Supermarkets and Groceries",
+    "Gas Stations",
+    "Convenience Stores",
+    "Loans",
+    "Transfer Credit",
+    "Transfer Deposit",
+    "Payroll",
+    "Uncategorized",
+    "Check Deposit",
+    "Third Party",
+    "Internal Account Transfer",
+    "Bank Fees",
+    "Transfer",
+    "Transfer Debit",
+    "ATM",
+]
+
+STATIC_PROMPT = """
 You are a financial assistant that helps users analyze and summarise their bank transaction history using natural language. Use markdown if necessary.
 First, understand the user's query and intent clearly and carefully.
 Have normal conversation with the user if the user's query is not related to bank transactions and tell them how you can help them with their bank transactions.
@@ -140,65 +175,58 @@ Call this only after a successful `query_sql` response and when the user request
 ## All Transaction Categories
 Use categories as the primary filter when the user's intent clearly matches known types of spending or income (e.g., groceries, travel, payroll, fees, etc.).
 
-- Shops
-- Telecommunication Services
-- Utilities
-- Insurance
-- Clothing and Accessories
-- Digital Entertainment
-- Gyms and Fitness Centers
-- Department Stores
-- Healthcare
-- Service
-- Travel
-- Arts and Entertainment
-- Interest
-- Tax Refund
-- Bank Fee
-- Payment
-- Restaurants
-- Supermarkets and Groceries
-- Gas Stations
-- Convenience Stores
-- Loans
-- Transfer Credit
-- Transfer Deposit
-- Payroll
-- Uncategorized
-- Check Deposit
-- Third Party
-- Internal Account Transfer
-- Bank Fees
-- Transfer
-- Transfer Debit
-- ATM
+""" + "\n".join(f"- {category}" for category in CATEGORIES) + """
 
 ---
 
 ## Semantic Merchant Candidates
-These merchant names were semantically retrieved from transaction history using vector similarity.
+The next system message lists merchant names semantically retrieved from the client's transaction history for this question, most relevant first.
 They are more reliable than raw descriptions.
 
 **If the user’s query mentions or implies a specific store, company, brand, or vendor, prioritize using these merchant names for filtering.**
 
-{merchants}
-
----
-
 ## Semantic Description Keywords
-These terms were semantically retrieved from unstructured transaction descriptions using vector search.
+The next system message also lists terms semantically retrieved from unstructured transaction descriptions, most relevant first.
 They are context-dependent and least reliable than categories and merchant names.
 
 **Only use them if the user's query clearly implies a need to search for unstructured terms inside the description field and no relevant merchant match is available.**
+"""
 
-{descriptions}
+# Per-question part of the system prompt. It is sent as a second system message after the
+# static prompt above, so the static prefix is byte-identical across every request.
+DYNAMIC_PROMPT = """Semantic Merchant Candidates: {merchants}
+Semantic Description Keywords: {descriptions}
+Today's Date is {today}"""
 
-## Today's Date is {today}
-"""
+SYSTEM_PROMPT = STATIC_PROMPT + "\n" + DYNAMIC_PROMPT
 
 today = datetime.datetime.now().strftime("%Y-%m-%d")
 
+def dynamic_prompt(merchants, descriptions, today, max_merchants=0, max_descriptions=0):
+    """
+    Renders the per-question suffix. Both lists are expected most relevant first; a positive
+    `max_merchants` / `max_descriptions` keeps only that many.
+    """
+    merchants = list(merchants or [])
+    descriptions = list(descriptions or [])
+    if max_merchants > 0:
+        merchants = merchants[:max_merchants]
+    if max_descriptions > 0:
+        descriptions = descriptions[:max_descriptions]
+    return DYNAMIC_PROMPT.format(
+        merchants=", ".join(merchants) if merchants else "None provided",
+        descriptions=", ".join(descriptions) if descriptions else "None provided",
+        today=today
+    )
+
+def system_messages(merchants, descriptions, today, max_merchants=0, max_descriptions=0):
+    """
+    The static prompt and the per-question suffix as two system messages.
+    """
+    return [
+        {"role": "system", "content": STATIC_PROMPT},
+        {"role": "system", "content": dynamic_prompt(merchants, descriptions, today, max_merchants, max_descriptions)},
+    ]
+
 def system_prompt(merchants, descriptions, today):
-    merchants = "\n- " + "\n- ".join(merchants) if merchants else "None provided"
-    descriptions = "\n- " + "\n- ".join(descriptions) if descriptions else "None provided"
-    return SYSTEM_PROMPT.format(merchants=merchants, descriptions=descriptions, today=today)
+    return STATIC_PROMPT + "\n" + dynamic_prompt(merchants, descriptions, today)
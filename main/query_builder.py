@@ -0,0 +1,272 @@
+import calendar
+import json
+import re
+from functools import lru_cache
+
+ALLOWED_COLUMNS = {
+    "bank_id", "acc_id", "txn_id", "txn_date", "desc", "amt", "cat", "merchant"
+}
+
+AGGREGATIONS = {
+    "sum": "SUM(amt)",
+    "count": "COUNT(*)",
+    "avg": "AVG(amt)",
+    "max": "MAX(amt)",
+    "min": "MIN(amt)"
+}
+
+# Schema versions (see migrate.py) that change which columns the builder can use
+NORMALIZED_COLUMNS_VERSION = 1
+FTS_VERSION = 2
+ROLLUP_VERSION = 3
+
+# Aggregates over the rollup tables, aliased to the column names the raw query returns
+ROLLUP_AGGREGATIONS = {
+    "sum": 'SUM(total) AS "SUM(amt)"',
+    "count": 'COALESCE(SUM(cnt), 0) AS "COUNT(*)"',
+    "avg": 'CAST(SUM(total) AS REAL) / SUM(amt_cnt) AS "AVG(amt)"',
+    "max": 'MAX(max_amt) AS "MAX(amt)"',
+    "min": 'MIN(min_amt) AS "MIN(amt)"'
+}
+
+ROLLUP_GROUP_COLUMNS = {"cat", "merchant"}
+
+# Sums of per-period partials equal the raw sum only in integer arithmetic
+SUM_AGGREGATIONS = {"sum", "avg"}
+
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+DIRECTIONS = {
+    "spend": "amt < 0",
+    "income": "amt > 0",
+    "both": None,
+}
+
+
+def build_query(
+        client_id: int,
+        start_date: str = None,
+        end_date: str = None,
+        aggregation: str = None,
+        direction: str = None,
+        category: str = None,
+        merchants: list[str] = None,
+        descriptions: list[str] = None,
+        group_by: list[str] = None,
+        limit: int = None,
+        schema_version: int = 0,
+        fts_tokenizer: str = None,
+        integer_amounts: bool = False
+) -> tuple[str, tuple]:
+    """
+    Builds a parameterized query for the `query_sql` arguments.
+    Returns the SQL text and its bound parameters. The SQL text depends only on which
+    filters are used, so repeated calls reuse the statement prepared on the pooled connection.
+    `schema_version` is the database's migration level and decides which columns are filtered on.
+    `fts_tokenizer` is the tokenizer of the `transactions_fts` table, if there is one.
+    `integer_amounts` tells whether `amt` has INTEGER affinity, so sums can come from the rollups.
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError("Invalid aggregation type")
+
+    if direction:
+        direction = direction.lower()
+        if direction not in DIRECTIONS:
+            raise ValueError("Invalid direction: must be 'spend', 'income', or 'both'")
+
+    has_merchants = bool(merchants and isinstance(merchants, list))
+    has_descriptions = bool(descriptions and isinstance(descriptions, list))
+
+    # Descriptions go through the full-text index when the keywords can be expressed as a MATCH,
+    # otherwise through the LIKE scan
+    fts_match = None
+    if has_descriptions and fts_tokenizer and schema_version >= FTS_VERSION:
+        fts_match = fts_match_expression(client_id, descriptions, fts_tokenizer)
+    description_mode = None
+    if has_descriptions:
+        description_mode = "fts" if fts_match else "like"
+
+    group_clean = ()
+    if group_by and isinstance(group_by, list):
+        group_clean = tuple(col for col in group_by if col in ALLOWED_COLUMNS)
+        if not group_clean:
+            raise ValueError("Invalid group by column(s)")
+
+    has_limit = bool(limit and isinstance(limit, int) and limit > 0)
+
+    source = "transactions"
+    if schema_version >= ROLLUP_VERSION:
+        source = rollup_source(aggregation, start_date, end_date, description_mode, group_clean, has_limit, integer_amounts)
+
+    shape = (
+        aggregation,
+        bool(start_date),
+        bool(end_date),
+        direction or None,
+        bool(category),
+        has_merchants,
+        description_mode,
+        group_clean,
+        has_limit,
+        schema_version >= NORMALIZED_COLUMNS_VERSION,
+        source,
+    )
+    sql = render_shape(shape)
+
+    params = [int(client_id)]
+    if start_date:
+        params.append(start_date[:7] if source == "monthly" else start_date)
+    if end_date:
+        params.append(end_date[:7] if source == "monthly" else end_date)
+    if category:
+        params.append(category)
+    if has_merchants:
+        params.append(json.dumps([m.lower() for m in merchants]))
+    if description_mode == "fts":
+        params.append(fts_match)
+    elif description_mode == "like":
+        params.append(json.dumps([d.lower() for d in descriptions]))
+    if has_limit:
+        params.append(limit)
+
+    return sql, tuple(params)
+
+
+def rollup_source(aggregation, start_date, end_date, description_mode, group_by, has_limit, integer_amounts) -> str:
+    """
+    Picks the cheapest table that answers the query with the same result as `transactions`:
+    "monthly" when the date range covers whole months, "daily" otherwise. Description filters,
+    grouping by other columns and LIMIT on grouped output (whose row order is unspecified)
+    stay on the raw table, and so do sums and averages of REAL amounts, whose rounding depends
+    on the order the rows are added in.
+    """
+    if description_mode or not set(group_by) <= ROLLUP_GROUP_COLUMNS or (group_by and has_limit):
+        return "transactions"
+    if aggregation in SUM_AGGREGATIONS and not integer_amounts:
+        return "transactions"
+    whole_start = not start_date or (bool(ISO_DATE.match(start_date)) and start_date.endswith("-01"))
+    whole_end = not end_date
+    if end_date and ISO_DATE.match(end_date):
+        year, month, day = map(int, end_date.split("-"))
+        whole_end = 1 <= month <= 12 and day == calendar.monthrange(year, month)[1]
+    return "monthly" if whole_start and whole_end else "daily"
+
+
+@lru_cache(maxsize=512)
+def render_shape(shape: tuple) -> str:
+    """
+    Renders the SQL text for a query shape (the set of filters used, not their values).
+    """
+    (aggregation, has_start, has_end, direction, has_category, has_merchants, description_mode,
+     group_by, has_limit, normalized, source) = shape
+
+    if source != "transactions":
+        return render_rollup_shape(shape)
+
+    # Migrated databases carry an ISO date and a lowercased merchant column backed by indexes
+    date_column = "txn_date_iso" if normalized else "txn_date"
+    merchant_column = "merchant_lc" if normalized else 'LOWER("merchant")'
+
+    where_clauses = ["clnt_id = ?"]
+    if has_start:
+        where_clauses.append(f"{date_column} >= ?")
+    if has_end:
+        where_clauses.append(f"{date_column} <= ?")
+    if direction and DIRECTIONS[direction]:
+        where_clauses.append(DIRECTIONS[direction])
+    if has_category:
+        where_clauses.append("cat = ?")
+    # List filters are bound as one JSON array so the SQL text does not change with list length
+    if has_merchants:
+        where_clauses.append(f"{merchant_column} IN (SELECT value FROM json_each(?))")
+    if description_mode == "fts":
+        where_clauses.append("rowid IN (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ?)")
+    elif description_mode == "like":
+        where_clauses.append(
+            'EXISTS (SELECT 1 FROM json_each(?) AS kw WHERE LOWER("desc") LIKE \'%\' || kw.value || \'%\')'
+        )
+
+    where_clause = " AND ".join(where_clauses)
+
+    group_clause = ""
+    select_fields = AGGREGATIONS[aggregation]
+    if group_by:
+        group_cols = [f'"{col}"' for col in group_by]
+        group_clause = f" GROUP BY {', '.join(group_cols)}"
+        select_fields = ', '.join(group_cols + [AGGREGATIONS[aggregation]])
+
+    sql_query = f"SELECT {select_fields} FROM transactions WHERE {where_clause}{group_clause}"
+    if has_limit:
+        sql_query += " LIMIT ?"
+
+    return sql_query
+
+
+def render_rollup_shape(shape: tuple) -> str:
+    """
+    Renders the SQL text for a query shape answered from `txn_rollup_daily` or `txn_rollup_monthly`.
+    """
+    (aggregation, has_start, has_end, direction, has_category, has_merchants, _,
+     group_by, has_limit, _, source) = shape
+
+    table, period = ("txn_rollup_monthly", "month") if source == "monthly" else ("txn_rollup_daily", "day")
+
+    where_clauses = ["clnt_id = ?"]
+    if has_start:
+        where_clauses.append(f"{period} >= ?")
+    if has_end:
+        where_clauses.append(f"{period} <= ?")
+    if direction == "spend":
+        where_clauses.append("sign = -1")
+    elif direction == "income":
+        where_clauses.append("sign = 1")
+    if has_category:
+        where_clauses.append("cat = ?")
+    if has_merchants:
+        where_clauses.append('LOWER("merchant") IN (SELECT value FROM json_each(?))')
+
+    group_clause = ""
+    select_fields = ROLLUP_AGGREGATIONS[aggregation]
+    if group_by:
+        group_cols = [f'"{col}"' for col in group_by]
+        group_clause = f" GROUP BY {', '.join(group_cols)}"
+        select_fields = ', '.join(group_cols + [select_fields])
+
+    sql_query = f"SELECT {select_fields} FROM {table} WHERE {' AND '.join(where_clauses)}{group_clause}"
+    if has_limit:
+        sql_query += " LIMIT ?"
+
+    return sql_query
+
+
+def fts_match_expression(client_id: int, descriptions: list[str], tokenizer: str) -> str:
+    """
+    Converts description keywords to an FTS5 MATCH expression on the `desc` column of one client's rows.
+    With the trigram tokenizer this matches exactly the rows `LIKE '%kw%'` does; it needs at least
+    three characters per keyword. Word tokenizers match keywords as word prefixes instead.
+    Returns None if any keyword cannot be served by the index.
+    """
+    terms = []
+    for keyword in descriptions:
+        keyword = str(keyword).lower().strip()
+        if "%" in keyword or "_" in keyword:
+            return None
+        if tokenizer == "trigram":
+            if len(keyword) < 3:
+                return None
+            terms.append('"' + keyword.replace('"', '""') + '"')
+        else:
+            if not any(ch.isalnum() for ch in keyword):
+                return None
+            terms.append('"' + keyword.replace('"', '""') + '"*')
+    if not terms:
+        return None
+    return f'clnt_tag : "|{int(client_id)}|" AND desc : (' + " OR ".join(terms) + ")"
+
+
+def shape_stats() -> dict:
+    """
+    Returns hit/miss counters of the rendered shape cache.
+    """
+    info = render_shape.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "shapes": info.currsize}
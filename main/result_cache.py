@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+SLASH_OR_DASH_DATE = re.compile(r"^(\d{4})[/-](\d{1,2})[/-](\d{1,2})")
+
+
+def normalize_date(value):
+    """
+    Returns 'YYYY-MM-DD' for 'YYYY-MM-DD' / 'YYYY/MM/DD' dates (with or without a time part).
+    Anything else is returned unchanged.
+    """
+    if not isinstance(value, str):
+        return value
+    match = SLASH_OR_DASH_DATE.match(value.strip())
+    if not match:
+        return value
+    year, month, day = match.groups()
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+def normalize_keywords(values):
+    if not values or not isinstance(values, list):
+        return None
+    cleaned = sorted({str(v).strip().lower() for v in values if str(v).strip()})
+    return cleaned or None
+
+
+def normalize_args(args: dict) -> dict:
+    """
+    Canonical form of `query_sql` arguments: merchant and description lists lowercased,
+    deduplicated and sorted, dates as YYYY-MM-DD, and empty values dropped. Each change leaves
+    the query result the same. group_by keeps its order since it sets the column order.
+    """
+    normalized = {}
+    for key, value in args.items():
+        if key in ("start_date", "end_date"):
+            value = normalize_date(value)
+        elif key in ("merchants", "descriptions"):
+            value = normalize_keywords(value)
+        elif key == "direction" and isinstance(value, str):
+            value = value.strip().lower()
+        elif key == "category" and isinstance(value, str):
+            value = value.strip()
+        elif key == "client_id":
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                pass
+        if value is None or value == "" or value == []:
+            continue
+        normalized[key] = value
+    return normalized
+
+
+def cache_key(args: dict) -> str:
+    return json.dumps(args, sort_keys=True, default=str)
+
+
+def estimate_size(value) -> int:
+    """
+    Approximate memory footprint of a result (dicts, lists and scalars) in bytes.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+
+class ResultCache:
+    """
+    Bounded LRU cache with a TTL for `query_sql` results. Entries are tagged with the data
+    version they were computed at and are treated as misses once the version moves on.
+    """
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, entry_version, created, size = entry
+            if entry_version != version or time.monotonic() - created > self.ttl:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, version: int, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, version, time.monotonic(), size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+query_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", "600")),
+)
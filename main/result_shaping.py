@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import os
+
+# Rows of a query result sent to the model; the rest is covered by the summary
+MAX_ROWS = int(os.getenv("TOOL_RESULT_MAX_ROWS", "50"))
+TOP_N = int(os.getenv("TOOL_RESULT_TOP_N", "5"))
+
+
+def format_value(value):
+    if isinstance(value, float):
+        # Amounts are money; SQLite sums carry float noise like -4961.1100000000015
+        return f"{value:.2f}"
+    # SUM over no rows is NULL; an empty CSV field would read as a missing column
+    return "null" if value is None else value
+
+
+def summarize_rows(rows: list[dict], columns: list[str], top_n: int = TOP_N) -> list[str]:
+    """
+    Summary lines over all rows: sum, min and max of each numeric column, and the `top_n` groups
+    with the largest absolute value in the last numeric column (the aggregate).
+    """
+    numeric = [
+        column for column in columns
+        if any(isinstance(row.get(column), (int, float)) for row in rows)
+        and all(row.get(column) is None or isinstance(row.get(column), (int, float)) for row in rows)
+    ]
+    lines = []
+    for column in numeric:
+        values = [row[column] for row in rows if row.get(column) is not None]
+        if values:
+            lines.append(
+                f"{column}: sum {format_value(float(sum(values)))}, "
+                f"min {format_value(float(min(values)))}, max {format_value(float(max(values)))}"
+            )
+    labels = [column for column in columns if column not in numeric]
+    if numeric and labels and len(rows) > top_n:
+        measure = numeric[-1]
+        ranked = sorted(
+            (row for row in rows if row.get(measure) is not None),
+            key=lambda row: abs(row[measure]),
+            reverse=True
+        )[:top_n]
+        top = ", ".join(
+            f"{'/'.join(str(row.get(label)) for label in labels)} ({format_value(float(row[measure]))})"
+            for row in ranked
+        )
+        lines.append(f"top {len(ranked)} by |{measure}|: {top}")
+    return lines
+
+
+def shape_result(result: dict, max_rows: int = MAX_ROWS, top_n: int = TOP_N) -> str:
+    """
+    What the model sees of a `query_sql` result: the row count, up to `max_rows` rows as CSV,
+    and, for multi-row results, summary stats over every row and how many rows were left out.
+    Errors pass through as compact JSON. The full result stays with the caller.
+    """
+    if "error" in result or "rows" not in result:
+        return json.dumps(result, default=str, separators=(",", ":"))
+    rows = result["rows"]
+    if not rows:
+        return "0 rows"
+
+    columns = list(rows[0])
+    for row in rows[1:]:
+        columns.extend(key for key in row if key not in columns)
+    shown = rows[:max_rows] if max_rows > 0 else rows
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for row in shown:
+        writer.writerow([format_value(row.get(column)) for column in columns])
+
+    header = f"{len(rows)} row{'s' if len(rows) != 1 else ''}"
+    if len(shown) < len(rows):
+        header += f"; first {len(shown)} shown, {len(rows) - len(shown)} more not shown (summary covers all rows)"
+    parts = [header, buffer.getvalue().rstrip("\n")]
+    if len(rows) > 1:
+        parts.append("summary:\n" + "\n".join(summarize_rows(rows, columns, top_n)))
+    return "\n".join(parts)
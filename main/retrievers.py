@@ -0,0 +1,268 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import numpy as np
+
+from db import get_pool
+from partitions import CollectionRouter
+from utils import resolve_repo_path
+
+# Clients with at most this many transactions are searched exactly with NumPy
+NUMPY_MAX_ROWS = int(os.getenv("NUMPY_RETRIEVER_MAX_ROWS", "20000"))
+
+
+class Retriever(ABC):
+    """
+    Nearest-neighbour search over one client's transaction vectors. `search` takes a batch of
+    normalized query vectors and returns, per query, the ids and metadatas of the `top_k`
+    closest transactions, closest first.
+    """
+    name = "base"
+
+    @abstractmethod
+    def search(self, client_id: int, vectors: list[list[float]], top_k: int = 100) -> list[dict]:
+        ...
+
+    def invalidate(self, client_id: int = None):
+        """
+        Drops anything derived from the collection, for one client or all of them.
+        """
+
+
+class ChromaRetriever(Retriever):
+    """
+    HNSW search through the client's Chroma collection.
+    """
+    name = "chroma"
+
+    def __init__(self, router: CollectionRouter):
+        self.router = router
+
+    def search(self, client_id: int, vectors: list[list[float]], top_k: int = 100) -> list[dict]:
+        collection = self.router.collection_for(client_id, create=False)
+        if collection is None:
+            return [{"ids": [], "metadatas": []} for _ in vectors]
+        result = collection.query(
+            query_embeddings=[list(vector) for vector in vectors],
+            n_results=top_k,
+            where=self.router.where(client_id),
+            include=["metadatas"]
+        )
+        return [{"ids": ids, "metadatas": metadatas} for ids, metadatas in zip(result["ids"], result["metadatas"])]
+
+
+class ClientMatrix:
+    """
+    One client's vectors as a contiguous float32 matrix, with the Chroma ids and metadatas of its rows.
+    `mtime` is the modification time of the file it was mapped from.
+    """
+    def __init__(self, vectors: np.ndarray, ids: list[str], metadatas: list[dict], mtime: int = None):
+        self.vectors = vectors
+        self.ids = ids
+        self.metadatas = metadatas
+        self.mtime = mtime
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries: np.ndarray, top_k: int) -> list[dict]:
+        if not self.ids:
+            return [{"ids": [], "metadatas": []} for _ in queries]
+        # Rows are unit vectors, so the dot product ranks like Chroma's L2 distance
+        scores = self.vectors @ queries.T
+        k = min(top_k, len(self.ids))
+        if k < len(self.ids):
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        else:
+            top = np.broadcast_to(np.arange(len(self.ids))[:, None], scores.shape)
+        results = []
+        for column in range(queries.shape[0]):
+            rows = top[:, column]
+            rows = rows[np.argsort(-scores[rows, column], kind="stable")]
+            results.append({
+                "ids": [self.ids[i] for i in rows],
+                "metadatas": [self.metadatas[i] for i in rows],
+            })
+        return results
+
+
+class NumpyRetriever(Retriever):
+    """
+    Exact brute-force search. Each client's vectors are exported once from Chroma into
+    `<cache_dir>/<collection>/<client>.npy` and memory-mapped from then on; at most
+    `max_clients` matrices stay open, least recently used first out. An open matrix is
+    dropped once its file is removed or rewritten, for instance by another process ingesting
+    the client's new transactions.
+    """
+    name = "numpy"
+
+    def __init__(self, router: CollectionRouter, cache_dir: str = "data/client_vectors", max_clients: int = 256):
+        self.router = router
+        self.cache_dir = os.path.join(resolve_repo_path(cache_dir), router.base_name)
+        self.max_clients = max_clients
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.builds = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def paths(self, client_id: int) -> tuple[str, str]:
+        base = os.path.join(self.cache_dir, str(int(client_id)))
+        return base + ".npy", base + ".json"
+
+    def build(self, client_id: int) -> ClientMatrix:
+        """
+        Exports the client's vectors from Chroma to the memory-mapped files.
+        """
+        vectors_path, rows_path = self.paths(client_id)
+        ids, metadatas, vectors = [], [], []
+        collection = self.router.collection_for(client_id, create=False)
+        if collection is not None:
+            where = self.router.where(client_id)
+            batch = collection.get(where=where, include=["embeddings", "metadatas"]) if where else collection.get(include=["embeddings", "metadatas"])
+            ids, metadatas = list(batch["ids"]), list(batch["metadatas"])
+            vectors = batch["embeddings"]
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1) if ids else np.empty((0, 0), dtype=np.float32)
+        # Written aside and renamed, so a concurrent reader never maps a partial file; the
+        # temporary names are per thread, so concurrent builds of one client do not interleave
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(vectors_path + suffix, "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix))
+        with open(rows_path + suffix, "w") as f:
+            json.dump({"ids": ids, "metadatas": metadatas}, f)
+        os.replace(vectors_path + suffix, vectors_path)
+        os.replace(rows_path + suffix, rows_path)
+        with self._lock:
+            self.builds += 1
+        # Another thread may have replaced or removed the files already; serve this export then
+        return self.load(client_id) or ClientMatrix(matrix, ids, metadatas)
+
+    def load(self, client_id: int) -> ClientMatrix | None:
+        vectors_path, rows_path = self.paths(client_id)
+        try:
+            mtime = os.stat(vectors_path).st_mtime_ns
+            with open(rows_path) as f:
+                rows = json.load(f)
+            vectors = np.load(vectors_path, mmap_mode="r")
+        except FileNotFoundError:
+            # Removed by an invalidation in the meantime
+            return None
+        if len(vectors) != len(rows["ids"]):
+            # The pair was caught halfway through a rebuild
+            return None
+        return ClientMatrix(vectors, rows["ids"], rows["metadatas"], mtime)
+
+    def current(self, client_id: int, matrix: ClientMatrix) -> bool:
+        try:
+            return os.stat(self.paths(client_id)[0]).st_mtime_ns == matrix.mtime
+        except FileNotFoundError:
+            return False
+
+    def matrix(self, client_id: int) -> ClientMatrix:
+        key = int(client_id)
+        with self._lock:
+            matrix = self._matrices.get(key)
+        if matrix is not None and self.current(key, matrix):
+            with self._lock:
+                # Unless an invalidation dropped it in the meantime
+                if key in self._matrices:
+                    self._matrices.move_to_end(key)
+            return matrix
+        matrix = self.load(key)
+        if matrix is None:
+            # One export at a time: threads missing the same client wait for the first one's files
+            with self._build_lock:
+                matrix = self.load(key) or self.build(key)
+        with self._lock:
+            self._matrices[key] = matrix
+            self._matrices.move_to_end(key)
+            while len(self._matrices) > self.max_clients:
+                self._matrices.popitem(last=False)
+        return matrix
+
+    def search(self, client_id: int, vectors: list[list[float]], top_k: int = 100) -> list[dict]:
+        queries = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        return self.matrix(client_id).search(queries, top_k)
+
+    def invalidate(self, client_id: int = None):
+        with self._lock:
+            if client_id is None:
+                self._matrices.clear()
+            else:
+                self._matrices.pop(int(client_id), None)
+        names = [str(int(client_id))] if client_id is not None else [
+            name.rsplit(".", 1)[0] for name in os.listdir(self.cache_dir) if name.endswith(".json")
+        ]
+        for name in names:
+            for path in self.paths(name):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Already removed by a concurrent invalidation
+                    pass
+
+
+class AutoRetriever(Retriever):
+    """
+    Uses exact NumPy search for clients with at most `max_rows` transactions and Chroma's
+    HNSW index above that. Row counts come from SQLite and are cached per client.
+    """
+    name = "auto"
+
+    def __init__(self, db_path: str, chroma: ChromaRetriever, numpy: NumpyRetriever, max_rows: int = NUMPY_MAX_ROWS):
+        self.db_path = db_path
+        self.chroma = chroma
+        self.numpy = numpy
+        self.max_rows = max_rows
+        self._row_counts = {}
+        self._lock = threading.Lock()
+        self.routed = {"numpy": 0, "chroma": 0}
+
+    def row_count(self, client_id: int) -> int:
+        key = int(client_id)
+        pool = get_pool(self.db_path)
+        # Counts are recounted once the database has been written, by this process or another
+        version = pool.data_version()
+        with self._lock:
+            entry = self._row_counts.get(key)
+        if entry is None or entry[0] != version:
+            with pool.connection() as conn:
+                count = conn.execute("SELECT COUNT(*) FROM transactions WHERE clnt_id = ?", (key,)).fetchone()[0]
+            entry = (version, count)
+            with self._lock:
+                self._row_counts[key] = entry
+        return entry[1]
+
+    def pick(self, client_id: int) -> Retriever:
+        return self.numpy if self.row_count(client_id) <= self.max_rows else self.chroma
+
+    def search(self, client_id: int, vectors: list[list[float]], top_k: int = 100) -> list[dict]:
+        retriever = self.pick(client_id)
+        with self._lock:
+            self.routed[retriever.name] += 1
+        return retriever.search(client_id, vectors, top_k)
+
+    def invalidate(self, client_id: int = None):
+        with self._lock:
+            if client_id is None:
+                self._row_counts.clear()
+            else:
+                self._row_counts.pop(int(client_id), None)
+        self.numpy.invalidate(client_id)
+
+
+def make_retriever(kind: str, db_path: str, router: CollectionRouter, cache_dir: str = "data/client_vectors") -> Retriever:
+    """
+    Builds the retriever named by `kind`: "chroma", "numpy" or "auto".
+    """
+    chroma = ChromaRetriever(router)
+    if kind == "chroma":
+        return chroma
+    numpy = NumpyRetriever(router, cache_dir, max_clients=int(os.getenv("NUMPY_RETRIEVER_CLIENTS", "256")))
+    if kind == "numpy":
+        return numpy
+    if kind == "auto":
+        return AutoRetriever(db_path, chroma, numpy)
+    raise ValueError(f"Unknown retriever: {kind}")
@@ -0,0 +1,188 @@
+"""
+Materialized per-client daily and monthly aggregates of `transactions` by category and merchant.
+The tables are created by migration 3 (see migrate.py) and kept current by triggers: inserts
+update one rollup row in place, updates and deletes recompute the affected client/day and month.
+`query_sql` reads them through the query builder whenever the result is identical to the raw
+query: counts, minimums and maximums always, sums and averages only when `amt` has INTEGER
+affinity (floating-point sums of partials round differently from a sum over the rows).
+
+    cd main
+    python rollup.py --rebuild    # recompute both tables from transactions
+    python rollup.py --verify     # compare rollup answers with the raw table
+"""
+import argparse
+import sqlite3
+import sys
+
+from db import DEFAULT_DB, amount_column_type, has_integer_affinity, iso_date_sql, resolve_db_path
+from query_builder import NORMALIZED_COLUMNS_VERSION, ROLLUP_VERSION, build_query
+
+# (table, period column, SQL for the period of a date column)
+ROLLUP_TABLES = [
+    ("txn_rollup_daily", "day", lambda column: iso_date_sql(column)),
+    ("txn_rollup_monthly", "month", lambda column: f"substr({iso_date_sql(column)}, 1, 7)"),
+]
+
+
+def sign_sql(column: str) -> str:
+    return f"CASE WHEN {column} < 0 THEN -1 WHEN {column} > 0 THEN 1 ELSE 0 END"
+
+
+def create_rollup_tables(conn: sqlite3.Connection):
+    """
+    Amount columns get the declared type of `transactions.amt`, so values keep the type the raw
+    query returns (an integer sum stays an integer).
+    """
+    amount_type = amount_column_type(conn)
+    for table, period, _ in ROLLUP_TABLES:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                clnt_id INTEGER,
+                {period} TEXT,
+                cat TEXT,
+                merchant TEXT,
+                sign INTEGER,
+                total {amount_type},
+                cnt INTEGER,
+                amt_cnt INTEGER,
+                min_amt {amount_type},
+                max_amt {amount_type}
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_clnt_period ON {table} (clnt_id, {period})")
+
+
+def aggregate_select(period_sql: str, where: str = "") -> str:
+    """
+    SELECT that aggregates raw transactions into rollup rows.
+    """
+    return f"""
+        SELECT clnt_id, {period_sql("txn_date")}, cat, merchant, {sign_sql("amt")},
+               SUM(amt), COUNT(*), COUNT(amt), MIN(amt), MAX(amt)
+        FROM transactions
+        {where}
+        GROUP BY clnt_id, {period_sql("txn_date")}, cat, merchant, {sign_sql("amt")}
+    """
+
+
+def rebuild_rollups(conn: sqlite3.Connection):
+    """
+    Recomputes every rollup row from `transactions`.
+    """
+    for table, _, period_sql in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {aggregate_select(period_sql)}")
+
+
+def create_rollup_triggers(conn: sqlite3.Connection):
+    """
+    Inserts add the new row to its rollup group; updates and deletes recompute the old row's
+    client/period, since MIN and MAX cannot be maintained by subtraction.
+    """
+    insert_steps = []
+    recompute_steps = []
+    for table, period, period_sql in ROLLUP_TABLES:
+        match_new = (
+            f"clnt_id IS NEW.clnt_id AND {period} IS {period_sql('NEW.txn_date')} AND cat IS NEW.cat "
+            f"AND merchant IS NEW.merchant AND sign = {sign_sql('NEW.amt')}"
+        )
+        insert_steps.append(f"""
+            UPDATE {table}
+            SET total = CASE WHEN NEW.amt IS NULL THEN total ELSE COALESCE(total, 0) + NEW.amt END,
+                cnt = cnt + 1,
+                amt_cnt = amt_cnt + (NEW.amt IS NOT NULL),
+                min_amt = COALESCE(MIN(min_amt, NEW.amt), min_amt, NEW.amt),
+                max_amt = COALESCE(MAX(max_amt, NEW.amt), max_amt, NEW.amt)
+            WHERE {match_new};
+            INSERT INTO {table}
+            SELECT NEW.clnt_id, {period_sql('NEW.txn_date')}, NEW.cat, NEW.merchant, {sign_sql('NEW.amt')},
+                   NEW.amt, 1, NEW.amt IS NOT NULL, NEW.amt, NEW.amt
+            WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {match_new});""")
+        recompute_steps.append(f"""
+            DELETE FROM {table} WHERE clnt_id IS OLD.clnt_id AND {period} IS {period_sql('OLD.txn_date')};
+            INSERT INTO {table} {aggregate_select(
+                period_sql,
+                f"WHERE clnt_id IS OLD.clnt_id AND {period_sql('txn_date')} IS {period_sql('OLD.txn_date')}"
+            )};""")
+
+    insert_body = "".join(insert_steps)
+    recompute_body = "".join(recompute_steps)
+    triggers = {
+        "trg_transactions_rollup_insert": f"AFTER INSERT ON transactions BEGIN {insert_body} END",
+        "trg_transactions_rollup_delete": f"AFTER DELETE ON transactions BEGIN {recompute_body} END",
+        "trg_transactions_rollup_update": (
+            f"AFTER UPDATE OF clnt_id, txn_date, amt, cat, merchant ON transactions "
+            f"BEGIN {recompute_body} {recompute_body.replace('OLD.', 'NEW.')} END"
+        ),
+    }
+    for name, body in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+
+def typed_rows(rows: list) -> list:
+    """
+    Rows with each value paired with its type, so 3 and 3.0 do not compare equal.
+    """
+    return [tuple((type(value), value) for value in row) for row in rows]
+
+
+def verify_rollups(db_path: str, arg_sets: list[dict]) -> list[dict]:
+    """
+    Runs each `query_sql` argument set against the raw table and through the rollup routing,
+    and returns the argument sets whose results differ.
+    """
+    conn = sqlite3.connect(resolve_db_path(db_path))
+    mismatches = []
+    routed = 0
+    try:
+        integer_amounts = has_integer_affinity(amount_column_type(conn))
+        for args in arg_sets:
+            raw_sql, raw_params = build_query(**args, schema_version=NORMALIZED_COLUMNS_VERSION)
+            sql, params = build_query(**args, schema_version=ROLLUP_VERSION, integer_amounts=integer_amounts)
+            if sql == raw_sql:
+                continue
+            routed += 1
+            raw = conn.execute(raw_sql, raw_params).fetchall()
+            rolled = conn.execute(sql, params).fetchall()
+            if typed_rows(raw) != typed_rows(rolled):
+                mismatches.append({"args": args, "raw": raw, "rollup": rolled})
+    finally:
+        conn.close()
+    print(f"Compared {routed} rollup-routed queries: {len(mismatches)} mismatches")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_DB, help="Database path, relative to the repository root")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the rollup tables")
+    parser.add_argument("--verify", action="store_true", help="Compare rollup answers with the raw table")
+    parser.add_argument("--queries", type=int, default=2000, help="Number of argument sets to verify")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        conn = sqlite3.connect(resolve_db_path(args.db), isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        rebuild_rollups(conn)
+        conn.execute("COMMIT")
+        conn.close()
+
+    if args.verify:
+        from benchmarks.synthetic import tool_call_args
+
+        conn = sqlite3.connect(resolve_db_path(args.db))
+        client_ids = [row[0] for row in conn.execute("SELECT DISTINCT clnt_id FROM transactions")]
+        conn.close()
+        arg_sets = tool_call_args(len(client_ids), args.queries)
+        for arg_set in arg_sets:
+            arg_set["client_id"] = client_ids[int(arg_set["client_id"]) - 1]
+        mismatches = verify_rollups(args.db, arg_sets)
+        for mismatch in mismatches[:20]:
+            print(mismatch)
+        if mismatches:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
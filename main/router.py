@@ -0,0 +1,345 @@
+"""
+Deterministic fast path in front of the agent. Questions like "How much did I spend on Uber
+last month?" are parsed into one `query_sql` call (relative dates resolved against today,
+direction and aggregation from keywords, merchants and categories from the client's own
+vocabulary) and answered from a template without calling the LLM. Anything the parser cannot
+fully account for falls back to the agent.
+"""
+import calendar
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+from merchant_index import get_merchant_index
+from prompts import CATEGORIES
+from query_builder import AGGREGATIONS
+from utils import STOPWORDS, clean_text
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+NUMBERS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+# Phrase -> category, besides the category names themselves (matched longest first)
+CATEGORY_SYNONYMS = {
+    "groceries": "Supermarkets and Groceries",
+    "grocery": "Supermarkets and Groceries",
+    "supermarket": "Supermarkets and Groceries",
+    "gas": "Gas Stations",
+    "fuel": "Gas Stations",
+    "restaurant": "Restaurants",
+    "dining": "Restaurants",
+    "eating out": "Restaurants",
+    "gym": "Gyms and Fitness Centers",
+    "fitness": "Gyms and Fitness Centers",
+    "utility": "Utilities",
+    "utility bills": "Utilities",
+    "phone bill": "Telecommunication Services",
+    "phone bills": "Telecommunication Services",
+    "salary": "Payroll",
+    "paycheck": "Payroll",
+    "bank fees": "Bank Fees",
+    "atm": "ATM",
+    "streaming": "Digital Entertainment",
+    "subscriptions": "Digital Entertainment",
+    "medical": "Healthcare",
+    "shopping": "Shops",
+}
+INCOME_CATEGORIES = {"Payroll", "Interest", "Tax Refund", "Transfer Credit", "Transfer Deposit", "Check Deposit"}
+
+# (pattern, aggregation); the first match wins
+AGGREGATION_PATTERNS = [
+    (r"\bhow many\b|\bnumber of\b|\bcount\b|\bhow often\b", "count"),
+    (r"\baverage\b|\bavg\b|\bmean\b|\btypical\b", "avg"),
+    (r"\b(biggest|largest|highest|most expensive|maximum|max)\b", "largest"),
+    (r"\b(smallest|lowest|cheapest|minimum|min)\b", "smallest"),
+    (r"\bhow much\b|\btotal\b|\bsum\b", "sum"),
+]
+# "get"/"got" alone is filler ("how many times did I get Starbucks"); money got *from* someone is income
+INCOME_PATTERN = (
+    r"\b(income|earn|earned|earnings|receive|received|got paid|get paid|deposits?|refunds?)\b"
+    r"|\b(get|got|gotten|getting)\b.*\bfrom\b"
+)
+# Time words left over after the date range is parsed mean a range the parser did not understand
+UNPARSED_DATE_PATTERN = (
+    r"\d|\b(day|week|month|year|days|weeks|months|years|last|next|first|second|daily|weekly|monthly|yearly|"
+    r"ago|since|before|after|until|till|today|yesterday|quarter|weekend)\b"
+)
+# Questions the fast path never answers: charts, breakdowns, comparisons, follow-ups
+FALLBACK_PATTERN = (
+    r"\b(chart|plot|graph|visuali[sz]e|breakdown|break down|by (category|merchant|month|day|date)|per|each|"
+    r"compare|compared|versus|vs|between|and|or|except|excluding|without|list|show|which|why|trend|that|it|those)\b"
+)
+
+# Words that carry no filter once dates, direction, aggregation and category are parsed
+FILLER = STOPWORDS | {
+    "on", "at", "for", "of", "the", "a", "an", "my", "me", "total", "much", "many", "times", "time", "go", "went",
+    "get", "got", "bill", "bills", "purchases", "purchase", "expenses", "expense", "spending", "money", "cost",
+    "costs", "ever", "overall", "so", "far", "have", "has", "had", "number", "count", "average", "avg", "mean",
+    "biggest", "largest", "highest", "smallest", "lowest", "cheapest", "maximum", "minimum", "max", "min",
+    "income", "earn", "earned", "received", "receive", "payments", "payment", "transactions", "often", "in",
+    "during", "since", "past", "previous", "spent", "days", "weeks", "months", "years", "typical", "single",
+    "most", "expensive", "sum", "deposits", "deposit", "refund", "refunds", "bought", "buy", "far", "dollars",
+    "eat", "ate", "shop", "shopped", "visit", "visited", "use", "used", "order", "ordered", "make", "made", "ride",
+    "rides", "trip", "trips", "bill", "charge", "charges", "charged", "put", "give", "gave", "into", "toward", "towards", "take", "took",
+}
+
+
+def to_date(today) -> date:
+    if isinstance(today, datetime):
+        return today.date()
+    if isinstance(today, date):
+        return today
+    return date.fromisoformat(str(today)[:10])
+
+
+def month_range(year: int, month: int) -> tuple[date, date]:
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def shift_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 - months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def parse_date_range(text: str, today) -> tuple:
+    """
+    Finds one relative or named date range in lowercased text. Returns (start, end, phrase),
+    (None, None, None) when there is none, or None when there are several (ambiguous).
+    Ranges follow the examples in the system prompt: "this year" is the whole calendar year,
+    "this month" runs to today, and "last N months" is a rolling window ending today.
+    """
+    today = to_date(today)
+    found = []
+    number = r"(\d+|" + "|".join(NUMBERS) + r")"
+    rolling = re.compile(r"\b(?:last|past|previous) " + number + r" (day|week|month|year)s?\b")
+    for match in rolling.finditer(text):
+        n = int(NUMBERS.get(match.group(1), match.group(1)))
+        unit = match.group(2)
+        if unit == "day":
+            start = today - timedelta(days=n)
+        elif unit == "week":
+            start = today - timedelta(weeks=n)
+        else:
+            start = shift_months(today, n * (12 if unit == "year" else 1))
+        found.append((start, today, match))
+    text_without_rolling = rolling.sub(" ", text)
+
+    monday = today - timedelta(days=today.weekday())
+    previous_month = shift_months(date(today.year, today.month, 1), 1)
+    simple = {
+        r"\b(?:last|previous) month\b": month_range(previous_month.year, previous_month.month),
+        r"\bthis month\b": (date(today.year, today.month, 1), today),
+        r"\b(?:last|previous) year\b": (date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)),
+        r"\bthis year\b": (date(today.year, 1, 1), date(today.year, 12, 31)),
+        r"\b(?:last|previous) week\b": (monday - timedelta(days=7), monday - timedelta(days=1)),
+        r"\bthis week\b": (monday, today),
+        r"\bpast month\b": (shift_months(today, 1), today),
+        r"\bpast week\b": (today - timedelta(weeks=1), today),
+        r"\bpast year\b": (shift_months(today, 12), today),
+        r"\byesterday\b": (today - timedelta(days=1), today - timedelta(days=1)),
+        r"\btoday\b": (today, today),
+    }
+    for pattern, (start, end) in simple.items():
+        for match in re.finditer(pattern, text_without_rolling):
+            found.append((start, end, match))
+
+    # "may" is only a month next to "in"/"during" or a year
+    month_names = "|".join(name for name in MONTHS if name != "may") + r"|(?<=\bin )may|(?<=during )may|may(?= \d{4})"
+    for match in re.finditer(r"\b(" + month_names + r")(?:\s+(\d{4}))?\b", text_without_rolling):
+        month = MONTHS[match.group(1)]
+        if match.group(2):
+            year = int(match.group(2))
+        else:
+            # A month after the current one means last year's
+            year = today.year if month <= today.month else today.year - 1
+        start, end = month_range(year, month)
+        found.append((start, min(end, today) if (year, month) == (today.year, today.month) else end, match))
+    without_months = re.sub(r"\b(" + month_names + r")(?:\s+\d{4})?\b", " ", text_without_rolling)
+    for match in re.finditer(r"\b(?:in|during) (\d{4})\b", without_months):
+        year = int(match.group(1))
+        found.append((date(year, 1, 1), date(year, 12, 31), match))
+
+    if not found:
+        return None, None, None
+    if len(found) > 1:
+        return None
+    start, end, match = found[0]
+    return start.isoformat(), end.isoformat(), match.group(0)
+
+
+def match_aggregation(text: str):
+    for pattern, aggregation in AGGREGATION_PATTERNS:
+        if re.search(pattern, text):
+            return aggregation
+    return None
+
+
+def match_category(text: str):
+    """
+    Returns (category, phrase) for the single category named in text, (None, None) for none,
+    or None when more than one category is named.
+    """
+    phrases = {category.lower(): category for category in CATEGORIES}
+    phrases.update(CATEGORY_SYNONYMS)
+    found = {}
+    remaining = text
+    for phrase in sorted(phrases, key=len, reverse=True):
+        pattern = r"\b" + re.escape(phrase) + r"\b"
+        if re.search(pattern, remaining):
+            found[phrases[phrase]] = phrase
+            remaining = re.sub(pattern, " ", remaining)
+    if not found:
+        return None, None
+    if len(found) > 1:
+        return None
+    return next(iter(found.items()))
+
+
+class FastPathRouter:
+    """
+    Answers single-filter aggregate questions without the LLM. `route` returns the
+    `query_sql` arguments when every meaningful word of the question is accounted for;
+    `answer` also runs the query and formats the reply. Counts routed and fallen-back questions.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.fallbacks = 0
+
+    def route(self, query: str, client_id: int, today) -> dict | None:
+        text = " ".join(query.lower().replace("’", "'").split())
+        # "from March" is an open range, not the month
+        if re.search(r"\bfrom (the )?(\d|" + "|".join(MONTHS) + r"|last|this|past)", text):
+            return None
+        dates = parse_date_range(text, today)
+        if dates is None:
+            return None
+        start_date, end_date, date_phrase = dates
+        if date_phrase:
+            text = text.replace(date_phrase, " ")
+        if re.search(UNPARSED_DATE_PATTERN, text):
+            return None
+
+        requested = match_aggregation(text)
+        if requested is None:
+            return None
+        category = match_category(text)
+        if category is None:
+            return None
+        category, category_phrase = category
+        if category_phrase:
+            text = re.sub(r"\b" + re.escape(category_phrase) + r"\b", " ", text)
+        if re.search(FALLBACK_PATTERN, text):
+            return None
+
+        if re.search(INCOME_PATTERN, text) or category in INCOME_CATEGORIES:
+            direction = "income"
+        else:
+            direction = "spend"
+
+        # Whatever is left must name merchants of this client, unambiguously
+        tokens = [token for token in clean_text(text).split() if token not in FILLER]
+        merchants = []
+        if tokens:
+            if category:
+                return None
+            vocabulary = get_merchant_index(self.db_path).vocabulary(client_id)
+            for token in tokens:
+                names = vocabulary.merchant_tokens.get(token)
+                if not names or len(names) > 1:
+                    return None
+                merchants.extend(name for name in names if name not in merchants)
+        if not merchants and not category:
+            return None
+
+        # Spend amounts are negative, so the largest expense is the minimum amount
+        if requested in ("largest", "smallest"):
+            largest = requested == "largest"
+            aggregation = ("min" if largest else "max") if direction == "spend" else ("max" if largest else "min")
+        else:
+            aggregation = requested
+
+        args = {"aggregation": aggregation, "direction": direction}
+        if start_date:
+            args["start_date"] = start_date
+            args["end_date"] = end_date
+        if merchants:
+            args["merchants"] = merchants
+        if category:
+            args["category"] = category
+        return {"args": args, "requested": requested, "date_phrase": date_phrase}
+
+    def answer(self, query: str, client_id: int, today) -> dict | None:
+        """
+        Returns {"content", "args", "result"} when the question was answered on the fast path,
+        or None to fall back to the agent.
+        """
+        from tools import query_sql
+
+        routed = self.route(query, client_id, today)
+        if routed is not None:
+            result = query_sql(client_id=str(client_id), **routed["args"])
+            if "error" in result:
+                routed = None
+        with self._lock:
+            if routed is None:
+                self.fallbacks += 1
+                return None
+            self.routed += 1
+        return {"content": format_answer(routed, result), "args": routed["args"], "result": result}
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.routed + self.fallbacks
+            return {
+                "routed": self.routed,
+                "fallbacks": self.fallbacks,
+                "hit_rate": self.routed / total if total else 0.0,
+            }
+
+
+def date_label(phrase: str, start_date: str) -> str:
+    """
+    How the answer names the range: "last month", "in the past 3 months", "in March 2024", "in 2024".
+    """
+    start = date.fromisoformat(start_date)
+    words = phrase.split()
+    if words[-1] in MONTHS or words[0] in MONTHS:
+        return f"in {calendar.month_name[start.month]} {start.year}"
+    if words[0] in ("in", "during"):
+        return phrase
+    if words[0] in ("past", "last", "previous") and len(words) == 3:
+        return f"in the past {words[1]} {words[2]}"
+    return phrase
+
+
+def format_answer(routed: dict, result: dict) -> str:
+    args = routed["args"]
+    rows = result.get("rows") or [{}]
+    value = rows[0].get(AGGREGATIONS[args["aggregation"]])
+
+    if args.get("merchants"):
+        target = " and ".join(" ".join(word[:1].upper() + word[1:] for word in name.split()) for name in args["merchants"])
+    else:
+        target = args["category"]
+    preposition = "from" if args["direction"] == "income" else ("on" if args.get("category") else "at")
+    period = ""
+    if args.get("start_date"):
+        period = f" {date_label(routed['date_phrase'], args['start_date'])} ({args['start_date']} to {args['end_date']})"
+
+    if routed["requested"] == "count":
+        kind = "payments" if args["direction"] == "income" else "transactions"
+        return f"You had {value or 0} {kind} {preposition} {target}{period}."
+    if value is None:
+        return f"There are no matching transactions {preposition} {target}{period}."
+    amount = f"${abs(value):,.2f}"
+    if routed["requested"] == "sum":
+        verb = "received" if args["direction"] == "income" else "spent"
+        return f"You {verb} {amount} {preposition} {target}{period}."
+    noun = "payment" if args["direction"] == "income" else "transaction"
+    adjective = {"avg": "average", "largest": "largest", "smallest": "smallest"}[routed["requested"]]
+    return f"Your {adjective} {noun} {preposition} {target}{period} was {amount}."
@@ -0,0 +1,255 @@
+"""
+Headless HTTP API for the agent. Each worker process builds one Agent (one embedding model,
+vector store and SQLite pool) and serves requests from it on threads. Workers bind the port
+with SO_REUSEPORT, so the kernel balances connections between them, and only once they have
+loaded everything, so no request waits on a cold worker.
+
+    cd main
+    python server.py --port 8000 --workers 4
+
+Endpoints:
+    POST /chat   {"query", "client_id", "today"?, "messages"?, "model"?} -> {"content", "chart"}
+    POST /query  {"client_id", ...query_sql arguments} -> query_sql result
+    POST /transactions {"transactions": [{"clnt_id", "txn_id", "txn_date", "amt", ...}]} -> ingest report
+                       (off unless SERVER_INGEST_TOKEN is set; send it as "Authorization: Bearer <token>")
+    GET  /health -> {"status", "pid"}
+    GET  /metrics -> span latencies of this worker in Prometheus text format (TRACING=1)
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = os.getenv("SERVER_MODEL", "llama-3.3-70b-versatile")
+# Sampling settings of the served model; replies are cached only at temperature 0
+MODEL_TEMPERATURE = float(os.getenv("SERVER_TEMPERATURE", "0.6"))
+MODEL_CACHE = os.getenv("SERVER_LLM_CACHE", "0") == "1"
+# Bearer token for POST /transactions; the endpoint is off while it is empty
+INGEST_TOKEN = os.getenv("SERVER_INGEST_TOKEN", "")
+
+
+class AgentApp:
+    """
+    What one worker serves from: the Agent and the handlers behind each endpoint.
+    """
+    def __init__(self, model_name: str = DEFAULT_MODEL):
+        from agent import Agent
+        from model import Model
+        from vector_store import VectorStore
+
+        self.model_name = model_name
+        self.agent = Agent(
+            Model(),
+            VectorStore(),
+            model_config={model_name: {"temperature": MODEL_TEMPERATURE, "cache": MODEL_CACHE}}
+        )
+        self.started = time.time()
+
+    def preload(self):
+        """
+        Loads the embedding model and opens the database before the worker takes traffic.
+        """
+        from db import get_pool
+        from encoder import get_encoder
+
+        start = time.perf_counter()
+        get_encoder().warm_up()
+        with get_pool(self.agent.db_path).connection() as conn:
+            conn.execute("SELECT 1 FROM transactions LIMIT 1").fetchall()
+        logger.info("Worker %s preloaded in %.1f s", os.getpid(), time.perf_counter() - start)
+
+    def chat(self, body: dict) -> tuple[int, dict]:
+        if not body.get("query") or body.get("client_id") is None:
+            return 400, {"error": "`query` and `client_id` are required"}
+        try:
+            today = date.fromisoformat(body["today"]) if body.get("today") else date.today()
+        except ValueError:
+            return 400, {"error": "`today` must be YYYY-MM-DD"}
+        response = self.agent.chat(
+            body["query"],
+            body["client_id"],
+            today,
+            body.get("messages") or [],
+            model_name=body.get("model") or self.model_name
+        )
+        chart = response["chart"]
+        return 200, {"content": response["content"], "chart": json.loads(chart.to_json()) if chart is not None else None}
+
+    def query(self, body: dict) -> tuple[int, dict]:
+        if body.get("client_id") is None:
+            return 400, {"error": "`client_id` is required"}
+        try:
+            result = self.agent.tools["query_sql"](**body)
+        except (TypeError, ValueError) as e:
+            # Unknown arguments, or values build_query rejects (aggregation, direction, group_by)
+            return 400, {"error": str(e)}
+        return (400 if "error" in result else 200), result
+
+    def transactions(self, body: dict) -> tuple[int, dict]:
+        from ingest import Ingestor
+
+        transactions = body.get("transactions")
+        if not isinstance(transactions, list) or not all(isinstance(t, dict) for t in transactions):
+            return 400, {"error": "`transactions` must be a list of objects"}
+        try:
+            return 200, Ingestor(self.agent.vector_store).ingest(transactions)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+    def health(self) -> tuple[int, dict]:
+        return 200, {"status": "ok", "pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1)}
+
+
+class AgentHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded server for one worker. Connections are spread across workers by SO_REUSEPORT.
+    Request threads are joined on shutdown, so in-flight requests finish.
+    """
+    allow_reuse_port = True
+    daemon_threads = False
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple[str, int], app: AgentApp):
+        super().__init__(address, AgentRequestHandler)
+        self.app = app
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self.respond(*self.server.app.health())
+        elif self.path.rstrip("/") == "/metrics":
+            import tracing
+
+            self.send_body(200, tracing.render_metrics().encode(), "text/plain; version=0.0.4")
+        else:
+            self.respond(404, {"error": "Not found"})
+
+    def do_POST(self):
+        routes = {
+            "/chat": self.server.app.chat,
+            "/query": self.server.app.query,
+            "/transactions": self.server.app.transactions,
+        }
+        handler = routes.get(self.path.rstrip("/"))
+        if handler is None:
+            self.respond(404, {"error": "Not found"})
+            return
+        if handler == self.server.app.transactions:
+            if not INGEST_TOKEN:
+                self.respond(403, {"error": "Ingestion is disabled; set SERVER_INGEST_TOKEN to enable it"})
+                return
+            if not hmac.compare_digest(self.headers.get("Authorization", "").encode(), f"Bearer {INGEST_TOKEN}".encode()):
+                self.respond(401, {"error": "Invalid or missing ingest token"})
+                return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.respond(400, {"error": "Body must be JSON"})
+            return
+        if not isinstance(body, dict):
+            self.respond(400, {"error": "Body must be a JSON object"})
+            return
+        try:
+            self.respond(*handler(body))
+        except Exception as e:
+            logger.exception("%s failed", self.path)
+            self.respond(500, {"error": str(e)})
+
+    def respond(self, status: int, payload: dict):
+        self.send_body(status, json.dumps(payload, default=str).encode(), "application/json")
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def run_worker(host: str, port: int, model_name: str = DEFAULT_MODEL):
+    """
+    Preloads, then binds and serves until SIGTERM/SIGINT, finishing in-flight requests.
+    """
+    app = AgentApp(model_name)
+    app.preload()
+    server = AgentHTTPServer((host, port), app)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so it cannot run on the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Worker %s listening on http://%s:%s", os.getpid(), host, server.server_address[1])
+    server.serve_forever()
+    server.server_close()
+
+
+def serve(host: str, port: int, workers: int, model_name: str = DEFAULT_MODEL):
+    """
+    Forks `workers` processes that each run `run_worker`. Nothing heavy is imported before the
+    fork, so every worker loads its own model and connections. Signals are passed on to the workers.
+    """
+    if workers <= 1:
+        run_worker(host, port, model_name)
+        return
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(host, port, model_name)
+            except BaseException:
+                logger.exception("Worker %s failed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", "1")))
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model for /chat requests that do not name one")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    serve(args.host, args.port, args.workers, args.model)
+
+
+if __name__ == "__main__":
+    main()
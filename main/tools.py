@@ -1,3 +1,24 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+# Monotonic time after which the running statement is interrupted, set by `query_deadline`
+_query_deadline = contextvars.ContextVar("query_deadline", default=None)
+
+
+@contextmanager
+def query_deadline(seconds: float = None):
+    """
+    Interrupts the SQLite statements run in this context once `seconds` have passed, so a slow
+    query gives its connection and thread back instead of running on. None sets no limit.
+    """
+    token = _query_deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _query_deadline.reset(token)
+
+
 def query_sql(
         client_id: int,
         start_date: str = None,
@@ -13,81 +34,74 @@ def query_sql(
     """
     Builds query from the given parameters and query the database to return the results.
     """
-    allowed_columns = {
-        "bank_id", "acc_id", "txn_id", "txn_date", "desc", "amt", "cat", "merchant"
-    }
-
-    aggregations = {
-        "sum": "SUM(amt)",
-        "count": "COUNT(*)",
-        "avg": "AVG(amt)",
-        "max": "MAX(amt)",
-        "min": "MIN(amt)"
-    }
-
-    if aggregation not in aggregations:
-        raise ValueError("Invalid aggregation type")
-
-    where_clauses = [f"clnt_id = {client_id}"]
-
-    if start_date:
-        where_clauses.append(f"txn_date >= '{start_date}'")
-    if end_date:
-        where_clauses.append(f"txn_date <= '{end_date}'")
-    if direction:
-        if direction.lower() == "spend":
-            where_clauses.append("amt < 0")
-        elif direction.lower() == "income":
-            where_clauses.append("amt > 0")
-        elif direction.lower() == "both":
-            pass
-        else:
-            raise ValueError("Invalid direction: must be 'spend', 'income', or 'both'")
-
-    if category:
-        where_clauses.append(f"cat = '{category}'")
-    if merchants and isinstance(merchants, list) and len(merchants) > 0:
-        formatted = ', '.join([f'"{m.lower()}"' for m in merchants])
-        where_clauses.append(f'LOWER("merchant") IN ({formatted})')
-    if descriptions and isinstance(descriptions, list) and len(descriptions) > 0:
-        desc_clauses = [f'LOWER("desc") LIKE \'%{d.lower()}%\'' for d in descriptions]
-        where_clauses.append("(" + " OR ".join(desc_clauses) + ")")
-
-    where_clause = " AND ".join(where_clauses)
-
-    group_clause = ""
-    select_fields = aggregations[aggregation]
-    if group_by and isinstance(group_by, list) and len(group_by) > 0:
-        group_clean = [col for col in group_by if col in allowed_columns]
-        if not group_clean:
-            raise ValueError("Invalid group by column(s)")
-        group_clause = f" GROUP BY {', '.join(group_clean)}"
-        select_fields = ', '.join(group_clean + [aggregations[aggregation]])
-
-    sql_query = f"SELECT {select_fields} FROM transactions WHERE {where_clause}{group_clause}"
-    if limit and isinstance(limit, int) and limit > 0:
-        sql_query += f" LIMIT {limit}"
-
-    return run_sql_query(sql_query)
-
-
-def run_sql_query(query: str, db_path: str = "data/transactions.db") -> dict:
+    from columnar import columnar_cache
+    from db import get_pool
+    from query_builder import build_query
+    from result_cache import cache_key, normalize_args, query_cache
+
+    args = normalize_args({
+        "client_id": client_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "aggregation": aggregation,
+        "direction": direction,
+        "category": category,
+        "merchants": merchants,
+        "descriptions": descriptions,
+        "group_by": group_by,
+        "limit": limit
+    })
+
+    pool = get_pool()
+    use_cache = query_cache.max_entries > 0
+    version = pool.data_version() if use_cache or columnar_cache.enabled else None
+    if use_cache:
+        key = cache_key(args)
+        cached = query_cache.get(key, version)
+        if cached is not None:
+            return {"rows": [dict(row) for row in cached["rows"]]}
+
+    sql_query, params = build_query(
+        **args,
+        schema_version=pool.user_version,
+        fts_tokenizer=pool.fts_tokenizer,
+        integer_amounts=pool.integer_amounts
+    )
+
+    # Served from the client's in-memory columns when enabled and exact, otherwise by SQLite
+    result = columnar_cache.execute(args, pool, version) if columnar_cache.enabled else None
+    if result is None:
+        result = run_sql_query(sql_query, params=params)
+    if use_cache and "error" not in result:
+        query_cache.put(key, version, {"rows": [dict(row) for row in result["rows"]]})
+    return result
+
+
+def run_sql_query(query: str, db_path: str = None, params: tuple = ()) -> dict:
     """
     Runs the given SQL query on the database and returns the results.
     """
+    deadline = _query_deadline.get()
     try:
-        import os
         import sqlite3
-        root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        full_db_path = os.path.join(root_dir, db_path)
-
-        conn = sqlite3.connect(full_db_path)
-        conn.row_factory = sqlite3.Row
-        cur = conn.execute(query)
-        rows = [dict(r) for r in cur.fetchall()]
+        from db import DEFAULT_DB, get_pool
+
+        with get_pool(db_path or DEFAULT_DB).connection() as conn:
+            if deadline is not None:
+                # SQLite calls this every 1000 VM instructions; True aborts with "interrupted"
+                conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+            try:
+                cur = conn.execute(query, params)
+                cur.row_factory = sqlite3.Row
+                rows = [dict(r) for r in cur.fetchall()]
+            finally:
+                if deadline is not None:
+                    conn.set_progress_handler(None, 1000)
         return {"rows": rows}
     except Exception as e:
-        return {"error": str(e), "query": query}
+        if deadline is not None and time.monotonic() > deadline:
+            return {"error": "Query timed out", "query": query, "params": list(params)}
+        return {"error": str(e), "query": query, "params": list(params)}
 
 
 def visualize_data(data: dict, chart_type: str, x: str, y: str, title: str = ""):
@@ -0,0 +1,227 @@
+"""
+Lightweight spans for the chat pipeline. With TRACING=1 every span records its duration and
+attributes (row counts, token usage), is appended to TRACE_FILE as one JSON line and feeds
+the Prometheus-style metrics from `render_metrics`. With tracing off, `span` returns a shared
+no-op object, so an instrumented call costs one flag check.
+
+    with tracing.span("llm_call", model=model_name) as s:
+        response = ...
+        s.set(prompt_tokens=response.usage.prompt_tokens)
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import resolve_repo_path
+
+ENABLED = os.getenv("TRACING", "0") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Numeric span attributes summed into agent_span_attribute_total
+COUNTED_ATTRIBUTES = ("rows", "matches", "merchants", "keywords", "prompt_tokens", "completion_tokens", "hit", "routed")
+# Upper bounds (seconds) of the duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    One timed stage. Nested spans share the trace id of the outermost one.
+    """
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = None
+        self.trace_id = None
+        self.start = None
+        self.error = None
+        self._token = None
+        self._begin = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.trace_id = self.parent.trace_id if self.parent else uuid.uuid4().hex
+        self.start = time.time()
+        self._begin = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._begin
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Exited in another context (a generator finished elsewhere); nothing to restore
+            pass
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        recorder.record(self, duration)
+        return False
+
+    def to_dict(self, duration: float) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def span(name: str, **attributes):
+    """
+    Context manager timing one stage; the no-op span when tracing is off.
+    """
+    if not ENABLED:
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the innermost open span, if any.
+    """
+    if ENABLED:
+        current = _current.get()
+        if current is not None:
+            current.set(**attributes)
+
+
+def bind(fn):
+    """
+    `fn` bound to the current span context, for work handed to another thread's executor.
+    """
+    if not ENABLED:
+        return fn
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return run
+
+
+class Recorder:
+    """
+    Aggregates finished spans into per-name histograms and attribute totals, and appends
+    them to the JSONL file.
+    """
+    def __init__(self, path: str = ""):
+        self.path = resolve_repo_path(path) if path else ""
+        self._lock = threading.Lock()
+        self._file = None
+        self.metrics = {}
+
+    def record(self, span: Span, duration: float):
+        with self._lock:
+            metric = self.metrics.get(span.name)
+            if metric is None:
+                metric = self.metrics[span.name] = {
+                    "count": 0, "errors": 0, "seconds": 0.0, "buckets": [0] * len(BUCKETS), "totals": {}
+                }
+            metric["count"] += 1
+            metric["seconds"] += duration
+            metric["errors"] += span.error is not None or "error" in span.attributes
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    metric["buckets"][i] += 1
+            for key in COUNTED_ATTRIBUTES:
+                value = span.attributes.get(key)
+                if isinstance(value, (int, float)):
+                    metric["totals"][key] = metric["totals"].get(key, 0) + value
+            if self.path:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self._file = open(self.path, "a", buffering=1)
+                self._file.write(json.dumps(span.to_dict(duration), default=str) + "\n")
+
+    def reset(self):
+        with self._lock:
+            self.metrics.clear()
+
+
+recorder = Recorder(TRACE_FILE)
+
+
+def render_metrics() -> str:
+    """
+    Prometheus text exposition of the span metrics.
+    """
+    lines = [
+        "# HELP agent_span_duration_seconds Duration of pipeline stages.",
+        "# TYPE agent_span_duration_seconds histogram",
+    ]
+    with recorder._lock:
+        metrics = {name: {**metric, "totals": dict(metric["totals"])} for name, metric in recorder.metrics.items()}
+    for name, metric in sorted(metrics.items()):
+        for bound, count in zip(BUCKETS, metric["buckets"]):
+            lines.append(f'agent_span_duration_seconds_bucket{{span="{name}",le="{bound:g}"}} {count}')
+        lines.append(f'agent_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {metric["count"]}')
+        lines.append(f'agent_span_duration_seconds_sum{{span="{name}"}} {metric["seconds"]:.6f}')
+        lines.append(f'agent_span_duration_seconds_count{{span="{name}"}} {metric["count"]}')
+    lines += ["# HELP agent_span_errors_total Stages that raised or reported an error.", "# TYPE agent_span_errors_total counter"]
+    for name, metric in sorted(metrics.items()):
+        lines.append(f'agent_span_errors_total{{span="{name}"}} {metric["errors"]}')
+    lines += [
+        "# HELP agent_span_attribute_total Rows, matches, tokens and cache hits summed over spans.",
+        "# TYPE agent_span_attribute_total counter",
+    ]
+    for name, metric in sorted(metrics.items()):
+        for key, value in sorted(metric["totals"].items()):
+            lines.append(f'agent_span_attribute_total{{span="{name}",attribute="{key}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_metrics_server = None
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """
+    Serves GET /metrics on a daemon thread, once per process (for the Streamlit app, which has no API server).
+    """
+    global _metrics_server
+    if _metrics_server is None:
+        _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        _metrics_server.daemon_threads = True
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+    return _metrics_server
@@ -1,6 +1,7 @@
 import os
 import re
-import sqlite3
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 STOPWORDS = set([
         'i', 'my', 'you', 'we', 'me', 'this', 'that', 'there', 'here', 'where', 'when', 'how', 'why', 'all', 'any', 'some', 'much', 'each',
@@ -13,6 +14,14 @@ STOPWORDS = set([
         'spend', 'pay', 'paid', 'show', 'summarize', 'describe', 'please', 'can', 'could', 'will', 'would', 'shall'
     ])
 
+def resolve_repo_path(path: str) -> str:
+    """
+    Resolves a path relative to the repository root; absolute paths are returned unchanged.
+    """
+    if os.path.isabs(path):
+        return path
+    return os.path.join(ROOT_DIR, path)
+
 def remove_stopwords(text):
     cleaned = re.sub(r'[^a-z\s]', '', text.lower())
     words = cleaned.split()
@@ -22,17 +31,21 @@ def clean_text(text):
     cleaned = text.lower()
     return re.sub(r'[^a-z\s]', '', cleaned)
 
+def clean_text_series(series):
+    """
+    Vectorized `clean_text` over a pandas Series; missing values become empty strings.
+    """
+    return series.fillna('').astype(str).str.lower().str.replace(r'[^a-z\s]', '', regex=True)
+
+
+def is_valid_client_id(client_id: int, db_name: str = None):
+    # Imported here because db imports this module
+    from db import DEFAULT_DB, get_pool
 
-def is_valid_client_id(client_id: int, db_name: str = "data/transactions.db"):
     try:
-        root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        db_path = os.path.join(root_dir, db_name)
-
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT EXISTS(SELECT 1 FROM transactions WHERE clnt_id = ? LIMIT 1)", (client_id,))
-        exists = cur.fetchone()[0]
-        conn.close()
+        with get_pool(db_name or DEFAULT_DB).connection() as conn:
+            cur = conn.execute("SELECT EXISTS(SELECT 1 FROM transactions WHERE clnt_id = ? LIMIT 1)", (client_id,))
+            exists = cur.fetchone()[0]
 
         if exists:
             return True
@@ -1,99 +1,383 @@
 import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-import sqlite3
-from sentence_transformers import SentenceTransformer
-import chromadb
 from more_itertools import batched
-from utils import clean_text, remove_stopwords
+from db import DEFAULT_DB, get_pool, resolve_db_path
+from embedding_cache import EmbeddingCache
+from encoder import get_encoder
+from merchant_index import get_merchant_index
+from partitions import DEFAULT_BUCKETS, CollectionRouter, chroma_client, read_layout, write_layout
+from retrievers import make_retriever
+import tracing
+from utils import clean_text, clean_text_series, remove_stopwords, resolve_repo_path
+
+
+def transaction_metadatas(client_ids: list, merchants: list, descriptions: list) -> list[dict]:
+    """
+    Chroma metadata for each vector: the client it belongs to plus the merchant and cleaned
+    description the prompt needs, so retrieval does not have to go back to SQLite.
+    """
+    return [
+        {"client_id": clnt, "merchant": merchant or "", "desc": desc or ""}
+        for clnt, merchant, desc in zip(client_ids, merchants, descriptions)
+    ]
+
+
+def merchants_and_keywords(merchants: list[str], descriptions: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Deduplicated, lowercased merchants and description keywords from matches given closest first.
+    Each is ranked by its reciprocal-rank score summed over the matches it appears in.
+    """
+    merchant_scores = {}
+    keyword_scores = {}
+    for rank, (merchant, desc) in enumerate(zip(merchants, descriptions)):
+        weight = 1 / (rank + 1)
+        name = (merchant or "").lower().strip()
+        if name:
+            merchant_scores[name] = merchant_scores.get(name, 0) + weight
+        for keyword in set((desc or "").lower().split()):
+            keyword_scores[keyword] = keyword_scores.get(keyword, 0) + weight
+    # sorted is stable, so ties keep first-seen order
+    ranked_merchants = sorted(merchant_scores, key=lambda name: -merchant_scores[name])
+    ranked_keywords = sorted(keyword_scores, key=lambda keyword: -keyword_scores[keyword])
+    return ranked_merchants, ranked_keywords
+
+
+def distinct_matches(matches: dict, top_k: int) -> dict:
+    """
+    The first `top_k` matches with distinct (merchant, desc) metadata, closest first. Rows
+    repeating a transaction text have identical vectors, so without this a frequent text could fill
+    every slot. Matches without that metadata are kept as they are.
+    """
+    seen = set()
+    ids, metadatas = [], []
+    for uid, meta in zip(matches["ids"], matches["metadatas"]):
+        if meta and "merchant" in meta:
+            text = (meta["merchant"], meta.get("desc", ""))
+            if text in seen:
+                continue
+            seen.add(text)
+        ids.append(uid)
+        metadatas.append(meta)
+        if len(ids) == top_k:
+            break
+    return {"ids": ids, "metadatas": metadatas}
+
+
+# Matches fetched per wanted distinct match; grown while duplicates crowd out distinct texts
+MATCH_OVERFETCH = 4
+MAX_MATCH_OVERFETCH = 64
 
 
 class VectorStore:
     def __init__(
             self, 
-            db_path: str = "data/transactions.db",
+            db_path: str = DEFAULT_DB,
             persist_dir: str = "data/chroma_store", 
             collection_name: str = "transactions",
+            embedding_cache_dir: str = "data/embedding_cache",
+            embedding_dtype: str = "float32",
+            use_merchant_index: bool = True,
+            partition_mode: str = None,
+            partition_buckets: int = None,
+            retriever: str = None,
+            client_vectors_dir: str = "data/client_vectors",
         ):
-        root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-        self.db_path = os.path.join(root_dir, db_path)
-        self.persist_dir = os.path.join(root_dir, persist_dir)
+        self.db_path = resolve_db_path(db_path)
+        self.persist_dir = resolve_repo_path(persist_dir)
 
-        self.client = chromadb.PersistentClient(path=self.persist_dir)
-        self.collection = self.client.get_or_create_collection(collection_name)
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        self.client = chroma_client(self.persist_dir)
+        # An explicit mode wins, then the layout recorded by a partitioned load or migration. A
+        # collection built without a layout record is a single one; the setting is for new stores
+        layout = read_layout(self.persist_dir, collection_name) or {}
+        if not layout and collection_name in {collection.name for collection in self.client.list_collections()}:
+            layout = {"mode": "single"}
+        self.partition_mode = partition_mode or layout.get("mode") or os.getenv("VECTOR_PARTITION_MODE", "single")
+        self.partition_buckets = partition_buckets or layout.get("buckets") or int(os.getenv("VECTOR_PARTITION_BUCKETS", str(DEFAULT_BUCKETS)))
+        self.router = CollectionRouter(
+            self.client,
+            collection_name,
+            self.partition_mode,
+            self.partition_buckets,
+            max_open=int(os.getenv("VECTOR_OPEN_PARTITIONS", "128"))
+        )
+        # Partitioned layouts have no single collection; every access goes through the router
+        self.collection = self.router.collection_for() if self.partition_mode == "single" else None
+        self.retriever = make_retriever(
+            retriever or os.getenv("VECTOR_RETRIEVER", "auto"),
+            self.db_path,
+            self.router,
+            client_vectors_dir
+        )
+        self.encoder = get_encoder()
+        self.embedding_cache_dir = embedding_cache_dir
+        self.embedding_dtype = embedding_dtype
+        self._embedding_cache = None
+        self.use_merchant_index = use_merchant_index
+
+    @property
+    def model(self):
+        return self.encoder.model
+
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        if self._embedding_cache is None:
+            self._embedding_cache = EmbeddingCache(
+                self.embedding_cache_dir, self.encoder.model_name, self.embedding_dtype, self.encoder.backend
+            )
+        return self._embedding_cache
+
+    def encode_texts(self, texts: list[str], batch_size: int = 1024) -> np.ndarray:
+        """
+        Embeds texts through the embedding cache, encoding only texts it has not seen.
+        """
+        vectors, _ = self.embedding_cache.encode(
+            texts,
+            self.encoder.encode,
+            batch_size=batch_size
+        )
+        return vectors
     
-    def load_data(self, file_path: str, embeddings_path: str = "data/embeddings.npy"):
+    def record_layout(self):
+        """
+        Records a partitioned layout next to the collections so later stores open it the same way,
+        and drops the retriever's copies of the old vectors.
+        """
+        self.retriever.invalidate()
+        if self.partition_mode != "single":
+            write_layout(self.persist_dir, self.router.base_name, self.partition_mode, self.partition_buckets)
+
+    def load_data(self, file_path: str):
         """
-        Load data from a CSV file into a ChromaDB collection.
+        Load data from a CSV file into a ChromaDB collection, one vector per transaction.
+        Embeddings come from the content-hashed embedding cache, so each distinct text is encoded
+        once, rows repeating a text reuse its vector, and a reload only encodes new or changed texts.
         """
         df = pd.read_csv(file_path)
         df["uid"] = df.index
         df['merchant'] = df.merchant.fillna('')
         df['desc'] = df.desc.fillna('')
         df['combined'] = df.apply(lambda row: clean_text(row["desc"]) + " " + clean_text(row["merchant"]), axis=1)
-        df = df.drop_duplicates(subset=['combined'])
         texts = df['combined'].tolist()
         ids = df['uid'].astype(str).tolist()
-        metadatas = [{"client_id": clnt} for clnt in df["clnt_id"]]
+        metadatas = transaction_metadatas(
+            df["clnt_id"].tolist(), df["merchant"].tolist(), df["desc"].apply(clean_text).tolist()
+        )
+
+        vectors = self.encode_texts(texts).tolist()
 
-        if os.path.exists(embeddings_path):
-            vectors = np.load(embeddings_path)
-        else:
-            vectors = self.model.encode(texts, normalize_embeddings=True, show_progress_bar=True).tolist()
-            np.save(embeddings_path, vectors)
-        
         for batch in batched(zip(ids, texts, vectors, metadatas), 500):
             b_ids, b_docs, b_vecs, b_meta = zip(*batch)
-            self.collection.add(
-                ids=list(b_ids),
-                documents=list(b_docs),
-                embeddings=list(b_vecs),
-                metadatas=list(b_meta)
-            )
+            self.router.add(list(b_ids), list(b_docs), list(b_vecs), list(b_meta))
+        self.record_layout()
 
-    def get_vector_matched_uids(self, query: str, client_id: int, top_k: int = 100) -> list[int]:
+    def load_data_stream(
+            self,
+            file_path: str,
+            chunk_size: int = 50_000,
+            encode_batch_size: int = 1024,
+            add_batch_size: int = 500,
+        ) -> dict:
         """
-        Get the uids of the transactions that match the query.
+        Streams a CSV into the ChromaDB collection without holding the whole file in memory.
+        The CSV is read in chunks and cleaned with vectorized string operations; each encoded batch
+        is added to Chroma on a background thread while the next batch is being encoded.
+        Every row gets a vector, but only texts missing from the embedding cache are encoded.
+        At most one chunk and two encoded batches are alive at a time. Returns rows/sec per stage.
         """
-        
-        vector = self.model.encode([query], normalize_embeddings=True).tolist()
+        timings = {"read": 0.0, "clean": 0.0, "encode": 0.0, "add": 0.0}
+        counts = {"rows": 0, "encoded": 0}
 
-        result = self.collection.query(
-            query_embeddings=vector,
-            n_results=top_k,
-            where={"client_id": client_id},
-            include=["documents"]
-        )
+        def add(ids, texts, vectors, metadatas):
+            start = time.perf_counter()
+            for batch in batched(zip(ids, texts, vectors, metadatas), add_batch_size):
+                b_ids, b_docs, b_vecs, b_meta = zip(*batch)
+                self.router.add(list(b_ids), list(b_docs), list(b_vecs), list(b_meta))
+            timings["add"] += time.perf_counter() - start
+
+        total_start = time.perf_counter()
+        pending = None
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            reader = pd.read_csv(file_path, chunksize=chunk_size, usecols=["clnt_id", "desc", "merchant"])
+            while True:
+                start = time.perf_counter()
+                chunk = next(reader, None)
+                timings["read"] += time.perf_counter() - start
+                if chunk is None:
+                    break
+                counts["rows"] += len(chunk)
+
+                start = time.perf_counter()
+                # The reader keeps a running index across chunks, so uids match load_data
+                chunk["uid"] = chunk.index
+                chunk["desc_clean"] = clean_text_series(chunk["desc"])
+                chunk["merchant"] = chunk["merchant"].fillna("").astype(str)
+                chunk["combined"] = chunk["desc_clean"] + " " + clean_text_series(chunk["merchant"])
+                timings["clean"] += time.perf_counter() - start
+
+                for offset in range(0, len(chunk), encode_batch_size):
+                    batch = chunk.iloc[offset:offset + encode_batch_size]
+                    texts = batch["combined"].tolist()
 
-        return list(map(int, result["ids"][0]))
+                    start = time.perf_counter()
+                    vectors, encoded = self.embedding_cache.encode(texts, self.encoder.encode, batch_size=encode_batch_size)
+                    vectors = vectors.tolist()
+                    timings["encode"] += time.perf_counter() - start
+                    counts["encoded"] += encoded
+
+                    if pending is not None:
+                        pending.result()
+                    pending = executor.submit(
+                        add,
+                        batch["uid"].astype(str).tolist(),
+                        texts,
+                        vectors,
+                        transaction_metadatas(
+                            batch["clnt_id"].tolist(), batch["merchant"].tolist(), batch["desc_clean"].tolist()
+                        )
+                    )
+            if pending is not None:
+                pending.result()
+        self.record_layout()
+        total = time.perf_counter() - total_start
+
+        report = {
+            "rows": counts["rows"],
+            "encoded_texts": counts["encoded"],
+            "seconds": total,
+            "rows_per_sec": counts["rows"] / total if total else 0.0,
+        }
+        for stage, seconds in timings.items():
+            rows = counts["encoded"] if stage == "encode" else counts["rows"]
+            report[f"{stage}_seconds"] = seconds
+            report[f"{stage}_rows_per_sec"] = rows / seconds if seconds else 0.0
+        return report
+
+    def upsert_transactions(
+            self,
+            uids: list[int],
+            client_ids: list[int],
+            descriptions: list[str],
+            merchants: list[str],
+            encode_batch_size: int = 1024,
+            add_batch_size: int = 500,
+        ) -> dict:
+        """
+        Writes one vector per transaction, keyed by uid, so re-sending a row replaces its vector.
+        Only texts the embedding cache has not seen are encoded. The retriever's copies of the
+        clients' vectors are left to the caller to drop (`retriever.invalidate`) once the rows
+        are committed. Returns how many texts were encoded and the seconds per stage.
+        """
+        descriptions = [clean_text(desc or "") for desc in descriptions]
+        merchants = [merchant or "" for merchant in merchants]
+        texts = [desc + " " + clean_text(merchant) for desc, merchant in zip(descriptions, merchants)]
+
+        start = time.perf_counter()
+        vectors, encoded = self.embedding_cache.encode(texts, self.encoder.encode, batch_size=encode_batch_size)
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        metadatas = transaction_metadatas(client_ids, merchants, descriptions)
+        for batch in batched(zip(map(str, uids), texts, vectors.tolist(), metadatas), add_batch_size):
+            b_ids, b_docs, b_vecs, b_meta = zip(*batch)
+            self.router.add(list(b_ids), list(b_docs), list(b_vecs), list(b_meta), upsert=True)
+        upsert_seconds = time.perf_counter() - start
+        return {"encoded_texts": encoded, "encode_seconds": encode_seconds, "upsert_seconds": upsert_seconds}
+
+    def delete_transactions(self, uids: list[int], client_ids: list[int], batch_size: int = 500):
+        """
+        Deletes the vectors of the given transactions, e.g. of rows whose insert was rolled back.
+        """
+        for batch in batched(zip(map(str, uids), client_ids), batch_size):
+            b_ids, b_clients = zip(*batch)
+            self.router.delete(list(b_ids), list(b_clients))
+
+    def get_vector_matches(self, query: str, client_id: int, top_k: int = 100) -> dict:
+        """
+        Searches the client's vectors and returns the ids and metadatas of the nearest
+        transactions, closest first.
+        """
+        return self.get_vector_matches_batch([query], client_id, top_k)[0]
+
+    def get_vector_matches_batch(self, queries: list[str], client_id: int, top_k: int = 100) -> list[dict]:
+        """
+        Searches the client's vectors for several queries in one retriever call.
+        """
+        with tracing.span("encode_query", queries=len(queries)):
+            vectors = [self.encoder.encode_query(query) for query in queries]
+        with tracing.span("vector_query", retriever=self.retriever.name, top_k=top_k) as span:
+            results = self.retriever.search(client_id, vectors, top_k)
+            span.set(matches=sum(len(result["ids"]) for result in results))
+        return results
+
+    def get_vector_matched_uids(self, query: str, client_id: int, top_k: int = 100) -> list[int]:
+        """
+        Get the uids of the transactions that match the query.
+        """
+        return list(map(int, self.get_vector_matches(query, client_id, top_k)["ids"]))
     
-    def get_unique_merchants_and_descriptions(self, query: str, client_id: int, top_k: int = 100) -> tuple[list[str], set[str]]:
+    def get_unique_merchants_and_descriptions(self, query: str, client_id: int, top_k: int = 100) -> tuple[list[str], list[str]]:
         """
-        Returns a list of unique merchants and descriptions keywords from the transactions that match the query.
+        Returns unique merchants and description keywords from the `top_k` closest distinct
+        transaction texts, most relevant first.
         """
         query = remove_stopwords(query)
-        uids = self.get_vector_matched_uids(query, client_id, top_k)
-        if not uids:
-            return {"merchants": [], "descriptions": []}
+        # An exact or fuzzy hit in the client's own vocabulary is enough for the prompt
+        if self.use_merchant_index:
+            with tracing.span("merchant_index") as span:
+                matched = get_merchant_index(self.db_path).lookup(client_id, query)
+                span.set(hit=matched is not None)
+            if matched is not None:
+                return matched
 
-        placeholders = ",".join("?" for _ in uids)
-        conn = sqlite3.connect(self.db_path)
+        fetch = top_k * MATCH_OVERFETCH
+        while True:
+            found = self.get_vector_matches(query, client_id, fetch)
+            matches = distinct_matches(found, top_k)
+            if len(matches["ids"]) >= top_k or len(found["ids"]) < fetch or fetch >= top_k * MAX_MATCH_OVERFETCH:
+                break
+            fetch *= MATCH_OVERFETCH
+        if not matches["ids"]:
+            return [], []
 
-        query = f"""
-            SELECT desc, merchant
+        metadatas = matches["metadatas"]
+        if all(meta and "merchant" in meta for meta in metadatas):
+            return merchants_and_keywords(
+                [meta["merchant"] for meta in metadatas],
+                [meta["desc"] for meta in metadatas]
+            )
+
+        # Collections built before merchant/desc were stored as metadata
+        return self.lookup_merchants_and_descriptions(list(map(int, matches["ids"])))
+
+    def lookup_merchants_and_descriptions(self, uids: list[int]) -> tuple[list[str], list[str]]:
+        """
+        Fetches merchant and description keywords for the given uids (closest first) from SQLite.
+        """
+        # A single fixed statement text keeps the prepared statement cached on the pooled connection
+        query = """
+            SELECT uid, desc, merchant
             FROM transactions
-            WHERE uid IN ({placeholders})
+            WHERE uid IN (SELECT value FROM json_each(?))
         """
-        df = pd.read_sql_query(query, conn, params=uids)
-        conn.close()
+        with tracing.span("sqlite_lookup") as span, get_pool(self.db_path).connection() as conn:
+            df = pd.read_sql_query(query, conn, params=(json.dumps(uids),))
+            span.set(rows=len(df))
 
-        merchants = df["merchant"].dropna().str.lower().str.strip().unique().tolist()
-        descriptions = df["desc"].dropna().apply(clean_text).str.lower().str.strip().unique().tolist()
-        description_keywords = set((" ".join(descriptions)).split())
-
-        return merchants, description_keywords
+        rank = {uid: i for i, uid in enumerate(uids)}
+        df = df.assign(rank=df["uid"].map(rank)).sort_values("rank")
+        return merchants_and_keywords(
+            df["merchant"].fillna("").tolist(),
+            df["desc"].fillna("").apply(clean_text).tolist()
+        )
 
     def clear_collection(self):
-        self.collection.delete()
+        self.retriever.invalidate()
+        if self.partition_mode == "single":
+            self.collection.delete()
+        else:
+            self.router.drop()
 
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The application modules live in main/ and import each other by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main"))
+
+from benchmarks.synthetic import make_transactions_db  # noqa: E402
+from migrate import migrate  # noqa: E402
+
+# Rows with a NULL amount and a NULL merchant, which every path must treat like SQLite does
+EDGE_ROWS = [
+    (1, 1, 10, 9001, "2023-05-04", "REFUND", None, "Travel", "Uber"),
+    (1, 1, 10, 9002, "2023-05-04", "CASH", 0, "Travel", None),
+]
+
+
+def insert_rows(path: str, rows: list):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO transactions (clnt_id, bank_id, acc_id, txn_id, txn_date, desc, amt, cat, merchant) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(params=["REAL", "INTEGER"])
+def transactions_db(request, tmp_path):
+    """
+    Migrated synthetic database with `amt` of the given type (INTEGER amounts are in cents).
+    Returns its path and whether the amounts are integers.
+    """
+    path = str(tmp_path / "transactions.db")
+    make_transactions_db(path, clients=3, rows_per_client=600)
+    if request.param == "INTEGER":
+        conn = sqlite3.connect(path)
+        conn.execute("ALTER TABLE transactions RENAME TO source")
+        conn.execute(
+            "CREATE TABLE transactions (uid INTEGER PRIMARY KEY, clnt_id INTEGER, bank_id INTEGER, acc_id INTEGER, "
+            "txn_id INTEGER, txn_date TEXT, desc TEXT, amt INTEGER, cat TEXT, merchant TEXT)"
+        )
+        conn.execute(
+            "INSERT INTO transactions SELECT uid, clnt_id, bank_id, acc_id, txn_id, txn_date, desc, "
+            "CAST(ROUND(amt * 100) AS INTEGER), cat, merchant FROM source"
+        )
+        conn.execute("DROP TABLE source")
+        conn.commit()
+        conn.close()
+    insert_rows(path, EDGE_ROWS)
+    migrate(path)
+    return path, request.param == "INTEGER"
@@ -0,0 +1,42 @@
+import itertools
+
+from benchmarks.synthetic import tool_call_args
+from columnar import ColumnarCache
+from db import get_pool
+from query_builder import AGGREGATIONS, build_query
+from result_cache import normalize_args
+from rollup import typed_rows
+from tools import run_sql_query
+
+
+def arg_sets():
+    yield from tool_call_args(3, 600)
+    for aggregation, group_by in itertools.product(AGGREGATIONS, [["amt"], ["cat", "merchant"], ["merchant"]]):
+        yield {"client_id": "1", "aggregation": aggregation, "direction": "both", "group_by": group_by}
+        yield {"client_id": "2", "aggregation": aggregation, "direction": "spend", "group_by": group_by, "limit": 5}
+
+
+def test_columnar_matches_sqlite(transactions_db):
+    path, integer_amounts = transactions_db
+    pool = get_pool(path)
+    cache = ColumnarCache(enabled=True)
+    served = set()
+    for call in arg_sets():
+        args = normalize_args(call)
+        sql, params = build_query(
+            **args,
+            schema_version=pool.user_version,
+            fts_tokenizer=pool.fts_tokenizer,
+            integer_amounts=pool.integer_amounts
+        )
+        expected = run_sql_query(sql, path, params)
+        result = cache.execute(args, pool, pool.data_version())
+        if result is None:
+            continue
+        served.add(args["aggregation"])
+        assert result["rows"] == expected["rows"], args
+        # dict equality treats 3 and 3.0 alike; compare column order and value types too
+        assert [list(row) for row in result["rows"]] == [list(row) for row in expected["rows"]], args
+        assert typed_rows([list(row.values()) for row in result["rows"]]) == typed_rows(
+            [list(row.values()) for row in expected["rows"]]), args
+    assert served == (set(AGGREGATIONS) if integer_amounts else {"count", "min", "max"})
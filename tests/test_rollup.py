@@ -0,0 +1,80 @@
+import itertools
+import sqlite3
+
+import pytest
+
+from conftest import insert_rows
+from query_builder import AGGREGATIONS, NORMALIZED_COLUMNS_VERSION, ROLLUP_VERSION, build_query
+from rollup import typed_rows
+
+GROUP_BYS = [None, ["cat"], ["merchant"], ["cat", "merchant"]]
+DATE_RANGES = [
+    {},
+    {"start_date": "2023-03-01", "end_date": "2024-06-30"},
+    {"start_date": "2023-03-15", "end_date": "2024-06-10"},
+    {"end_date": "2023-12-31"},
+]
+FILTERS = {
+    "direction": ["spend", "income", "both"],
+    "category": ["Travel"],
+    "merchants": [["Uber", "lyft"]],
+}
+EXTRA_ROWS = [
+    (2, 1, 20, 9003, "05/06/2023 10:00", "POS UBER", -1234, "Travel", "UBER"),
+]
+
+
+def arg_sets():
+    for aggregation, group_by, dates in itertools.product(AGGREGATIONS, GROUP_BYS, DATE_RANGES):
+        for used in itertools.product([False, True], repeat=len(FILTERS)):
+            options = [values if on else [None] for (_, values), on in zip(FILTERS.items(), used)]
+            for values in itertools.product(*options):
+                args = dict(client_id=1, aggregation=aggregation, group_by=group_by, **dates)
+                args.update({name: value for name, value in zip(FILTERS, values) if value is not None})
+                yield args
+
+
+def assert_rollups_identical(path: str, integer_amounts: bool):
+    conn = sqlite3.connect(path)
+    routed = set()
+    for args in arg_sets():
+        raw_sql, raw_params = build_query(**args, schema_version=NORMALIZED_COLUMNS_VERSION)
+        sql, params = build_query(**args, schema_version=ROLLUP_VERSION, integer_amounts=integer_amounts)
+        if sql == raw_sql:
+            assert args["aggregation"] in ("sum", "avg") and not integer_amounts
+            continue
+        routed.add(args["aggregation"])
+        raw = conn.execute(raw_sql, raw_params).fetchall()
+        rolled = conn.execute(sql, params).fetchall()
+        assert typed_rows(rolled) == typed_rows(raw), args
+    conn.close()
+    return routed
+
+
+def test_rollups_match_raw_query(transactions_db):
+    path, integer_amounts = transactions_db
+    routed = assert_rollups_identical(path, integer_amounts)
+    assert routed == (set(AGGREGATIONS) if integer_amounts else {"count", "min", "max"})
+
+
+def test_rollups_match_after_writes(transactions_db):
+    path, integer_amounts = transactions_db
+    insert_rows(path, EXTRA_ROWS)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE transactions SET amt = -amt WHERE clnt_id = 1 AND txn_id < 20")
+    conn.execute("DELETE FROM transactions WHERE clnt_id = 1 AND txn_id BETWEEN 20 AND 40")
+    conn.commit()
+    conn.close()
+    assert_rollups_identical(path, integer_amounts)
+
+
+def test_integer_sums_stay_integers(transactions_db):
+    path, integer_amounts = transactions_db
+    if not integer_amounts:
+        pytest.skip("REAL amounts")
+    sql, params = build_query(client_id=1, aggregation="sum", schema_version=ROLLUP_VERSION, integer_amounts=True)
+    assert "txn_rollup" in sql
+    conn = sqlite3.connect(path)
+    (total,), = conn.execute(sql, params).fetchall()
+    conn.close()
+    assert isinstance(total, int)